@@ -1,819 +1,4597 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-from werkzeug.security import generate_password_hash, check_password_hash
-from functools import wraps
-import sqlite3
-from datetime import datetime
-import os
-
-app = Flask(__name__)
-app.secret_key = os.environ.get('SECRET_KEY', 'tu_clave_secreta_super_segura_cambiar_en_produccion')
-
-# Configuración de la base de datos
-DATABASE = 'tienda_tecnologia.db'
-
-def get_db():
-    """Obtiene una conexión a la base de datos"""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def init_db():
-    """Inicializa la base de datos con las tablas necesarias"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Tabla de usuarios
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS usuarios (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            nombre_completo TEXT NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            rol TEXT NOT NULL CHECK(rol IN ('administrador', 'asesor')),
-            activo INTEGER DEFAULT 1,
-            fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Tabla de categorías
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS categorias (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nombre TEXT UNIQUE NOT NULL,
-            descripcion TEXT,
-            activo INTEGER DEFAULT 1
-        )
-    ''')
-    
-    # Tabla de productos
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS productos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            codigo TEXT UNIQUE NOT NULL,
-            nombre TEXT NOT NULL,
-            descripcion TEXT,
-            categoria_id INTEGER,
-            marca TEXT,
-            modelo TEXT,
-            precio REAL NOT NULL,
-            stock INTEGER DEFAULT 0,
-            stock_minimo INTEGER DEFAULT 5,
-            imagen_url TEXT,
-            activo INTEGER DEFAULT 1,
-            fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (categoria_id) REFERENCES categorias (id)
-        )
-    ''')
-    
-    # Tabla de clientes
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS clientes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            documento TEXT UNIQUE NOT NULL,
-            tipo_documento TEXT NOT NULL,
-            nombre TEXT NOT NULL,
-            apellido TEXT NOT NULL,
-            email TEXT,
-            telefono TEXT,
-            direccion TEXT,
-            fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Tabla de ventas
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS ventas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            numero_venta TEXT UNIQUE NOT NULL,
-            cliente_id INTEGER,
-            usuario_id INTEGER,
-            fecha_venta TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            sdetalle   ubtotal REAL NOT NULL,
-            igv REAL NOT NULL,
-            total REAL NOT NULL,
-            estado TEXT DEFAULT 'completada',
-            metodo_pago TEXT,
-            observaciones TEXT,
-            FOREIGN KEY (cliente_id) REFERENCES clientes (id),
-            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-        )
-    ''')
-    
-    # Tabla de detalle de ventas
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS detalle_ventas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            venta_id INTEGER,
-            producto_id INTEGER,
-            cantidad INTEGER NOT NULL,
-            precio_unitario REAL NOT NULL,
-            subtotal REAL NOT NULL,
-            FOREIGN KEY (venta_id) REFERENCES ventas (id),
-            FOREIGN KEY (producto_id) REFERENCES productos (id)
-        )
-    ''')
-    
-    # Tabla de historial de stock (nueva)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS historial_stock (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            producto_id INTEGER NOT NULL,
-            usuario_id INTEGER NOT NULL,
-            cantidad_anterior INTEGER NOT NULL,
-            cantidad_nueva INTEGER NOT NULL,
-            tipo_movimiento TEXT NOT NULL,
-            motivo TEXT,
-            fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (producto_id) REFERENCES productos (id),
-            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-        )
-    ''')
-    conn.commit()
-    
-    # Crear usuario administrador por defecto
-    cursor.execute("SELECT * FROM usuarios WHERE username = 'admin'")
-    if not cursor.fetchone():
-        hash_password= generate_password_hash('admin123')
-        cursor.execute('''
-            INSERT INTO usuarios (username, password, nombre_completo, email, rol)
-            VALUES (?, ?, ?, ?, ?)
-        ''', ('admin', hash_password, 'Administrador', 'admin@gpsmanagement.com', 'administrador'))
-        
-        # Crear usuario asesor por defecto
-        hash_password_asesor = generate_password_hash('asesor123')
-        cursor.execute('''
-            INSERT INTO usuarios (username, password, nombre_completo, email, rol)
-            VALUES (?, ?, ?, ?, ?)
-        ''', ('asesor', hash_password_asesor, 'Asesor de Ventas', 'asesor@gpsmanagement.com', 'asesor'))
-        
-        conn.commit()
-    
-    # Insertar categorías de ejemplo
-    cursor.execute("SELECT COUNT(*) as count FROM categorias")
-    if cursor.fetchone()['count'] == 0:
-        categorias = [
-            ('Laptops', 'Computadoras portátiles de diferentes marcas'),
-            ('Smartphones', 'Teléfonos inteligentes'),
-            ('Tablets', 'Tabletas y iPads'),
-            ('Accesorios', 'Accesorios tecnológicos diversos'),
-            ('Componentes', 'Componentes de computadora'),
-            ('Audio', 'Audífonos, parlantes y equipos de audio'),
-            ('Gaming', 'Productos para videojuegos')
-        ]
-        cursor.executemany('INSERT INTO categorias (nombre, descripcion) VALUES (?, ?)', categorias)
-        conn.commit()
-    
-    # Insertar productos de ejemplo
-    cursor.execute("SELECT COUNT(*) as count FROM productos")
-    if cursor.fetchone()['count'] == 0:
-        productos = [
-            ('LAP001', 'Laptop HP Pavilion 15', 'Laptop con procesador Intel Core i5, 8GB RAM, 256GB SSD', 1, 'HP', 'Pavilion 15', 2499.00, 15, 5, None),
-            ('LAP002', 'Laptop Lenovo IdeaPad', 'Laptop con procesador AMD Ryzen 5, 16GB RAM, 512GB SSD', 1, 'Lenovo', 'IdeaPad 3', 2799.00, 10, 5, None),
-            ('CEL001', 'iPhone 15 Pro', 'Smartphone Apple con chip A17 Pro, 256GB', 2, 'Apple', 'iPhone 15 Pro', 5499.00, 8, 3, None),
-            ('CEL002', 'Samsung Galaxy S24', 'Smartphone Samsung con 256GB y cámara de 50MP', 2, 'Samsung', 'Galaxy S24', 4299.00, 12, 5, None),
-            ('TAB001', 'iPad Air', 'Tablet Apple con chip M1 y pantalla de 10.9"', 3, 'Apple', 'iPad Air', 3499.00, 6, 3, None),
-            ('ACC001', 'Mouse Logitech MX Master', 'Mouse ergonómico inalámbrico', 4, 'Logitech', 'MX Master 3S', 349.00, 25, 10, None),
-            ('ACC002', 'Teclado Mecánico RGB', 'Teclado gaming con switches mecánicos', 4, 'Corsair', 'K95 RGB', 599.00, 18, 8, None),
-            ('AUD001', 'Audífonos Sony WH-1000XM5', 'Audífonos con cancelación de ruido', 6, 'Sony', 'WH-1000XM5', 1299.00, 20, 10, None)
-        ]
-        cursor.executemany('''
-            INSERT INTO productos (codigo, nombre, descripcion, categoria_id, marca, modelo, precio, stock, stock_minimo, imagen_url)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', productos)
-        conn.commit()
-    
-    conn.close()
-
-def registrar_historial_stock(producto_id, usuario_id, cantidad_anterior, cantidad_nueva, tipo_movimiento, motivo=''):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO historial_stock (producto_id, usuario_id, cantidad_anterior, cantidad_nueva, tipo_movimiento, motivo)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (producto_id, usuario_id, cantidad_anterior, cantidad_nueva, tipo_movimiento, motivo))
-    conn.commit()
-    conn.close()
-
-# Decorador para requerir login
-def login_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            flash('Por favor inicia sesión para acceder', 'warning')
-            return redirect(url_for('login'))
-        return f(*args, **kwargs)
-    return decorated_function
-
-# Decorador para requerir rol de administrador
-def admin_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            flash('Por favor inicia sesión para acceder', 'warning')
-            return redirect(url_for('login'))
-        if session.get('rol') != 'administrador':
-            flash('No tienes permisos para acceder a esta sección', 'danger')
-            return redirect(url_for('dashboard'))
-        return f(*args, **kwargs)
-    return decorated_function
-
-# Rutas de autenticación
-@app.route('/')
-def index():
-    if 'user_id' in session:
-        return redirect(url_for('dashboard'))
-    return redirect(url_for('login'))
-
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    if request.method == 'POST':
-        username = request.form['username']
-        password = request.form['password']
-        
-        # Validar campos vacíos
-        if not username or not password:
-            flash('Por favor completa todos los campos', 'warning')
-            return render_template('login.html')
-        
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM usuarios WHERE username = ? AND activo = 1', (username,))
-        user = cursor.fetchone()
-        conn.close()
-        
-        if user and check_password_hash(user['password'], password):
-            session['user_id'] = user['id']
-            session['username'] = user['username']
-            session['nombre_completo'] = user['nombre_completo']
-            session['rol'] = user['rol']
-            flash(f'Bienvenido {user["nombre_completo"]}!', 'success')
-            return redirect(url_for('dashboard'))
-        else:
-            flash('Usuario o contraseña incorrectos', 'danger')
-    
-    return render_template('login.html')
-
-@app.route('/logout')
-def logout():
-    session.clear()
-    flash('Sesión cerrada exitosamente', 'info')
-    return redirect(url_for('login'))
-
-# Dashboard principal
-@app.route('/dashboard')
-@login_required
-def dashboard():
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Obtener estadísticas
-    cursor.execute('SELECT COUNT(*) as total FROM productos WHERE activo = 1')
-    total_productos = cursor.fetchone()['total']
-    
-    cursor.execute('SELECT COUNT(*) as total FROM productos WHERE activo = 1 AND stock <= stock_minimo')
-    productos_bajo_stock = cursor.fetchone()['total']
-    
-    cursor.execute('SELECT COUNT(*) as total FROM ventas WHERE DATE(fecha_venta) = DATE("now")')
-    ventas_hoy = cursor.fetchone()['total']
-    
-    cursor.execute('SELECT COALESCE(SUM(total), 0) as total FROM ventas WHERE DATE(fecha_venta) = DATE("now")')
-    ingresos_hoy = cursor.fetchone()['total']
-    
-    # Productos con bajo stock
-    cursor.execute('''
-        SELECT p.*, c.nombre as categoria_nombre
-        FROM productos p
-        LEFT JOIN categorias c ON p.categoria_id = c.id
-        WHERE p.activo = 1 AND p.stock <= p.stock_minimo
-        ORDER BY p.stock ASC
-        LIMIT 5
-    ''')
-    productos_alerta = cursor.fetchall()
-    
-    # Últimas ventas
-    cursor.execute('''
-        SELECT v.*, u.nombre_completo as vendedor, c.nombre as cliente_nombre
-            CASE 
-               WHEN c.nombre IS NOT NULL THEN c.nombre || ' ' || c.apellido
-               ELSE 'Cliente General'
-            END as cliente_nombre
-        FROM ventas v
-        LEFT JOIN usuarios u ON v.usuario_id = u.id
-        LEFT JOIN clientes c ON v.cliente_id = c.id
-        ORDER BY v.fecha_venta DESC
-        LIMIT 5
-    ''')
-    ultimas_ventas = cursor.fetchall()
-    
-    conn.close()
-    
-    return render_template('dashboard.html',
-                         total_productos=total_productos,
-                         productos_bajo_stock=productos_bajo_stock,
-                         ventas_hoy=ventas_hoy,
-                         ingresos_hoy=ingresos_hoy,
-                         productos_alerta=productos_alerta,
-                         ultimas_ventas=ultimas_ventas)
-
-# Gestión de productos
-@app.route('/productos')
-@login_required
-def productos():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT p.*, c.nombre as categoria_nombre
-        FROM productos p
-        LEFT JOIN categorias c ON p.categoria_id = c.id
-        WHERE p.activo = 1
-        ORDER BY p.nombre
-    ''')
-    productos = cursor.fetchall()
-    
-    cursor.execute('SELECT * FROM categorias WHERE activo = 1 ORDER BY nombre')
-    categorias = cursor.fetchall()
-    conn.close()
-    
-    return render_template('productos.html', productos=productos, categorias=categorias)
-
-@app.route('/api/producto/<int:id>')
-@login_required
-def api_producto(id):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM productos WHERE id = ? AND activo = 1', (id,))
-    producto = cursor.fetchone()
-    conn.close()
-    
-    if producto:
-        return jsonify({
-            'id': producto['id'],
-            'codigo': producto['codigo'],
-            'nombre': producto['nombre'],
-            'precio': producto['precio'],
-            'stock': producto['stock']
-        })
-    return jsonify({'error': 'Producto no encontrado'}), 404
-
-@app.route('/producto/nuevo', methods=['GET', 'POST'])
-@admin_required
-def nuevo_producto():
-    if request.method == 'POST':
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        try:
-            codigo = request.form.get('codigo', '').strip().upper()
-            nombre = request.form.get('nombre', '').strip()
-            precio = float(request.form.get('precio', 0))
-            stock  = int(request.form.get('stock', 0))
-            
-            # Validar campos obligatorios
-            if not codigo or not nombre or precio <= 0:
-                flash('Por favor completa todos los campos obligatorios correctamente', 'danger')
-                raise ValueError('Datos incompletos')
-            
-            cursor.execute('''
-                INSERT INTO productos (codigo, nombre, descripcion, categoria_id, marca, modelo, precio, stock, stock_minimo)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                request.form['codigo'],
-                request.form['nombre'],
-                request.form['descripcion'],
-                request.form['categoria_id'] if request.form['categoria_id'] else None,
-                request.form['marca'],
-                request.form['modelo'],
-                request.form['precio'],
-                request.form['stock'],
-                request.form['stock_minimo']
-            ))
-            conn.commit()
-            flash('Producto creado exitosamente', 'success')
-            return redirect(url_for('productos'))
-        except sqlite3.IntegrityError:
-            flash('El código del producto ya existe', 'danger')
-        finally:
-            conn.close()
-    
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM categorias WHERE activo = 1 ORDER BY nombre')
-    categorias = cursor.fetchall()
-    conn.close()
-    
-    return render_template('producto_form.html', categorias=categorias)
-
-@app.route('/producto/editar/<int:id>', methods=['GET', 'POST'])
-@admin_required
-def editar_producto(id):
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    if request.method == 'POST':
-        try:
-            cursor.execute('''
-                UPDATE productos
-                SET codigo = ?, nombre = ?, descripcion = ?, categoria_id = ?,
-                    marca = ?, modelo = ?, precio = ?, stock = ?, stock_minimo = ?
-                WHERE id = ?
-            ''', (
-                request.form['codigo'],
-                request.form['nombre'],
-                request.form['descripcion'],
-                request.form['categoria_id'] if request.form['categoria_id'] else None,
-                request.form['marca'],
-                request.form['modelo'],
-                request.form['precio'],
-                request.form['stock'],
-                request.form['stock_minimo'],
-                id
-            ))
-            conn.commit()
-            flash('Producto actualizado exitosamente', 'success')
-            return redirect(url_for('productos'))
-        except sqlite3.IntegrityError:
-            flash('El código del producto ya existe', 'danger')
-        finally:
-            conn.close()
-    
-    cursor.execute('SELECT stock FROM productos WHERE id = ?', (id,))
-    stock_anterior = cursor.fetchone()['stock']
-    stock_nuevo = int(request.form.get('stock', 0))
-
-    cursor.execute('SELECT * FROM productos WHERE id = ?', (id,))
-    producto = cursor.fetchone()
-
-# Registrar cambio de stock si hubo modificación
-    if stock_anterior != stock_nuevo:
-        tipo = 'entrada' if stock_nuevo > stock_anterior else 'salida'
-        registrar_historial_stock(id, session['user_id'], stock_anterior, stock_nuevo, tipo, 'Ajuste manual')                                   
-
-    cursor.execute('SELECT * FROM categorias WHERE activo = 1 ORDER BY nombre')
-    categorias = cursor.fetchall()
-    conn.close()
-    
-    return render_template('producto_form.html', producto=producto, categorias=categorias)
-
-@app.route('/producto/<int:id>/historial')
-@login_required
-def historial_producto(id):
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT * FROM productos WHERE id = ?', (id,))
-    producto = cursor.fetchone()
-    
-    if not producto:
-        flash('Producto no encontrado', 'danger')
-        return redirect(url_for('productos'))
-    
-    cursor.execute('''
-        SELECT h.*, u.nombre_completo as usuario
-        FROM historial_stock h
-        LEFT JOIN usuarios u ON h.usuario_id = u.id
-        WHERE h.producto_id = ?
-        ORDER BY h.fecha DESC
-        LIMIT 50
-    ''', (id,))
-    historial = cursor.fetchall()
-    
-    conn.close()
-    
-    return render_template('historial_stock.html', producto=producto, historial=historial)
-
-@app.route('/producto/eliminar/<int:id>')
-@admin_required
-def eliminar_producto(id):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('UPDATE productos SET activo = 0 WHERE id = ?', (id,))
-    conn.commit()
-    conn.close()
-    flash('Producto eliminado exitosamente', 'success')
-    return redirect(url_for('productos'))
-
-# Gestión de ventas
-@app.route('/ventas')
-@login_required
-def ventas():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT v.*, u.nombre_completo as vendedor, 
-               c.nombre || ' ' || c.apellido as cliente_nombre
-        FROM ventas v
-        LEFT JOIN usuarios u ON v.usuario_id = u.id
-        LEFT JOIN clientes c ON v.cliente_id = c.id
-        ORDER BY v.fecha_venta DESC
-    ''')
-    ventas = cursor.fetchall()
-    conn.close()
-    
-    return render_template('ventas.html', ventas=ventas)
-
-@app.route('/venta/nueva', methods=['GET', 'POST'])
-@login_required
-def nueva_venta():
-    if request.method == 'POST':
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        try:
-            # Obtener datos del formulario
-            cliente_id = request.form.get('cliente_id')
-            productos_ids = request.form.getlist('producto_id[]')
-            cantidades = request.form.getlist('cantidad[]')
-            
-            documento = request.form.get('documento', '').strip()
-            nombre = request.form.get('nombre', '').strip()
-            apellido = request.form.get('apellido', '').strip()
-
-            if not documento or not nombre or not apellido:
-                flash('Por favor completa los campos obligatorios', 'danger')
-                return render_template('cliente_form.html')
-
-            if not productos_ids:
-                flash('Debe agregar al menos un producto', 'danger')
-                return redirect(url_for('nueva_venta'))
-            
-            # Calcular totales
-            subtotal = 0
-            detalles = []
-            
-            for prod_id, cant in zip(productos_ids, cantidades):
-                if not prod_id or not cant:
-                    continue
-
-                cursor.execute('SELECT * FROM productos WHERE id = ?', (prod_id,))
-                producto = cursor.fetchone()
-                
-                if not producto:
-                    flash(f'Producto no encontrado', 'danger')
-                    return redirect(url_for('nueva_venta'))
-            
-                if int(cant) > producto['stock']:
-                    flash(f'Stock insuficiente para {producto["nombre"]}. Disponible: {producto["stock"]}', 'danger')
-                    return redirect(url_for('nueva_venta'))
-
-                cantidad = int(cant)
-                precio_unitario = producto['precio']
-                subtotal_item = precio_unitario * cantidad
-                
-                detalles.append({
-                    'producto_id': prod_id,
-                    'cantidad': cantidad,
-                    'precio_unitario': precio_unitario,
-                    'subtotal': subtotal_item
-                })
-                
-                subtotal += subtotal_item
-            
-            igv = subtotal * 0.18
-            total = subtotal + igv
-            
-            # Generar número de venta
-            cursor.execute('SELECT COUNT(*) as count FROM ventas')
-            num_venta = f"VTA-{cursor.fetchone()['count'] + 1:06d}"
-            
-            # Insertar venta
-            cursor.execute('''
-                INSERT INTO ventas (numero_venta, cliente_id, usuario_id, subtotal, igv, total, metodo_pago, observaciones)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                num_venta,
-                cliente_id if cliente_id else None,
-                session['user_id'],
-                subtotal,
-                igv,
-                total,
-                request.form['metodo_pago'],
-                request.form.get('observaciones', '')
-            ))
-            
-            venta_id = cursor.lastrowid
-            
-            # Insertar detalles y actualizar stock
-            for detalle in detalles:
-                cursor.execute('''
-                    INSERT INTO detalle_ventas (venta_id, producto_id, cantidad, precio_unitario, subtotal)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (venta_id, detalle['producto_id'], detalle['cantidad'], 
-                      detalle['precio_unitario'], detalle['subtotal']))
-                
-                cursor.execute('''
-                    UPDATE productos SET stock = stock - ? WHERE id = ?
-                ''', (detalle['cantidad'], detalle['producto_id']))
-            
-            conn.commit()
-            flash(f'Venta {num_venta} registrada exitosamente', 'success')
-            return redirect(url_for('ventas'))
-            
-        except Exception as e:
-            conn.rollback()
-            flash(f'Error al registrar la venta: {str(e)}', 'danger')
-        finally:
-            conn.close()
-    
-    # GET: mostrar formulario
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT * FROM productos WHERE activo = 1 AND stock > 0 ORDER BY nombre')
-    productos = cursor.fetchall()
-    
-    cursor.execute('SELECT * FROM clientes ORDER BY nombre, apellido')
-    clientes = cursor.fetchall()
-    
-    conn.close()
-    
-    return render_template('venta_form.html', productos=productos, clientes=clientes)
-
-@app.route('/venta/detalle/<int:id>')
-@login_required
-def detalle_venta(id):
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT v.*, u.nombre_completo as vendedor,
-               c.nombre || ' ' || c.apellido as cliente_nombre,
-               c.documento, c.telefono, c.email
-        FROM ventas v
-        LEFT JOIN usuarios u ON v.usuario_id = u.id
-        LEFT JOIN clientes c ON v.cliente_id = c.id
-        WHERE v.id = ?
-    ''', (id,))
-    venta = cursor.fetchone()
-    
-    cursor.execute('''
-        SELECT dv.*, p.nombre as producto_nombre, p.codigo
-        FROM detalle_ventas dv
-        JOIN productos p ON dv.producto_id = p.id
-        WHERE dv.venta_id = ?
-    ''', (id,))
-    detalles = cursor.fetchall()
-    
-    conn.close()
-    
-    return render_template('venta_detalle.html', venta=venta, detalles=detalles)
-
-# Gestión de clientes
-@app.route('/clientes')
-@login_required
-def clientes():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM clientes ORDER BY nombre, apellido')
-    clientes = cursor.fetchall()
-    conn.close()
-    
-    return render_template('clientes.html', clientes=clientes)
-
-@app.route('/cliente/nuevo', methods=['GET', 'POST'])
-@login_required
-def nuevo_cliente():
-    if request.method == 'POST':
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-                INSERT INTO clientes (documento, tipo_documento, nombre, apellido, email, telefono, direccion)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                request.form['documento'],
-                request.form['tipo_documento'],
-                request.form['nombre'],
-                request.form['apellido'],
-                request.form['email'],
-                request.form['telefono'],
-                request.form['direccion']
-            ))
-            conn.commit()
-            flash('Cliente registrado exitosamente', 'success')
-            return redirect(url_for('clientes'))
-        except sqlite3.IntegrityError:
-            flash('El documento ya está registrado', 'danger')
-        finally:
-            conn.close()
-    
-    return render_template('cliente_form.html')
-
-@app.route('/reportes')
-@admin_required
-def reportes():
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Productos más vendidos
-    cursor.execute('''
-        SELECT p.nombre, p.codigo, SUM(dv.cantidad) as total_vendido
-        FROM detalle_ventas dv
-        JOIN productos p ON dv.producto_id = p.id
-        GROUP BY dv.producto_id
-        ORDER BY total_vendido DESC
-        LIMIT 10
-    ''')
-    productos_top = cursor.fetchall()
-    
-    # Ventas por mes
-    cursor.execute('''
-        SELECT strftime('%Y-%m', fecha_venta) as mes, 
-               COUNT(*) as num_ventas,
-               SUM(total) as total_ingresos
-        FROM ventas
-        GROUP BY mes
-        ORDER BY mes DESC
-        LIMIT 12
-    ''')
-    ventas_mensuales = cursor.fetchall()
-    
-    conn.close()
-    
-    return render_template('reportes.html', 
-                         productos_top=productos_top,
-                         ventas_mensuales=ventas_mensuales)
-
-# Gestión de usuarios (solo administrador)
-@app.route('/usuarios')
-@admin_required
-def usuarios():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM usuarios ORDER BY nombre_completo')
-    usuarios = cursor.fetchall()
-    conn.close()
-    
-    return render_template('usuarios.html', usuarios=usuarios)
-
-@app.route('/usuario/nuevo', methods=['GET', 'POST'])
-@admin_required
-def nuevo_usuario():
-    if request.method == 'POST':
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        try:
-            hash_password = generate_password_hash(request.form['password'])
-            cursor.execute('''
-                INSERT INTO usuarios (username, password, nombre_completo, email, rol)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                request.form['username'],
-                hash_password,
-                request.form['nombre_completo'],
-                request.form['email'],
-                request.form['rol']
-            ))
-            conn.commit()
-            flash('Usuario creado exitosamente', 'success')
-            return redirect(url_for('usuarios'))
-        except sqlite3.IntegrityError:
-            flash('El nombre de usuario o email ya existe', 'danger')
-        finally:
-            conn.close()
-    
-    return render_template('usuario_form.html')
-
-# Categorías (solo administrador)
-@app.route('/categorias')
-@admin_required
-def categorias():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM categorias WHERE activo = 1 ORDER BY nombre')
-    categorias = cursor.fetchall()
-    conn.close()
-    
-    return render_template('categorias.html', categorias=categorias)
-
-if __name__ == '__main__':
-  def init_db():
-    """Inicializa la base de datos con las tablas necesarias"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # ... todas tus tablas aquí ...
-    
-    # Insertar productos de ejemplo
-    cursor.execute("SELECT COUNT(*) as count FROM productos")
-    if cursor.fetchone()['count'] == 0:
-        productos = [
-            # ... tus productos ...
-        ]
-        cursor.executemany('''
-            INSERT INTO productos (codigo, nombre, descripcion, categoria_id, marca, modelo, precio, stock, stock_minimo, imagen_url)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', productos)
-        conn.commit()
-    
-    # ⭐ AGREGAR AQUÍ LOS ÍNDICES (antes de conn.close())
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_productos_activo ON productos(activo)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_productos_stock ON productos(stock)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ventas_fecha ON ventas(fecha_venta)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ventas_usuario ON ventas(usuario_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_detalle_venta ON detalle_ventas(venta_id)')
-    conn.commit()
-    
-    conn.close()
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, g, has_app_context, send_file, abort, make_response, Response, stream_with_context
+from werkzeug.security import generate_password_hash, check_password_hash
+from functools import wraps
+from contextlib import contextmanager, nullcontext
+import sqlite3
+import threading
+import queue
+from collections import OrderedDict, deque
+import base64
+import csv
+import hashlib
+import json
+import time
+import random
+import re
+import tempfile
+import zlib
+from datetime import datetime, timedelta, timezone
+import os
+import click
+import logging
+import atexit
+import cProfile
+import pstats
+import io
+import urllib.request
+import urllib.error
+import urllib.parse
+from http.cookiejar import CookieJar
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+app = Flask(__name__)
+app.secret_key = os.environ.get('SECRET_KEY', 'tu_clave_secreta_super_segura_cambiar_en_produccion')
+
+# Configuración de la base de datos
+DATABASE = os.environ.get('DATABASE', 'tienda_tecnologia.db')
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+
+# Numeración de ventas: serie por defecto (p. ej. una por caja) y tamaño
+# del bloque de números que cada proceso reserva por adelantado
+SERIE_VENTA = os.environ.get('SERIE_VENTA', 'VTA')
+NUMERACION_BLOQUE = int(os.environ.get('NUMERACION_BLOQUE', 1))
+
+# Filas por página en los listados
+PAGINA_TAMANO = int(os.environ.get('PAGINA_TAMANO', 50))
+
+# Búsqueda de texto completo (FTS5): columnas indexadas por tabla y
+# cantidad máxima de resultados por consulta
+INDICES_BUSQUEDA = {
+    'productos': ('codigo', 'nombre', 'descripcion', 'marca', 'modelo'),
+    'clientes': ('documento', 'nombre', 'apellido', 'email'),
+}
+BUSQUEDA_LIMITE = 50
+# Por encima de esta cantidad de coincidencias no se ordena por relevancia
+# (bm25 tendría que puntuar todas) y se devuelven en orden del índice
+BUSQUEDA_MAX_RANQUEO = 2000
+
+# Pragmas aplicados una sola vez al abrir cada conexión
+DB_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA foreign_keys = ON',
+    'PRAGMA cache_size = -20000',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA temp_store = MEMORY',
+)
+
+# Instrumentación: métricas del proceso en formato Prometheus
+# Consultas más lentas que este umbral (ms) se registran en el log 'tienda.sql'; 0 lo desactiva
+SQL_LENTA_MS = float(os.environ.get('SQL_LENTA_MS', 200))
+log_sql = logging.getLogger('tienda.sql')
+
+BUCKETS_SEGUNDOS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# nombre: (tipo, ayuda, buckets de los histogramas)
+DEFINICION_METRICAS = {
+    'tienda_peticiones_total': ('counter', 'Peticiones atendidas por ruta, método y estado HTTP', None),
+    'tienda_peticion_duracion_segundos': ('histogram', 'Duración de las peticiones por ruta', BUCKETS_SEGUNDOS),
+    'tienda_consultas_por_peticion': ('histogram', 'Sentencias SQL ejecutadas por petición', BUCKETS_CONSULTAS),
+    'tienda_sql_consultas_total': ('counter', 'Sentencias SQL ejecutadas por ruta', None),
+    'tienda_sql_segundos_total': ('counter', 'Tiempo total en sentencias SQL por ruta', None),
+    'tienda_sql_lentas_total': ('counter', 'Sentencias SQL por encima de SQL_LENTA_MS', None),
+    'tienda_sqlite_ocupada_total': ('counter', 'Errores "database is locked/busy" de SQLite', None),
+    'tienda_sqlite_espera_bloqueo_segundos': ('histogram', 'Espera para obtener el bloqueo de escritura (BEGIN IMMEDIATE)', BUCKETS_SEGUNDOS),
+    'tienda_venta_commit_segundos': ('histogram', 'Duración de registrar_venta desde BEGIN hasta el commit', BUCKETS_SEGUNDOS),
+    'tienda_pool_conexiones': ('gauge', 'Conexiones del pool por estado', None),
+    'tienda_cache_lecturas_total': ('counter', 'Lecturas de la caché de datos de consulta por clave y resultado', None),
+    'tienda_cache_desalojos_total': ('counter', 'Entradas de la caché desalojadas por tamaño', None),
+    'tienda_cache_entradas': ('gauge', 'Entradas en la caché de datos de consulta', None),
+    'tienda_escritura_diferida_pendientes': ('gauge', 'Registros en la cola de escritura diferida', None),
+    'tienda_escritura_diferida_registros_total': ('counter', 'Registros escritos por el hilo de escritura diferida', None),
+    'tienda_escritura_diferida_vaciado_segundos': ('histogram', 'Duración de cada lote de la escritura diferida', BUCKETS_SEGUNDOS),
+    'tienda_escritura_diferida_directas_total': ('counter', 'Registros escritos en la petición por tener la cola llena', None),
+    'tienda_escritura_diferida_errores_total': ('counter', 'Registros diferidos que no se pudieron escribir', None),
+    'tienda_alertas_stock_total': ('counter', 'Alertas de stock publicadas a los tableros conectados', None),
+    'tienda_alertas_clientes': ('gauge', 'Tableros conectados al flujo de alertas de stock', None),
+    'tienda_reportes_refresco_segundos': ('histogram', 'Duración de cada refresco de la base de reportes', BUCKETS_SEGUNDOS),
+    'tienda_reportes_antiguedad_segundos': ('gauge', 'Antigüedad de la base de reportes', None),
+    'tienda_archivos_adjuntos_total': ('counter', 'Archivos de ventas adjuntados para una consulta', None),
+}
+
+class Metricas:
+    """Contadores e histogramas en memoria, propios de cada proceso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._valores = {}
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def observar(self, nombre, valor, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        buckets = DEFINICION_METRICAS[nombre][2]
+        with self._lock:
+            serie = self._valores.get(clave)
+            if serie is None:
+                serie = self._valores[clave] = [0] * len(buckets) + [0, 0]
+            for i, limite in enumerate(buckets):
+                if valor <= limite:
+                    serie[i] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def exportar(self, medidores=()):
+        """Texto en formato de exposición de Prometheus; medidores son (nombre, etiquetas, valor) instantáneos"""
+        with self._lock:
+            valores = sorted((clave, list(v) if isinstance(v, list) else v) for clave, v in self._valores.items())
+        valores += [((nombre, tuple(sorted(etiquetas.items()))), valor) for nombre, etiquetas, valor in medidores]
+
+        def formatear(etiquetas):
+            if not etiquetas:
+                return ''
+            texto = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in etiquetas)
+            return '{' + texto + '}'
+
+        lineas = []
+        for nombre, (tipo, ayuda, buckets) in DEFINICION_METRICAS.items():
+            series = [(etiquetas, valor) for (n, etiquetas), valor in valores if n == nombre]
+            if not series:
+                continue
+            lineas.append(f'# HELP {nombre} {ayuda}')
+            lineas.append(f'# TYPE {nombre} {tipo}')
+            for etiquetas, valor in series:
+                if tipo != 'histogram':
+                    lineas.append(f'{nombre}{formatear(etiquetas)} {valor}')
+                    continue
+                for limite, cuenta in zip(buckets, valor):
+                    lineas.append(f'{nombre}_bucket{formatear(etiquetas + (("le", limite),))} {cuenta}')
+                lineas.append(f'{nombre}_bucket{formatear(etiquetas + (("le", "+Inf"),))} {valor[-1]}')
+                lineas.append(f'{nombre}_sum{formatear(etiquetas)} {valor[-2]}')
+                lineas.append(f'{nombre}_count{formatear(etiquetas)} {valor[-1]}')
+        return '\n'.join(lineas) + '\n'
+
+metricas = Metricas()
+
+# Perfilado bajo demanda: directorio de perfiles, cuántos conservar y
+# configuración inicial (fracción de peticiones y ruta opcional)
+PERFILES_DIR = os.environ.get('PERFILES_DIR', 'perfiles')
+PERFILES_MAX = int(os.environ.get('PERFILES_MAX', 50))
+PERFILADO_REVISION = 2  # segundos entre lecturas de la configuración compartida
+
+class Perfilador:
+    """Perfila con cProfile una fracción de las peticiones y guarda los últimos perfiles
+
+    La configuración elegida en la página se guarda en `perfilado.conf`
+    dentro del directorio de perfiles, que comparten todos los procesos del
+    servidor; cada proceso la relee si cambió, como mucho cada
+    PERFILADO_REVISION segundos. Mientras está inactivo el costo por
+    petición es leer `activo` y, cada tanto, un os.stat del archivo.
+    """
+
+    def __init__(self, directorio, maximo, fraccion=0.0, ruta=None):
+        self.directorio = directorio
+        self.maximo = maximo
+        self._lock = threading.Lock()
+        self._marca = None
+        self._proxima_revision = 0.0
+        self._aplicar(fraccion, ruta)
+
+    def _aplicar(self, fraccion, ruta):
+        self.fraccion = fraccion
+        self.ruta = ruta or None
+        self.activo = fraccion > 0
+
+    def _configuracion(self):
+        return os.path.join(self.directorio, 'perfilado.conf')
+
+    def configurar(self, fraccion, ruta=None):
+        """fraccion entre 0 y 1 (0 desactiva); ruta limita el perfilado a un endpoint
+
+        Se aplica de inmediato en este proceso y se guarda para los demás.
+        """
+        os.makedirs(self.directorio, exist_ok=True)
+        temporal = f'{self._configuracion()}.{os.getpid()}.tmp'
+        with open(temporal, 'w', encoding='utf-8') as archivo:
+            json.dump({'fraccion': fraccion, 'ruta': ruta or None}, archivo)
+        os.replace(temporal, self._configuracion())
+        self._aplicar(fraccion, ruta)
+
+    def revisar(self):
+        """Relee la configuración compartida si otro proceso la cambió"""
+        ahora = time.monotonic()
+        if ahora < self._proxima_revision:
+            return
+        self._proxima_revision = ahora + PERFILADO_REVISION
+        try:
+            estado = os.stat(self._configuracion())
+        except OSError:
+            return
+        marca = (estado.st_mtime_ns, estado.st_size)
+        if marca == self._marca:
+            return
+        try:
+            with open(self._configuracion(), encoding='utf-8') as archivo:
+                datos = json.load(archivo)
+            fraccion, ruta = float(datos['fraccion']), datos.get('ruta')
+        except (OSError, ValueError, TypeError, KeyError, AttributeError):
+            return
+        self._marca = marca
+        self._aplicar(min(max(fraccion, 0.0), 1.0), ruta if isinstance(ruta, str) else None)
+
+    def debe_perfilar(self, endpoint):
+        if self.ruta and endpoint != self.ruta:
+            return False
+        return random.random() < self.fraccion
+
+    def guardar(self, perfil, datos):
+        """Escribe el perfil (.prof) y sus datos (.json) y elimina los más antiguos"""
+        os.makedirs(self.directorio, exist_ok=True)
+        nombre = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{datos['ruta']}"
+        perfil.dump_stats(os.path.join(self.directorio, nombre + '.prof'))
+        with open(os.path.join(self.directorio, nombre + '.json'), 'w', encoding='utf-8') as archivo:
+            json.dump(dict(datos, nombre=nombre), archivo)
+        with self._lock:
+            for antiguo in self.nombres()[self.maximo:]:
+                for extension in ('.prof', '.json'):
+                    try:
+                        os.remove(os.path.join(self.directorio, antiguo + extension))
+                    except FileNotFoundError:
+                        pass
+
+    def nombres(self):
+        """Nombres de los perfiles guardados, del más reciente al más antiguo"""
+        if not os.path.isdir(self.directorio):
+            return []
+        return sorted((archivo[:-5] for archivo in os.listdir(self.directorio) if archivo.endswith('.json')), reverse=True)
+
+    def listar(self):
+        perfiles = []
+        for nombre in self.nombres():
+            try:
+                with open(os.path.join(self.directorio, nombre + '.json'), encoding='utf-8') as archivo:
+                    perfiles.append(json.load(archivo))
+            except (OSError, ValueError):
+                continue
+        return perfiles
+
+    def archivo(self, nombre):
+        """Ruta del .prof de un perfil guardado, o None si el nombre no es válido"""
+        if not re.fullmatch(r'[\w.-]+', nombre):
+            return None
+        ruta = os.path.join(self.directorio, nombre + '.prof')
+        return ruta if os.path.isfile(ruta) else None
+
+perfilador = Perfilador(PERFILES_DIR, PERFILES_MAX,
+                        float(os.environ.get('PERFILADO_FRACCION', 0)), os.environ.get('PERFILADO_RUTA'))
+
+def forma_parametros(parametros):
+    """Describe los tipos de los parámetros de una consulta sin sus valores"""
+    if isinstance(parametros, dict):
+        return '{' + ', '.join(f'{k}: {type(v).__name__}' for k, v in parametros.items()) + '}'
+    if isinstance(parametros, (list, tuple)):
+        return '(' + ', '.join(type(v).__name__ for v in parametros) + ')'
+    return type(parametros).__name__
+
+class CursorInstrumentado(sqlite3.Cursor):
+    """Cursor que mide cada sentencia y la suma a los contadores de su conexión"""
+
+    def _medir(self, metodo, sql, parametros, forma):
+        inicio = time.perf_counter()
+        try:
+            return metodo(sql, parametros)
+        except sqlite3.OperationalError as error:
+            if 'locked' in str(error) or 'busy' in str(error):
+                metricas.incrementar('tienda_sqlite_ocupada_total')
+            raise
+        finally:
+            duracion = time.perf_counter() - inicio
+            conexion = self.connection
+            conexion.consultas += 1
+            conexion.segundos_sql += duracion
+            if sql.lstrip()[:5].upper() == 'BEGIN':
+                metricas.observar('tienda_sqlite_espera_bloqueo_segundos', duracion)
+            if SQL_LENTA_MS and duracion * 1000 >= SQL_LENTA_MS:
+                metricas.incrementar('tienda_sql_lentas_total')
+                log_sql.warning('Consulta lenta (%.1f ms): %s | parámetros: %s',
+                                duracion * 1000, ' '.join(sql.split()), forma(parametros))
+
+    def execute(self, sql, parametros=()):
+        return self._medir(super().execute, sql, parametros, forma_parametros)
+
+    def executemany(self, sql, parametros):
+        return self._medir(super().executemany, sql, parametros,
+                           lambda filas: f'{len(filas)} x {forma_parametros(filas[0])}' if isinstance(filas, list) and filas
+                           else type(filas).__name__)
+
+class ConexionInstrumentada(sqlite3.Connection):
+    """Conexión cuyos cursores cuentan y miden las sentencias ejecutadas"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reiniciar_contadores()
+        # Funciones pendientes hasta que la transacción en curso se confirme
+        self._al_confirmar = []
+
+    def reiniciar_contadores(self):
+        self.consultas = 0
+        self.segundos_sql = 0.0
+
+    def cursor(self, factory=CursorInstrumentado):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, parametros):
+        return self.cursor().executemany(sql, parametros)
+
+    def al_confirmar(self, funcion):
+        """Ejecuta funcion() después del próximo commit exitoso; un rollback la descarta"""
+        if self.in_transaction:
+            self._al_confirmar.append(funcion)
+        else:
+            funcion()
+
+    def commit(self):
+        try:
+            super().commit()
+        except sqlite3.OperationalError as error:
+            if 'locked' in str(error) or 'busy' in str(error):
+                metricas.incrementar('tienda_sqlite_ocupada_total')
+            raise
+        pendientes, self._al_confirmar = self._al_confirmar, []
+        for funcion in pendientes:
+            funcion()
+
+    def rollback(self):
+        self._al_confirmar = []
+        super().rollback()
+
+def crear_conexion(database=None):
+    """Abre una conexión nueva con los pragmas de rendimiento aplicados"""
+    conn = sqlite3.connect(database or DATABASE, timeout=DB_POOL_TIMEOUT, check_same_thread=False,
+                           factory=ConexionInstrumentada, uri=True)
+    conn.row_factory = sqlite3.Row
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+@contextmanager
+def transaccion(conn):
+    """Ejecuta el bloque dentro de BEGIN IMMEDIATE, con commit o rollback al salir"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+class PoolConexiones:
+    """Pool acotado de conexiones SQLite reutilizables dentro de un proceso"""
+
+    def __init__(self, database, max_conexiones=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, al_abrir=None):
+        self.database = database
+        self.max_conexiones = max_conexiones
+        self.timeout = timeout
+        # Función opcional que recibe cada conexión nueva (instrumentación)
+        self.al_abrir = al_abrir
+        self._lock = threading.Lock()
+        self._reiniciar()
+
+    def _reiniciar(self):
+        # Cada proceso (worker) mantiene su propio pool
+        self._pid = os.getpid()
+        self._libres = queue.LifoQueue()
+        self._abiertas = 0
+        self._en_uso = 0
+
+    def obtener(self):
+        """Entrega una conexión libre, abre una nueva o espera si el pool está lleno"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reiniciar()
+            crear = self._libres.empty() and self._abiertas < self.max_conexiones
+            if crear:
+                self._abiertas += 1
+
+        if crear:
+            try:
+                conn = crear_conexion(self.database)
+                if self.al_abrir:
+                    self.al_abrir(conn)
+            except Exception:
+                with self._lock:
+                    self._abiertas -= 1
+                raise
+        else:
+            try:
+                conn = self._libres.get(timeout=self.timeout)
+            except queue.Empty:
+                raise RuntimeError('No hay conexiones disponibles en el pool de base de datos')
+
+        with self._lock:
+            self._en_uso += 1
+        return conn
+
+    def devolver(self, conn):
+        """Devuelve una conexión al pool descartando transacciones pendientes"""
+        if self._pid != os.getpid():
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.ProgrammingError:
+            # La conexión fue cerrada por el llamador: se descarta
+            with self._lock:
+                self._abiertas -= 1
+                self._en_uso -= 1
+            return
+        with self._lock:
+            self._en_uso -= 1
+        self._libres.put(conn)
+
+    def cerrar_todas(self):
+        """Cierra las conexiones libres del pool"""
+        with self._lock:
+            while True:
+                try:
+                    conn = self._libres.get_nowait()
+                except queue.Empty:
+                    break
+                conn.close()
+                self._abiertas -= 1
+
+    def estadisticas(self):
+        """Cantidad de conexiones abiertas, en uso y libres"""
+        with self._lock:
+            return {
+                'abiertas': self._abiertas,
+                'en_uso': self._en_uso,
+                'libres': self._abiertas - self._en_uso,
+                'maximo': self.max_conexiones,
+            }
+
+pool = PoolConexiones(DATABASE)
+
+@contextmanager
+def usar_base_datos(ruta, **opciones_pool):
+    """Redirige get_db() y el pool a otra base (herramientas de diagnóstico)
+
+    Mientras tanto los reportes también consultan esa base y no la copia.
+    """
+    global DATABASE, pool, base_reportes
+    anterior = (DATABASE, pool, base_reportes)
+    DATABASE, pool = ruta, PoolConexiones(ruta, **opciones_pool)
+    base_reportes = BaseReportes(ruta='')
+    try:
+        yield pool
+    finally:
+        cola_escritura.vaciar()
+        pool.cerrar_todas()
+        DATABASE, pool, base_reportes = anterior
+
+def get_db():
+    """Obtiene una conexión a la base de datos
+
+    Dentro de una petición (o contexto de aplicación) todas las llamadas
+    comparten la misma conexión del pool, que se devuelve en el teardown.
+    Fuera de contexto se entrega una conexión independiente que el llamador
+    debe cerrar.
+    """
+    if not has_app_context():
+        return crear_conexion()
+    if 'db' not in g:
+        g.db = pool.obtener()
+        g.db.reiniciar_contadores()
+    return g.db
+
+@app.teardown_appcontext
+def liberar_db(exception=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        pool.devolver(conn)
+    copia = g.pop('db_reportes', None)
+    if copia is not None:
+        copia.close()
+
+# Base de reportes: copia de solo lectura de la base principal, refrescada
+# cada REPORTES_ANTIGUEDAD segundos con la API de backup. Los reportes y las
+# exportaciones de ventas la consultan para no competir con las ventas.
+# REPORTES_COPIA es la ruta de la copia; vacío desactiva el modo.
+REPORTES_COPIA = os.environ.get('REPORTES_COPIA', '')
+REPORTES_ANTIGUEDAD = float(os.environ.get('REPORTES_ANTIGUEDAD', 300))
+log_reportes = logging.getLogger('tienda.reportes')
+
+class BaseReportes:
+    """Copia de la base para consultas analíticas, con su antigüedad conocida
+
+    refrescar() copia la base en un solo paso de backup: la lectura ve una
+    instantánea consistente y, con WAL, no bloquea a los escritores. La
+    copia se escribe en un archivo temporal que reemplaza a la anterior de
+    forma atómica, así que las consultas en curso terminan sobre la versión
+    que abrieron. La fecha de modificación del archivo es el momento de la
+    instantánea, compartido por todos los procesos. Un hilo por proceso la
+    refresca cuando vence; si no existe o tiene más de tres veces la
+    antigüedad configurada, las consultas vuelven a la base principal.
+    """
+
+    def __init__(self, ruta=REPORTES_COPIA, antiguedad=REPORTES_ANTIGUEDAD, origen=DATABASE):
+        self.ruta = ruta
+        self.antiguedad = antiguedad
+        self.origen = origen
+        self._lock = threading.Lock()
+        self._hilo = None
+
+    def activa(self):
+        return bool(self.ruta)
+
+    def edad(self):
+        """Segundos desde la instantánea de la copia, o None si no existe"""
+        try:
+            return max(0.0, time.time() - os.path.getmtime(self.ruta))
+        except OSError:
+            return None
+
+    def refrescar(self):
+        """Reemplaza la copia por una instantánea de la base de origen"""
+        inicio = time.perf_counter()
+        momento = time.time()
+        fd, temporal = tempfile.mkstemp(prefix='.reportes-', suffix='.db',
+                                        dir=os.path.dirname(os.path.abspath(self.ruta)))
+        os.close(fd)
+        fuente = crear_conexion(self.origen)
+        destino = sqlite3.connect(temporal)
+        try:
+            fuente.backup(destino)
+            # La copia no se modifica: sin WAL se abre como inmutable
+            destino.execute('PRAGMA journal_mode = DELETE')
+            destino.close()
+            os.utime(temporal, (momento, momento))
+            os.replace(temporal, self.ruta)
+        except BaseException:
+            destino.close()
+            os.remove(temporal)
+            raise
+        finally:
+            fuente.close()
+        metricas.observar('tienda_reportes_refresco_segundos', time.perf_counter() - inicio)
+
+    def conectar(self):
+        """Conexión de solo lectura a la copia, o None si no está disponible o está vencida"""
+        self._iniciar()
+        edad = self.edad()
+        if edad is None or edad > 3 * self.antiguedad:
+            return None
+        ruta = urllib.parse.quote(os.path.abspath(self.ruta))
+        conn = sqlite3.connect(f'file:{ruta}?mode=ro&immutable=1', uri=True, check_same_thread=False,
+                               factory=ConexionInstrumentada)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+
+    def _iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._trabajar, name='base-reportes', daemon=True)
+                self._hilo.start()
+
+    def _trabajar(self):
+        while True:
+            edad = self.edad()
+            # Otro proceso pudo haberla refrescado: solo se copia si venció
+            if edad is None or edad >= self.antiguedad:
+                try:
+                    self.refrescar()
+                    edad = 0
+                except (sqlite3.Error, OSError):
+                    log_reportes.exception('No se pudo refrescar la base de reportes %s', self.ruta)
+                    edad = max(0, self.antiguedad - 60)
+            time.sleep(max(1, self.antiguedad - edad))
+
+base_reportes = BaseReportes()
+
+def duracion_legible(segundos):
+    return f'{segundos / 60:g} min' if segundos >= 60 else f'{segundos:g} s'
+
+def get_db_reportes():
+    """Conexión para reportes y exportaciones
+
+    Usa la copia de reportes si está activa y vigente, y si no la conexión
+    principal de la petición. g.datos_al queda con la fecha de la copia
+    (None si los datos son en vivo) para mostrarla al usuario.
+    """
+    if 'db_reportes' not in g:
+        g.db_reportes = base_reportes.conectar() if base_reportes.activa() else None
+        g.datos_al = None
+        if g.db_reportes is not None:
+            g.datos_al = datetime.fromtimestamp(os.path.getmtime(base_reportes.ruta)).strftime('%Y-%m-%d %H:%M:%S')
+    return g.db_reportes or get_db()
+
+# Caché de lecturas para datos de consulta frecuente que cambian poco
+# (categorías, usuarios): máximo de entradas y segundos de vigencia
+CACHE_LECTURAS_MAX = int(os.environ.get('CACHE_LECTURAS_MAX', 256))
+CACHE_LECTURAS_TTL = float(os.environ.get('CACHE_LECTURAS_TTL', 300))
+
+class CacheLecturas:
+    """Caché LRU con vencimiento, propia del proceso e invalidada por versión de tabla
+
+    Cada entrada depende de una tabla cuya versión se guarda en
+    versiones_tablas. Las escrituras llaman a invalidar() dentro de su
+    transacción; los demás procesos (y las demás conexiones del pool) lo
+    notan porque PRAGMA data_version de su conexión cambia, y solo entonces
+    releen las versiones. La versión en memoria cambia recién después del
+    commit: antes, otra conexión todavía lee las filas anteriores y podría
+    guardarlas con la versión nueva.
+    """
+
+    def __init__(self, maximo=CACHE_LECTURAS_MAX, ttl=CACHE_LECTURAS_TTL):
+        self.maximo = maximo
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()  # clave -> (valor, tabla, versión, vence)
+        self._versiones = {}
+
+    def _version(self, conn, tabla):
+        dato = conn.execute('PRAGMA data_version').fetchone()[0]
+        if getattr(conn, 'version_datos', None) != dato:
+            versiones = dict(conn.execute('SELECT tabla, version FROM versiones_tablas').fetchall())
+            with self._lock:
+                self._versiones = versiones
+            conn.version_datos = dato
+        return self._versiones.get(tabla, 0)
+
+    def obtener(self, clave, tabla, cargar):
+        """Valor de la clave, o el resultado de cargar(conn) si no está vigente"""
+        conn = get_db()
+        version = self._version(conn, tabla)
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada and entrada[2] == version and entrada[3] > ahora:
+                self._entradas.move_to_end(clave)
+                metricas.incrementar('tienda_cache_lecturas_total', clave=clave, resultado='acierto')
+                return entrada[0]
+        metricas.incrementar('tienda_cache_lecturas_total', clave=clave, resultado='fallo')
+
+        valor = cargar(conn)
+        with self._lock:
+            if self._versiones.get(tabla, 0) != version:
+                # Una escritura se confirmó mientras se cargaba: no guardar lo leído
+                return valor
+            self._entradas[clave] = (valor, tabla, version, ahora + self.ttl)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.maximo:
+                self._entradas.popitem(last=False)
+                metricas.incrementar('tienda_cache_desalojos_total')
+        return valor
+
+    def invalidar(self, cursor, tabla):
+        """Incrementa la versión de la tabla en la transacción en curso
+
+        Las entradas de la tabla se descartan cuando la transacción se
+        confirma; si se revierte, la caché queda como estaba.
+        """
+        cursor.execute('''
+            INSERT INTO versiones_tablas (tabla, version) VALUES (?, 1)
+            ON CONFLICT (tabla) DO UPDATE SET version = version + 1
+        ''', (tabla,))
+        cursor.execute('SELECT version FROM versiones_tablas WHERE tabla = ?', (tabla,))
+        version = cursor.fetchone()[0]
+
+        def aplicar():
+            with self._lock:
+                self._versiones[tabla] = max(version, self._versiones.get(tabla, 0))
+                for clave in [clave for clave, entrada in self._entradas.items() if entrada[1] == tabla]:
+                    del self._entradas[clave]
+
+        conn = cursor.connection
+        if hasattr(conn, 'al_confirmar'):
+            conn.al_confirmar(aplicar)
+        else:
+            aplicar()
+
+    def tamano(self):
+        with self._lock:
+            return len(self._entradas)
+
+cache_lecturas = CacheLecturas()
+
+def categorias_activas():
+    return cache_lecturas.obtener('categorias_activas', 'categorias', lambda conn: tuple(
+        conn.execute('SELECT * FROM categorias WHERE activo = 1 ORDER BY nombre').fetchall()))
+
+def lista_vendedores():
+    return cache_lecturas.obtener('vendedores', 'usuarios', lambda conn: tuple(
+        conn.execute('SELECT id, nombre_completo FROM usuarios ORDER BY nombre_completo').fetchall()))
+
+# Escritura diferida de registros no críticos (auditoría de accesos): se
+# agrupan en memoria y un hilo del proceso los escribe por lotes
+ESCRITURA_DIFERIDA = os.environ.get('ESCRITURA_DIFERIDA', '1') != '0'
+ESCRITURA_DIFERIDA_MAX = int(os.environ.get('ESCRITURA_DIFERIDA_MAX', 10000))
+ESCRITURA_DIFERIDA_LOTE = int(os.environ.get('ESCRITURA_DIFERIDA_LOTE', 500))
+ESCRITURA_DIFERIDA_INTERVALO = float(os.environ.get('ESCRITURA_DIFERIDA_INTERVALO', 1.0))
+log_escritura = logging.getLogger('tienda.escritura')
+
+class ColaEscritura:
+    """Cola acotada de inserciones que se escriben en segundo plano por lotes
+
+    encolar() solo agrega el registro a la cola. Un hilo del proceso los
+    escribe cuando junta `lote` registros o pasan `intervalo` segundos desde
+    el primero pendiente, en una transacción por lote y un executemany por
+    sentencia. Si la cola está llena, encolar() espera hasta `espera`
+    segundos y luego escribe el registro directamente: la petición se frena
+    al ritmo del escritor pero ningún registro se descarta. Solo es para
+    datos cuya pérdida ante una caída del proceso es aceptable; al terminar
+    el proceso se vacía la cola (atexit).
+    """
+
+    def __init__(self, activa=ESCRITURA_DIFERIDA, max_pendientes=ESCRITURA_DIFERIDA_MAX,
+                 lote=ESCRITURA_DIFERIDA_LOTE, intervalo=ESCRITURA_DIFERIDA_INTERVALO, espera=0.5):
+        self.activa = activa
+        self.lote = max(1, lote)
+        self.intervalo = intervalo
+        self.espera = espera
+        self._cola = queue.Queue(max_pendientes)
+        self._lock = threading.Lock()
+        self._hilo = None
+        # Conexiones propias del hilo escritor, por ruta de base de datos
+        self._conexiones = {}
+
+    def pendientes(self):
+        return self._cola.qsize()
+
+    def encolar(self, sql, params):
+        registro = (DATABASE, sql, tuple(params))
+        if self.activa:
+            self._iniciar()
+            try:
+                self._cola.put(registro, timeout=self.espera)
+                return
+            except queue.Full:
+                metricas.incrementar('tienda_escritura_diferida_directas_total')
+        self._escribir_directo(registro)
+
+    def vaciar(self):
+        """Espera a que se escriba todo lo encolado hasta ahora"""
+        if self._hilo is not None and self._hilo.is_alive():
+            self._cola.join()
+
+    def _iniciar(self):
+        # El hilo se crea con el primer registro: en servidores con varios
+        # procesos cada uno arranca el suyo después del fork
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._trabajar, name='escritura-diferida', daemon=True)
+                self._hilo.start()
+
+    def _trabajar(self):
+        while True:
+            registros = [self._cola.get()]
+            limite = time.monotonic() + self.intervalo
+            while len(registros) < self.lote:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    registros.append(self._cola.get(timeout=restante))
+                except queue.Empty:
+                    break
+            try:
+                self._escribir_lote(registros)
+            finally:
+                for _ in registros:
+                    self._cola.task_done()
+
+    def _escribir_lote(self, registros):
+        inicio = time.perf_counter()
+        por_base = {}
+        for ruta, sql, params in registros:
+            por_base.setdefault(ruta, {}).setdefault(sql, []).append(params)
+        for ruta, sentencias in por_base.items():
+            try:
+                conn = self._conexiones.get(ruta)
+                if conn is None:
+                    conn = self._conexiones[ruta] = crear_conexion(ruta)
+                with transaccion(conn):
+                    for sql, filas in sentencias.items():
+                        conn.executemany(sql, filas)
+            except Exception:
+                cantidad = sum(len(filas) for filas in sentencias.values())
+                metricas.incrementar('tienda_escritura_diferida_errores_total', cantidad)
+                log_escritura.exception('No se pudieron escribir %d registros diferidos en %s', cantidad, ruta)
+        # Las bases temporales de las herramientas de diagnóstico no se retienen
+        for ruta in [r for r in self._conexiones if r != DATABASE]:
+            self._conexiones.pop(ruta).close()
+        metricas.incrementar('tienda_escritura_diferida_registros_total', len(registros))
+        metricas.observar('tienda_escritura_diferida_vaciado_segundos', time.perf_counter() - inicio)
+
+    def _escribir_directo(self, registro):
+        ruta, sql, params = registro
+        if has_app_context() and ruta == DATABASE:
+            conn = get_db()
+            if conn.in_transaction:
+                # Dentro de una transacción del llamador se confirma con ella
+                conn.execute(sql, params)
+                return
+            with transaccion(conn):
+                conn.execute(sql, params)
+            return
+        conn = crear_conexion(ruta)
+        try:
+            with transaccion(conn):
+                conn.execute(sql, params)
+        finally:
+            conn.close()
+
+cola_escritura = ColaEscritura()
+atexit.register(cola_escritura.vaciar)
+
+def registrar_evento_acceso(evento, usuario_id=None, username=None):
+    """Encola un evento de acceso (ingreso, fallido, salida) de la petición actual"""
+    cola_escritura.encolar('''
+        INSERT INTO eventos_acceso (fecha, usuario_id, username, evento, ip, agente)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'), usuario_id, username, evento,
+          request.remote_addr, request.user_agent.string[:200]))
+
+# Alertas de stock en vivo: un hilo por proceso lee las alertas nuevas y las
+# reparte a los tableros conectados por Server-Sent Events
+ALERTAS_INTERVALO = float(os.environ.get('ALERTAS_INTERVALO', 1.0))
+ALERTAS_MEMORIA = int(os.environ.get('ALERTAS_MEMORIA', 500))
+ALERTAS_SSE_DURACION = int(os.environ.get('ALERTAS_SSE_DURACION', 300))
+ALERTAS_SSE_LATIDO = 15
+# alertas_stock conserva solo las últimas filas; las anteriores ya no se reenvían
+ALERTAS_CONSERVAR = int(os.environ.get('ALERTAS_CONSERVAR', 10000))
+ALERTAS_PODA_INTERVALO = 3600
+log_alertas = logging.getLogger('tienda.alertas')
+
+class VigiaAlertas:
+    """Publica a los tableros conectados los cruces del umbral de stock mínimo
+
+    Un solo hilo por proceso, con su propia conexión, consulta PRAGMA
+    data_version cada `intervalo` segundos y solo cuando otra conexión
+    confirmó cambios lee las alertas posteriores a la última conocida (por
+    clave primaria). Las últimas `memoria` alertas quedan en memoria y cada
+    flujo SSE espera en una condición: los clientes conectados no ocupan
+    conexiones del pool ni consultan la base. Cada hora el mismo hilo borra
+    de alertas_stock todo lo anterior a las últimas `conservar` alertas.
+    """
+
+    def __init__(self, intervalo=ALERTAS_INTERVALO, memoria=ALERTAS_MEMORIA, conservar=ALERTAS_CONSERVAR):
+        self.intervalo = intervalo
+        self.memoria = memoria
+        self.conservar = max(conservar, memoria)
+        self._condicion = threading.Condition()
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._clientes = 0
+        self._reiniciar(None)
+
+    def _reiniciar(self, ruta):
+        self._ruta = ruta
+        self._alertas = deque(maxlen=self.memoria)
+        self._ultimo = None       # id de la última alerta leída
+        self._descartadas = 0     # alertas con id <= a este ya no están en memoria
+        self._total = 0
+
+    def clientes(self):
+        return self._clientes
+
+    def _iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._trabajar, name='vigia-alertas', daemon=True)
+                self._hilo.start()
+
+    def _trabajar(self):
+        conn = version = None
+        proxima_poda = time.monotonic()
+        while True:
+            try:
+                if conn is None or self._ruta != DATABASE:
+                    if conn is not None:
+                        conn.close()
+                    conn = crear_conexion(DATABASE)
+                    version = None
+                    with self._condicion:
+                        self._reiniciar(DATABASE)
+                actual = conn.execute('PRAGMA data_version').fetchone()[0]
+                if actual != version:
+                    version = actual
+                    self._leer(conn)
+                if time.monotonic() >= proxima_poda:
+                    proxima_poda = time.monotonic() + ALERTAS_PODA_INTERVALO
+                    self._podar(conn)
+            except sqlite3.Error:
+                log_alertas.exception('No se pudieron leer las alertas de stock')
+                if conn is not None:
+                    conn.close()
+                conn = None
+            time.sleep(self.intervalo)
+
+    def _leer(self, conn):
+        if self._ultimo is None:
+            # Al arrancar se cargan las últimas alertas para los tableros que
+            # se abrieron antes que el hilo
+            maximo = conn.execute('SELECT COALESCE(MAX(id), 0) FROM alertas_stock').fetchone()[0]
+            desde = self._descartadas = max(0, maximo - self.memoria)
+        else:
+            desde = self._ultimo
+        filas = conn.execute('''
+            SELECT a.id, a.producto_id, a.tipo, a.stock, a.stock_minimo, a.fecha, p.codigo, p.nombre
+            FROM alertas_stock a
+            LEFT JOIN productos p ON p.id = a.producto_id
+            WHERE a.id > ?
+            ORDER BY a.id
+        ''', (desde,)).fetchall()
+        total = conn.execute('SELECT COUNT(*) FROM productos_stock_bajo').fetchone()[0]
+        with self._condicion:
+            for fila in filas:
+                if len(self._alertas) == self._alertas.maxlen:
+                    self._descartadas = self._alertas[0]['id']
+                self._alertas.append(dict(fila))
+            self._ultimo = filas[-1]['id'] if filas else desde
+            self._total = total
+            self._condicion.notify_all()
+        if filas and desde:
+            metricas.incrementar('tienda_alertas_stock_total', len(filas))
+
+    def _podar(self, conn):
+        try:
+            borradas = conn.execute('''
+                DELETE FROM alertas_stock WHERE id <= (SELECT MAX(id) FROM alertas_stock) - ?
+            ''', (self.conservar,)).rowcount
+            conn.commit()
+        except sqlite3.OperationalError:
+            # Base ocupada: se intenta de nuevo en la próxima poda
+            conn.rollback()
+            log_alertas.warning('No se pudieron podar las alertas de stock', exc_info=True)
+            return
+        if borradas:
+            log_alertas.info('%d alertas de stock antiguas borradas', borradas)
+
+    def escuchar(self, desde=None, duracion=ALERTAS_SSE_DURACION, latido=ALERTAS_SSE_LATIDO):
+        """Genera los mensajes SSE de las alertas posteriores a `desde`
+
+        Termina a los `duracion` segundos; el navegador reconecta solo y
+        envía el id del último mensaje recibido (Last-Event-ID).
+        """
+        self._iniciar()
+        fin = time.monotonic() + duracion
+        with self._condicion:
+            self._clientes += 1
+        try:
+            with self._condicion:
+                self._condicion.wait_for(lambda: self._ultimo is not None, timeout=latido)
+                if desde is None or desde > (self._ultimo or 0):
+                    desde = self._ultimo or 0
+                perdidas = desde < self._descartadas
+            yield 'retry: 3000\n\n'
+            if perdidas:
+                # El cliente se perdió alertas que ya no están en memoria
+                yield 'event: recargar\ndata: {}\n\n'
+                return
+            while True:
+                restante = fin - time.monotonic()
+                if restante <= 0:
+                    return
+                with self._condicion:
+                    self._condicion.wait_for(lambda: self._alertas and self._alertas[-1]['id'] > desde,
+                                             timeout=min(latido, restante))
+                    nuevas = [alerta for alerta in self._alertas if alerta['id'] > desde]
+                    total = self._total
+                if not nuevas:
+                    yield ': latido\n\n'
+                    continue
+                for alerta in nuevas:
+                    datos = json.dumps(dict(alerta, total=total), ensure_ascii=False)
+                    yield f'id: {alerta["id"]}\nevent: stock\ndata: {datos}\n\n'
+                desde = nuevas[-1]['id']
+        finally:
+            with self._condicion:
+                self._clientes -= 1
+
+vigia_alertas = VigiaAlertas()
+
+def _migracion_esquema_inicial(cursor):
+    """Tablas base del sistema y datos de ejemplo"""
+    # Tabla de usuarios
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            nombre_completo TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            rol TEXT NOT NULL CHECK(rol IN ('administrador', 'asesor')),
+            activo INTEGER DEFAULT 1,
+            fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Tabla de categorías
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS categorias (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT UNIQUE NOT NULL,
+            descripcion TEXT,
+            activo INTEGER DEFAULT 1
+        )
+    ''')
+    
+    # Tabla de productos
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS productos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            codigo TEXT UNIQUE NOT NULL,
+            nombre TEXT NOT NULL,
+            descripcion TEXT,
+            categoria_id INTEGER,
+            marca TEXT,
+            modelo TEXT,
+            precio REAL NOT NULL,
+            stock INTEGER DEFAULT 0,
+            stock_minimo INTEGER DEFAULT 5,
+            imagen_url TEXT,
+            activo INTEGER DEFAULT 1,
+            fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (categoria_id) REFERENCES categorias (id)
+        )
+    ''')
+    
+    # Tabla de clientes
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS clientes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            documento TEXT UNIQUE NOT NULL,
+            tipo_documento TEXT NOT NULL,
+            nombre TEXT NOT NULL,
+            apellido TEXT NOT NULL,
+            email TEXT,
+            telefono TEXT,
+            direccion TEXT,
+            fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Tabla de ventas
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ventas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            numero_venta TEXT UNIQUE NOT NULL,
+            cliente_id INTEGER,
+            usuario_id INTEGER,
+            fecha_venta TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            subtotal REAL NOT NULL,
+            igv REAL NOT NULL,
+            total REAL NOT NULL,
+            estado TEXT DEFAULT 'completada',
+            metodo_pago TEXT,
+            observaciones TEXT,
+            FOREIGN KEY (cliente_id) REFERENCES clientes (id),
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )
+    ''')
+    
+    # Tabla de detalle de ventas
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS detalle_ventas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            venta_id INTEGER,
+            producto_id INTEGER,
+            cantidad INTEGER NOT NULL,
+            precio_unitario REAL NOT NULL,
+            subtotal REAL NOT NULL,
+            FOREIGN KEY (venta_id) REFERENCES ventas (id),
+            FOREIGN KEY (producto_id) REFERENCES productos (id)
+        )
+    ''')
+    
+    # Tabla de historial de stock (nueva)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS historial_stock (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            producto_id INTEGER NOT NULL,
+            usuario_id INTEGER NOT NULL,
+            cantidad_anterior INTEGER NOT NULL,
+            cantidad_nueva INTEGER NOT NULL,
+            tipo_movimiento TEXT NOT NULL,
+            motivo TEXT,
+            fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (producto_id) REFERENCES productos (id),
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )
+    ''')
+    
+    # Bases creadas con el DDL anterior tenían la columna subtotal mal escrita
+    cursor.execute('PRAGMA table_info(ventas)')
+    if 'sdetalle' in [columna['name'] for columna in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE ventas RENAME COLUMN sdetalle TO subtotal')
+    
+    # Crear usuario administrador por defecto
+    cursor.execute("SELECT * FROM usuarios WHERE username = 'admin'")
+    if not cursor.fetchone():
+        hash_password= generate_password_hash('admin123')
+        cursor.execute('''
+            INSERT INTO usuarios (username, password, nombre_completo, email, rol)
+            VALUES (?, ?, ?, ?, ?)
+        ''', ('admin', hash_password, 'Administrador', 'admin@gpsmanagement.com', 'administrador'))
+        
+        # Crear usuario asesor por defecto
+        hash_password_asesor = generate_password_hash('asesor123')
+        cursor.execute('''
+            INSERT INTO usuarios (username, password, nombre_completo, email, rol)
+            VALUES (?, ?, ?, ?, ?)
+        ''', ('asesor', hash_password_asesor, 'Asesor de Ventas', 'asesor@gpsmanagement.com', 'asesor'))
+    
+    # Insertar categorías de ejemplo
+    cursor.execute("SELECT COUNT(*) as count FROM categorias")
+    if cursor.fetchone()['count'] == 0:
+        categorias = [
+            ('Laptops', 'Computadoras portátiles de diferentes marcas'),
+            ('Smartphones', 'Teléfonos inteligentes'),
+            ('Tablets', 'Tabletas y iPads'),
+            ('Accesorios', 'Accesorios tecnológicos diversos'),
+            ('Componentes', 'Componentes de computadora'),
+            ('Audio', 'Audífonos, parlantes y equipos de audio'),
+            ('Gaming', 'Productos para videojuegos')
+        ]
+        cursor.executemany('INSERT INTO categorias (nombre, descripcion) VALUES (?, ?)', categorias)
+    
+    # Insertar productos de ejemplo
+    cursor.execute("SELECT COUNT(*) as count FROM productos")
+    if cursor.fetchone()['count'] == 0:
+        productos = [
+            ('LAP001', 'Laptop HP Pavilion 15', 'Laptop con procesador Intel Core i5, 8GB RAM, 256GB SSD', 1, 'HP', 'Pavilion 15', 2499.00, 15, 5, None),
+            ('LAP002', 'Laptop Lenovo IdeaPad', 'Laptop con procesador AMD Ryzen 5, 16GB RAM, 512GB SSD', 1, 'Lenovo', 'IdeaPad 3', 2799.00, 10, 5, None),
+            ('CEL001', 'iPhone 15 Pro', 'Smartphone Apple con chip A17 Pro, 256GB', 2, 'Apple', 'iPhone 15 Pro', 5499.00, 8, 3, None),
+            ('CEL002', 'Samsung Galaxy S24', 'Smartphone Samsung con 256GB y cámara de 50MP', 2, 'Samsung', 'Galaxy S24', 4299.00, 12, 5, None),
+            ('TAB001', 'iPad Air', 'Tablet Apple con chip M1 y pantalla de 10.9"', 3, 'Apple', 'iPad Air', 3499.00, 6, 3, None),
+            ('ACC001', 'Mouse Logitech MX Master', 'Mouse ergonómico inalámbrico', 4, 'Logitech', 'MX Master 3S', 349.00, 25, 10, None),
+            ('ACC002', 'Teclado Mecánico RGB', 'Teclado gaming con switches mecánicos', 4, 'Corsair', 'K95 RGB', 599.00, 18, 8, None),
+            ('AUD001', 'Audífonos Sony WH-1000XM5', 'Audífonos con cancelación de ruido', 6, 'Sony', 'WH-1000XM5', 1299.00, 20, 10, None)
+        ]
+        cursor.executemany('''
+            INSERT INTO productos (codigo, nombre, descripcion, categoria_id, marca, modelo, precio, stock, stock_minimo, imagen_url)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', productos)
+
+def _migracion_indices(cursor):
+    """Índices para los listados paginados, el dashboard y los detalles de venta"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_productos_activo ON productos(activo, stock)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_productos_activo_nombre ON productos(activo, nombre)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ventas_fecha ON ventas(fecha_venta)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ventas_usuario ON ventas(usuario_id, fecha_venta)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_detalle_venta ON detalle_ventas(venta_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_clientes_nombre ON clientes(nombre, apellido)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_usuarios_nombre ON usuarios(nombre_completo)')
+
+def _migracion_indices_consultas(cursor):
+    """Índices exigidos por `flask verificar-planes`: historial por fecha y alertas de stock"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_historial_producto_fecha ON historial_stock(producto_id, fecha)')
+    # (activo, stock) con stock_minimo incluido: el conteo de stock crítico se
+    # resuelve solo con el índice y el listado del dashboard sale ya ordenado
+    cursor.execute('DROP INDEX IF EXISTS idx_productos_activo')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_productos_activo_stock ON productos(activo, stock, stock_minimo)')
+
+def _migracion_versiones_tablas(cursor):
+    """Versión por tabla para invalidar las cachés de lectura entre procesos"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS versiones_tablas (
+            tabla TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.executemany('INSERT OR IGNORE INTO versiones_tablas (tabla) VALUES (?)', [('categorias',), ('usuarios',)])
+
+# Tablas cuya versión mantienen triggers (ETag de las vistas condicionales)
+TABLAS_VERSIONADAS = ('productos', 'clientes', 'categorias', 'ventas')
+
+def _migracion_versiones_triggers(cursor):
+    """Triggers que incrementan la versión de una tabla con cada cambio"""
+    cursor.executemany('INSERT OR IGNORE INTO versiones_tablas (tabla) VALUES (?)', [(t,) for t in TABLAS_VERSIONADAS])
+    for tabla in TABLAS_VERSIONADAS:
+        for evento in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS version_{tabla}_{evento.lower()} AFTER {evento} ON {tabla} BEGIN
+                    UPDATE versiones_tablas SET version = version + 1 WHERE tabla = '{tabla}';
+                END
+            ''')
+
+def _migracion_version_productos(cursor):
+    """Versión por fila en productos para la sincronización por delta de /api/productos/lote"""
+    cursor.execute('PRAGMA table_info(productos)')
+    if 'version' not in [columna['name'] for columna in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE productos ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+    cursor.execute('DROP TRIGGER IF EXISTS version_productos_insert')
+    cursor.execute('DROP TRIGGER IF EXISTS version_productos_update')
+    # Las filas existentes quedan en una versión nueva (> 0): desde=0 las incluye
+    cursor.execute("UPDATE versiones_tablas SET version = version + 1 WHERE tabla = 'productos'")
+    cursor.execute("UPDATE productos SET version = (SELECT version FROM versiones_tablas WHERE tabla = 'productos')")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_productos_version ON productos(version)')
+    # Cada alta o cambio incrementa la versión de la tabla y la copia en la fila
+    for evento in ('INSERT', 'UPDATE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS version_productos_{evento.lower()} AFTER {evento} ON productos BEGIN
+                UPDATE versiones_tablas SET version = version + 1 WHERE tabla = 'productos';
+                UPDATE productos SET version = (SELECT version FROM versiones_tablas WHERE tabla = 'productos')
+                WHERE id = new.id;
+            END
+        ''')
+
+def _migracion_idempotencia_ventas(cursor):
+    """Claves de idempotencia de las ventas recibidas por /api/ventas/lote"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ventas_idempotencia (
+            clave TEXT PRIMARY KEY,
+            venta_id INTEGER NOT NULL,
+            numero_venta TEXT NOT NULL,
+            fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    ''')
+
+def _migracion_instantaneas_stock(cursor):
+    """Instantáneas periódicas del stock para consultar el inventario en cualquier fecha"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS instantaneas_stock (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fecha TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            historial_id INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS instantaneas_stock_detalle (
+            instantanea_id INTEGER NOT NULL,
+            producto_id INTEGER NOT NULL,
+            stock INTEGER NOT NULL,
+            PRIMARY KEY (instantanea_id, producto_id),
+            FOREIGN KEY (instantanea_id) REFERENCES instantaneas_stock (id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_instantaneas_stock_fecha ON instantaneas_stock(fecha)')
+    # Movimientos de todos los productos en un rango de fechas
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_historial_fecha ON historial_stock(fecha)')
+    cursor.execute('SELECT 1 FROM instantaneas_stock LIMIT 1')
+    if cursor.fetchone() is None:
+        tomar_instantanea_stock(cursor)
+
+def _migracion_eventos_acceso(cursor):
+    """Registro de ingresos, intentos fallidos y salidas de los usuarios"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS eventos_acceso (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fecha TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            usuario_id INTEGER,
+            username TEXT,
+            evento TEXT NOT NULL CHECK(evento IN ('ingreso', 'fallido', 'salida')),
+            ip TEXT,
+            agente TEXT
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_eventos_acceso_usuario ON eventos_acceso(usuario_id, evento, fecha)')
+
+def _migracion_stock_bajo(cursor):
+    crear_stock_bajo(cursor)
+    reconstruir_stock_bajo(cursor)
+
+def _migracion_archivo_ventas(cursor):
+    """Registro de los meses de ventas archivados y mes de cada venta archivada"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archivos_ventas (
+            mes TEXT PRIMARY KEY,
+            archivo TEXT NOT NULL,
+            ventas INTEGER NOT NULL,
+            lineas INTEGER NOT NULL,
+            total REAL NOT NULL,
+            fecha_archivo TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ventas_archivadas (
+            venta_id INTEGER PRIMARY KEY,
+            mes TEXT NOT NULL
+        )
+    ''')
+
+def _migracion_secuencias(cursor):
+    """Tabla de secuencias para numeración de documentos"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS secuencias (
+            serie TEXT PRIMARY KEY,
+            prefijo TEXT NOT NULL,
+            ultimo INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+def _migracion_busqueda(cursor):
+    crear_indices_busqueda(cursor)
+
+def _migracion_resumen_diario(cursor):
+    crear_resumen_diario(cursor)
+    reconstruir_resumen_diario(cursor)
+
+def _migracion_resumen_productos(cursor):
+    crear_resumen_productos(cursor)
+    reconstruir_resumen_productos(cursor)
+
+# Migraciones en orden: la versión del esquema (PRAGMA user_version) es la
+# cantidad de migraciones aplicadas. Cada paso debe ser idempotente y las
+# nuevas migraciones se agregan siempre al final.
+MIGRACIONES = [
+    _migracion_esquema_inicial,
+    _migracion_indices,
+    _migracion_busqueda,
+    _migracion_secuencias,
+    _migracion_resumen_diario,
+    _migracion_resumen_productos,
+    _migracion_indices_consultas,
+    _migracion_versiones_tablas,
+    _migracion_versiones_triggers,
+    _migracion_version_productos,
+    _migracion_idempotencia_ventas,
+    _migracion_instantaneas_stock,
+    _migracion_eventos_acceso,
+    _migracion_stock_bajo,
+    _migracion_archivo_ventas,
+]
+
+def version_esquema(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrar(conn, hasta=None):
+    """Aplica las migraciones pendientes, cada una en su propia transacción
+
+    Retorna la lista de versiones aplicadas.
+    """
+    hasta = len(MIGRACIONES) if hasta is None else hasta
+    aplicadas = []
+    version = version_esquema(conn)
+    while version < hasta:
+        with transaccion(conn):
+            # Otro proceso pudo migrar mientras se esperaba el bloqueo
+            version = version_esquema(conn)
+            if version >= hasta:
+                break
+            MIGRACIONES[version](conn.cursor())
+            version += 1
+            conn.execute(f'PRAGMA user_version = {version}')
+        aplicadas.append(version)
+    return aplicadas
+
+def init_db():
+    """Inicializa la base de datos aplicando las migraciones pendientes
+
+    Si el esquema está al día el costo es una sola lectura de PRAGMA.
+    """
+    conn = get_db()
+    if version_esquema(conn) < len(MIGRACIONES):
+        migrar(conn)
+    if not has_app_context():
+        conn.close()
+
+def crear_indices_busqueda(cursor):
+    """Crea las tablas FTS5 de búsqueda y los triggers que las sincronizan"""
+    for tabla, columnas in INDICES_BUSQUEDA.items():
+        fts = f'{tabla}_fts'
+        cols = ', '.join(columnas)
+        nuevos = ', '.join(f'new.{c}' for c in columnas)
+        viejos = ', '.join(f'old.{c}' for c in columnas)
+
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts,))
+        existe = cursor.fetchone() is not None
+
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                {cols}, content='{tabla}', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            )
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {tabla} BEGIN
+                INSERT INTO {fts} (rowid, {cols}) VALUES (new.id, {nuevos});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {tabla} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.id, {viejos});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {tabla} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.id, {viejos});
+                INSERT INTO {fts} (rowid, {cols}) VALUES (new.id, {nuevos});
+            END
+        ''')
+        if not existe:
+            cursor.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+def _ajuste_resumen_diario(fila, signo):
+    """Sentencias que suman (o restan) una venta en su fila de detalle y en el total del día"""
+    sentencias = []
+    for metodo, usuario in ((f"COALESCE({fila}.metodo_pago, '')", f'COALESCE({fila}.usuario_id, 0)'), ("'*'", '0')):
+        sentencias.append(f'''
+                INSERT INTO ventas_diarias (fecha, metodo_pago, usuario_id, num_ventas, subtotal, igv, total)
+                VALUES (DATE({fila}.fecha_venta), {metodo}, {usuario}, {signo}1, {signo}{fila}.subtotal, {signo}{fila}.igv, {signo}{fila}.total)
+                ON CONFLICT (fecha, metodo_pago, usuario_id) DO UPDATE SET
+                    num_ventas = num_ventas + excluded.num_ventas,
+                    subtotal = subtotal + excluded.subtotal,
+                    igv = igv + excluded.igv,
+                    total = total + excluded.total;''')
+    if signo == '-':
+        sentencias.append(f'''
+                DELETE FROM ventas_diarias WHERE fecha = DATE({fila}.fecha_venta) AND num_ventas = 0;''')
+    return ''.join(sentencias)
+
+def crear_resumen_diario(cursor):
+    """Crea la tabla ventas_diarias y los triggers que la actualizan
+
+    Hay una fila por fecha, método de pago y vendedor, y una fila de total
+    del día con metodo_pago = '*' y usuario_id = 0. Las ventas anuladas no
+    se suman. Como los triggers corren dentro de la transacción que escribe
+    la venta, el resumen nunca queda desfasado.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ventas_diarias (
+            fecha TEXT NOT NULL,
+            metodo_pago TEXT NOT NULL,
+            usuario_id INTEGER NOT NULL,
+            num_ventas INTEGER NOT NULL DEFAULT 0,
+            subtotal REAL NOT NULL DEFAULT 0,
+            igv REAL NOT NULL DEFAULT 0,
+            total REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (fecha, metodo_pago, usuario_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS ventas_diarias_ai AFTER INSERT ON ventas
+        WHEN new.estado IS NOT 'anulada' BEGIN{_ajuste_resumen_diario('new', '+')}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS ventas_diarias_ad AFTER DELETE ON ventas
+        WHEN old.estado IS NOT 'anulada' BEGIN{_ajuste_resumen_diario('old', '-')}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS ventas_diarias_au_old
+        AFTER UPDATE OF fecha_venta, usuario_id, subtotal, igv, total, estado, metodo_pago ON ventas
+        WHEN old.estado IS NOT 'anulada' BEGIN{_ajuste_resumen_diario('old', '-')}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS ventas_diarias_au_new
+        AFTER UPDATE OF fecha_venta, usuario_id, subtotal, igv, total, estado, metodo_pago ON ventas
+        WHEN new.estado IS NOT 'anulada' BEGIN{_ajuste_resumen_diario('new', '+')}
+        END
+    ''')
+
+def reconstruir_resumen_diario(cursor):
+    """Recalcula ventas_diarias desde la tabla ventas (dentro de la transacción del llamador)
+
+    Los días de meses archivados conservan su resumen: sus ventas ya no
+    están en la tabla.
+    """
+    archivados = json.dumps(meses_archivados(cursor))
+    cursor.execute('DELETE FROM ventas_diarias WHERE SUBSTR(fecha, 1, 7) NOT IN (SELECT value FROM json_each(?))',
+                   (archivados,))
+    cursor.execute('''
+        INSERT INTO ventas_diarias (fecha, metodo_pago, usuario_id, num_ventas, subtotal, igv, total)
+        SELECT DATE(fecha_venta), COALESCE(metodo_pago, ''), COALESCE(usuario_id, 0),
+               COUNT(*), SUM(subtotal), SUM(igv), SUM(total)
+        FROM ventas
+        WHERE estado IS NOT 'anulada'
+        GROUP BY 1, 2, 3
+    ''')
+    cursor.execute('''
+        INSERT INTO ventas_diarias (fecha, metodo_pago, usuario_id, num_ventas, subtotal, igv, total)
+        SELECT fecha, '*', 0, SUM(num_ventas), SUM(subtotal), SUM(igv), SUM(total)
+        FROM ventas_diarias
+        WHERE SUBSTR(fecha, 1, 7) NOT IN (SELECT value FROM json_each(?))
+        GROUP BY fecha
+    ''', (archivados,))
+    return cursor.rowcount
+
+def _ajuste_resumen_productos(origen, mes, signo):
+    """Sentencias que suman (o restan) líneas de venta en ventas_productos_mes
+
+    origen es un SELECT que entrega producto_id, unidades, ingresos y
+    num_ventas; mes la expresión del mes afectado.
+    """
+    sentencias = f'''
+                INSERT INTO ventas_productos_mes (mes, producto_id, unidades, ingresos, num_ventas)
+                SELECT {mes}, producto_id, {signo}unidades, {signo}ingresos, {signo}num_ventas FROM ({origen}) WHERE true
+                ON CONFLICT (mes, producto_id) DO UPDATE SET
+                    unidades = unidades + excluded.unidades,
+                    ingresos = ingresos + excluded.ingresos,
+                    num_ventas = num_ventas + excluded.num_ventas;'''
+    if signo == '-':
+        sentencias += f'''
+                DELETE FROM ventas_productos_mes WHERE mes = {mes} AND num_ventas = 0;'''
+    return sentencias
+
+def crear_resumen_productos(cursor):
+    """Crea la tabla ventas_productos_mes y los triggers que la actualizan
+
+    Guarda unidades, ingresos y cantidad de ventas por mes y producto. Se
+    actualiza al insertar o borrar líneas de detalle y cuando una venta
+    cambia de fecha o de estado (las anuladas no se suman).
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ventas_productos_mes (
+            mes TEXT NOT NULL,
+            producto_id INTEGER NOT NULL,
+            unidades INTEGER NOT NULL DEFAULT 0,
+            ingresos REAL NOT NULL DEFAULT 0,
+            num_ventas INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (mes, producto_id)
+        ) WITHOUT ROWID
+    ''')
+    mes_linea = "(SELECT strftime('%Y-%m', fecha_venta) FROM ventas WHERE id = {fila}.venta_id)"
+    linea = 'SELECT {fila}.producto_id AS producto_id, {fila}.cantidad AS unidades, {fila}.subtotal AS ingresos, 1 AS num_ventas'
+    lineas_venta = '''SELECT producto_id, SUM(cantidad) AS unidades, SUM(subtotal) AS ingresos, COUNT(*) AS num_ventas
+                   FROM detalle_ventas WHERE venta_id = {fila}.id GROUP BY producto_id'''
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS ventas_productos_mes_ai AFTER INSERT ON detalle_ventas
+        WHEN (SELECT estado FROM ventas WHERE id = new.venta_id) IS NOT 'anulada' BEGIN{_ajuste_resumen_productos(linea.format(fila='new'), mes_linea.format(fila='new'), '+')}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS ventas_productos_mes_ad AFTER DELETE ON detalle_ventas
+        WHEN (SELECT estado FROM ventas WHERE id = old.venta_id) IS NOT 'anulada' BEGIN{_ajuste_resumen_productos(linea.format(fila='old'), mes_linea.format(fila='old'), '-')}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS ventas_productos_mes_vd AFTER DELETE ON ventas
+        WHEN old.estado IS NOT 'anulada' BEGIN{_ajuste_resumen_productos(lineas_venta.format(fila='old'), "strftime('%Y-%m', old.fecha_venta)", '-')}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS ventas_productos_mes_vu_old AFTER UPDATE OF fecha_venta, estado ON ventas
+        WHEN old.estado IS NOT 'anulada' BEGIN{_ajuste_resumen_productos(lineas_venta.format(fila='old'), "strftime('%Y-%m', old.fecha_venta)", '-')}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS ventas_productos_mes_vu_new AFTER UPDATE OF fecha_venta, estado ON ventas
+        WHEN new.estado IS NOT 'anulada' BEGIN{_ajuste_resumen_productos(lineas_venta.format(fila='new'), "strftime('%Y-%m', new.fecha_venta)", '+')}
+        END
+    ''')
+
+def reconstruir_resumen_productos(cursor):
+    """Recalcula ventas_productos_mes desde ventas y detalle_ventas (dentro de la transacción del llamador)
+
+    Los meses archivados conservan su resumen.
+    """
+    cursor.execute('DELETE FROM ventas_productos_mes WHERE mes NOT IN (SELECT value FROM json_each(?))',
+                   (json.dumps(meses_archivados(cursor)),))
+    cursor.execute('''
+        INSERT INTO ventas_productos_mes (mes, producto_id, unidades, ingresos, num_ventas)
+        SELECT strftime('%Y-%m', v.fecha_venta), dv.producto_id,
+               SUM(dv.cantidad), SUM(dv.subtotal), COUNT(*)
+        FROM detalle_ventas dv
+        JOIN ventas v ON v.id = dv.venta_id
+        WHERE v.estado IS NOT 'anulada'
+        GROUP BY 1, 2
+    ''')
+    return cursor.rowcount
+
+# Conjunto de productos con stock bajo: los triggers de productos lo mantienen
+# al día en la misma transacción que cambia el stock (ventas, ediciones,
+# importaciones) y anotan cada cruce del umbral en alertas_stock, que el
+# vigía de alertas publica a los tableros conectados
+STOCK_BAJO = 'IFNULL({fila}.activo = 1 AND {fila}.stock <= {fila}.stock_minimo, 0)'
+
+def crear_stock_bajo(cursor):
+    """Crea productos_stock_bajo, alertas_stock y los triggers que los actualizan"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS productos_stock_bajo (
+            producto_id INTEGER PRIMARY KEY,
+            desde TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS alertas_stock (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            producto_id INTEGER NOT NULL,
+            tipo TEXT NOT NULL CHECK(tipo IN ('bajo', 'normal')),
+            stock INTEGER,
+            stock_minimo INTEGER,
+            fecha TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    entra = '''
+                INSERT OR IGNORE INTO productos_stock_bajo (producto_id) VALUES (new.id);
+                INSERT INTO alertas_stock (producto_id, tipo, stock, stock_minimo)
+                VALUES (new.id, 'bajo', new.stock, new.stock_minimo);'''
+    sale = '''
+                DELETE FROM productos_stock_bajo WHERE producto_id = {fila}.id;
+                INSERT INTO alertas_stock (producto_id, tipo, stock, stock_minimo)
+                VALUES ({fila}.id, 'normal', {fila}.stock, {fila}.stock_minimo);'''
+    nuevo, anterior = STOCK_BAJO.format(fila='new'), STOCK_BAJO.format(fila='old')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS stock_bajo_ai AFTER INSERT ON productos
+        WHEN {nuevo} BEGIN{entra}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS stock_bajo_entra AFTER UPDATE OF stock, stock_minimo, activo ON productos
+        WHEN {nuevo} AND NOT {anterior} BEGIN{entra}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS stock_bajo_sale AFTER UPDATE OF stock, stock_minimo, activo ON productos
+        WHEN {anterior} AND NOT {nuevo} BEGIN{sale.format(fila='new')}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS stock_bajo_ad AFTER DELETE ON productos
+        WHEN {anterior} BEGIN{sale.format(fila='old')}
+        END
+    ''')
+
+def reconstruir_stock_bajo(cursor):
+    """Recalcula productos_stock_bajo desde productos (sin generar alertas)"""
+    cursor.execute('DELETE FROM productos_stock_bajo')
+    cursor.execute(f'''
+        INSERT INTO productos_stock_bajo (producto_id)
+        SELECT id FROM productos WHERE {STOCK_BAJO.format(fila='productos')}
+    ''')
+    return cursor.rowcount
+
+def consulta_fts(texto):
+    """Convierte el texto del usuario en una consulta FTS5 por prefijos"""
+    terminos = [t for t in ''.join(c if c.isalnum() else ' ' for c in texto).split() if t]
+    return ' '.join(f'"{t}"*' for t in terminos)
+
+def registrar_historial_stock(cursor, producto_id, usuario_id, cantidad_anterior, cantidad_nueva, tipo_movimiento, motivo=''):
+    """Agrega un movimiento al historial dentro de la transacción del llamador (sin commit)"""
+    cursor.execute('''
+        INSERT INTO historial_stock (producto_id, usuario_id, cantidad_anterior, cantidad_nueva, tipo_movimiento, motivo)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (producto_id, usuario_id, cantidad_anterior, cantidad_nueva, tipo_movimiento, motivo))
+
+# Instantáneas de stock: el historial es el libro de movimientos y cada
+# instantánea guarda el stock de todos los productos junto con el último
+# movimiento que incluye, para reconstruir el stock en cualquier fecha
+def tomar_instantanea_stock(cursor):
+    """Guarda el stock actual de todos los productos y retorna el id de la instantánea
+
+    Debe ejecutarse dentro de una transacción de escritura para que el stock
+    y el último movimiento del historial correspondan al mismo momento.
+    """
+    cursor.execute('SELECT COALESCE(MAX(id), 0) FROM historial_stock')
+    historial_id = cursor.fetchone()[0]
+    cursor.execute('INSERT INTO instantaneas_stock (historial_id) VALUES (?)', (historial_id,))
+    instantanea_id = cursor.lastrowid
+    cursor.execute('''
+        INSERT INTO instantaneas_stock_detalle (instantanea_id, producto_id, stock)
+        SELECT ?, id, COALESCE(stock, 0) FROM productos
+    ''', (instantanea_id,))
+    return instantanea_id
+
+def normalizar_momento(valor):
+    """Convierte 'AAAA-MM-DD' o 'AAAA-MM-DDTHH:MM[:SS]' al formato de fecha de SQLite
+
+    Una fecha sin hora se interpreta como el final de ese día.
+    """
+    valor = (valor or '').strip()
+    if len(valor) == 10:
+        valor += ' 23:59:59'
+    return datetime.fromisoformat(valor).strftime('%Y-%m-%d %H:%M:%S')
+
+def consultar_stock_en(cursor, momento, producto_id=None):
+    """Ejecuta la consulta del stock de un producto (o de todos) en `momento`
+
+    Parte de la última instantánea anterior a `momento` y le suma los
+    movimientos posteriores a ella hasta `momento`. Si no hay ninguna
+    anterior, parte de la primera posterior (o del stock actual) y le resta
+    los movimientos entre `momento` y ella. En ambos casos solo se recorren
+    los movimientos entre la instantánea y `momento`. El cursor queda con
+    filas (id, codigo, nombre, stock) listas para fetchall() o exportación.
+    """
+    params = {'momento': momento, 'producto_id': producto_id}
+    cursor.execute('''
+        SELECT id, fecha, historial_id FROM instantaneas_stock
+        WHERE fecha <= ? ORDER BY fecha DESC, id DESC LIMIT 1
+    ''', (momento,))
+    base = cursor.fetchone()
+    if base is not None:
+        signo = '+'
+        rango = 'h.id > :historial_id AND h.fecha >= :fecha_base AND h.fecha <= :momento'
+    else:
+        cursor.execute('''
+            SELECT id, fecha, historial_id FROM instantaneas_stock
+            WHERE fecha > ? ORDER BY fecha, id LIMIT 1
+        ''', (momento,))
+        base = cursor.fetchone()
+        signo = '-'
+        rango = 'h.id <= :historial_id AND h.fecha > :momento AND h.fecha <= :fecha_base'
+    if base is not None:
+        params.update(instantanea_id=base['id'], historial_id=base['historial_id'], fecha_base=base['fecha'])
+        stock_base = 'SELECT producto_id, stock FROM instantaneas_stock_detalle WHERE instantanea_id = :instantanea_id'
+    else:
+        # Sin instantáneas: el stock actual hace de instantánea al final del historial
+        cursor.execute('SELECT COALESCE(MAX(id), 0), CURRENT_TIMESTAMP FROM historial_stock')
+        params['historial_id'], params['fecha_base'] = cursor.fetchone()
+        stock_base = 'SELECT id AS producto_id, stock FROM productos'
+
+    # La reconstrucción de cada producto recorre solo sus movimientos entre la
+    # instantánea y `momento` en idx_historial_producto_fecha
+    cursor.execute(f'''
+        SELECT p.id, p.codigo, p.nombre,
+               COALESCE(b.stock, 0) {signo} COALESCE((
+                   SELECT SUM(h.cantidad_nueva - h.cantidad_anterior) FROM historial_stock h
+                   WHERE h.producto_id = p.id AND {rango}
+               ), 0) AS stock
+        FROM productos p
+        LEFT JOIN ({stock_base}) b ON b.producto_id = p.id
+        {'WHERE p.id = :producto_id' if producto_id is not None else 'ORDER BY p.codigo'}
+    ''', params)
+    return cursor
+
+# Numeración de documentos
+class Numerador:
+    """Asigna números correlativos por serie usando la tabla secuencias
+
+    Cada número cuesta una actualización por clave primaria dentro de la
+    transacción del llamador. Con bloque > 1 el proceso reserva varios
+    números de una vez y los entrega desde memoria; si la transacción que
+    reservó el bloque se revierte, el bloque se descarta con descartar().
+    """
+
+    def __init__(self, bloque=1):
+        self.bloque = max(1, bloque)
+        self._lock = threading.Lock()
+        self._bloques = {}
+
+    def _reservar(self, cursor, serie, cantidad):
+        cursor.execute('UPDATE secuencias SET ultimo = ultimo + ? WHERE serie = ?', (cantidad, serie))
+        if cursor.rowcount == 0:
+            # Serie nueva: continúa desde el mayor número ya emitido con ese prefijo
+            cursor.execute('''
+                INSERT OR IGNORE INTO secuencias (serie, prefijo, ultimo)
+                SELECT ?, ?, COALESCE(MAX(CAST(SUBSTR(numero_venta, ?) AS INTEGER)), 0)
+                FROM ventas WHERE numero_venta LIKE ?
+            ''', (serie, serie, len(serie) + 2, serie + '-%'))
+            cursor.execute('UPDATE secuencias SET ultimo = ultimo + ? WHERE serie = ?', (cantidad, serie))
+        cursor.execute('SELECT prefijo, ultimo FROM secuencias WHERE serie = ?', (serie,))
+        fila = cursor.fetchone()
+        return fila['prefijo'], fila['ultimo']
+
+    def siguiente(self, cursor, serie=SERIE_VENTA):
+        """Retorna el siguiente número formateado de la serie (p. ej. VTA-000042)"""
+        if self.bloque == 1:
+            prefijo, numero = self._reservar(cursor, serie, 1)
+            return f'{prefijo}-{numero:06d}'
+
+        with self._lock:
+            actual = self._bloques.get(serie)
+            if actual is None or actual[1] > actual[2]:
+                prefijo, limite = self._reservar(cursor, serie, self.bloque)
+                actual = [prefijo, limite - self.bloque + 1, limite]
+                self._bloques[serie] = actual
+            numero = actual[1]
+            actual[1] += 1
+            return f'{actual[0]}-{numero:06d}'
+
+    def reservar(self, cursor, cantidad, serie=SERIE_VENTA):
+        """Reserva cantidad números consecutivos de la serie y los retorna formateados
+
+        No usa el bloque en memoria: los números quedan dentro de la
+        transacción del llamador y se liberan solos si esta se revierte.
+        """
+        prefijo, limite = self._reservar(cursor, serie, cantidad)
+        return [f'{prefijo}-{numero:06d}' for numero in range(limite - cantidad + 1, limite + 1)]
+
+    def descartar(self, serie=SERIE_VENTA):
+        """Olvida el bloque en memoria de una serie (tras un rollback)"""
+        with self._lock:
+            self._bloques.pop(serie, None)
+
+numerador = Numerador(NUMERACION_BLOQUE)
+
+# Motor de ventas
+IGV = 0.18
+
+class VentaError(Exception):
+    """Error de validación que impide registrar una venta"""
+
+def consolidar_lineas(lineas):
+    """Agrupa las líneas del carrito por producto sumando sus cantidades"""
+    cantidades = {}
+    for prod_id, cant in lineas:
+        # int() aceptaría true como 1 y truncaría 1.5 a 1: se rechazan antes
+        if isinstance(prod_id, bool) or isinstance(cant, bool) or (isinstance(cant, float) and not cant.is_integer()):
+            raise VentaError('Producto o cantidad inválidos')
+        if not prod_id or not cant:
+            continue
+        try:
+            prod_id, cant = int(prod_id), int(cant)
+        except (TypeError, ValueError):
+            raise VentaError('Producto o cantidad inválidos')
+        if cant <= 0:
+            raise VentaError('La cantidad debe ser mayor a cero')
+        cantidades[prod_id] = cantidades.get(prod_id, 0) + cant
+    return cantidades
+
+def registrar_venta(conn, usuario_id, lineas, cliente_id=None, metodo_pago=None, observaciones='', serie=SERIE_VENTA):
+    """Registra una venta con sus detalles y descuenta stock de forma atómica
+
+    Toda la operación ocurre en una transacción BEGIN IMMEDIATE: los
+    productos del carrito se leen en una sola consulta, el stock se descuenta
+    con un UPDATE condicional por lotes y, si alguna línea quedara en
+    negativo, la venta completa se revierte. Retorna (venta_id, numero_venta).
+    """
+    cantidades = consolidar_lineas(lineas)
+    if not cantidades:
+        raise VentaError('Debe agregar al menos un producto')
+
+    ids = list(cantidades)
+    marcadores = ','.join('?' * len(ids))
+
+    cursor = conn.cursor()
+    inicio = time.perf_counter()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        cursor.execute(f'SELECT id, nombre, precio, stock FROM productos WHERE activo = 1 AND id IN ({marcadores})', ids)
+        productos = {p['id']: p for p in cursor.fetchall()}
+
+        if len(productos) != len(ids):
+            raise VentaError('Producto no encontrado')
+
+        subtotal = 0
+        detalles = []
+        for prod_id, cantidad in cantidades.items():
+            producto = productos[prod_id]
+            if cantidad > producto['stock']:
+                raise VentaError(f'Stock insuficiente para {producto["nombre"]}. Disponible: {producto["stock"]}')
+            subtotal_item = producto['precio'] * cantidad
+            detalles.append((prod_id, cantidad, producto['precio'], subtotal_item))
+            subtotal += subtotal_item
+
+        igv = subtotal * IGV
+        total = subtotal + igv
+
+        num_venta = numerador.siguiente(cursor, serie)
+
+        cursor.execute('''
+            INSERT INTO ventas (numero_venta, cliente_id, usuario_id, subtotal, igv, total, metodo_pago, observaciones)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (num_venta, cliente_id or None, usuario_id, subtotal, igv, total, metodo_pago, observaciones))
+        venta_id = cursor.lastrowid
+
+        # Descuento condicional: ninguna fila puede quedar con stock negativo
+        cursor.executemany(
+            'UPDATE productos SET stock = stock - ? WHERE id = ? AND stock >= ?',
+            [(cantidad, prod_id, cantidad) for prod_id, cantidad in cantidades.items()]
+        )
+        if cursor.rowcount != len(ids):
+            raise VentaError('Stock insuficiente: otro usuario vendió las últimas unidades')
+
+        cursor.executemany('''
+            INSERT INTO detalle_ventas (venta_id, producto_id, cantidad, precio_unitario, subtotal)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(venta_id,) + detalle for detalle in detalles])
+
+        cursor.executemany('''
+            INSERT INTO historial_stock (producto_id, usuario_id, cantidad_anterior, cantidad_nueva, tipo_movimiento, motivo)
+            VALUES (?, ?, ?, ?, 'venta', ?)
+        ''', [
+            (prod_id, usuario_id, productos[prod_id]['stock'], productos[prod_id]['stock'] - cantidad, f'Venta {num_venta}')
+            for prod_id, cantidad in cantidades.items()
+        ])
+
+        conn.commit()
+    except Exception:
+        numerador.descartar(serie)
+        conn.rollback()
+        raise
+    metricas.observar('tienda_venta_commit_segundos', time.perf_counter() - inicio)
+
+    return venta_id, num_venta
+
+# Ingesta de ventas por lotes (puntos de venta sin conexión)
+VENTAS_LOTE_MAX = 2000
+# Tolerancia para relojes de caja adelantados respecto del servidor
+VENTAS_LOTE_DESFASE = timedelta(minutes=5)
+
+def _normalizar_fecha_venta(valor):
+    """Convierte la fecha ISO informada por el cliente al formato de SQLite"""
+    if valor in (None, ''):
+        return None
+    try:
+        fecha = datetime.fromisoformat(str(valor).replace('Z', '+00:00'))
+    except ValueError:
+        raise VentaError('Fecha de venta inválida')
+    if fecha.tzinfo is not None:
+        fecha = fecha.astimezone(timezone.utc).replace(tzinfo=None)
+    if fecha > datetime.now(timezone.utc).replace(tzinfo=None) + VENTAS_LOTE_DESFASE:
+        raise VentaError('La fecha de venta no puede ser futura')
+    return fecha.strftime('%Y-%m-%d %H:%M:%S')
+
+def registrar_ventas_lote(conn, usuario_id, ventas, serie=SERIE_VENTA):
+    """Registra un lote de ventas con claves de idempotencia en una transacción
+
+    Cada venta es un dict con 'clave', 'lineas' (producto_id, cantidad y
+    opcionalmente el precio cobrado), 'cliente_id', 'metodo_pago',
+    'observaciones' y 'fecha'. Productos, clientes y claves ya registradas se
+    leen con una consulta por conjunto; el stock se valida en memoria en el
+    orden del lote, de modo que una venta rechazada no consume unidades, y
+    todas las escrituras se hacen con executemany. Una clave ya registrada
+    (o repetida dentro del lote) devuelve la venta original como 'duplicada',
+    por lo que reenviar un lote nunca duplica ventas. Retorna una lista de
+    resultados en el mismo orden que las ventas recibidas.
+    """
+    resultados = [None] * len(ventas)
+    candidatas = []
+    primeras = {}
+    repetidas = []
+
+    # Validación que no requiere la base de datos
+    for i, venta in enumerate(ventas):
+        clave = venta.get('clave') if isinstance(venta, dict) else None
+        if clave is not None and not isinstance(clave, str):
+            resultados[i] = {'clave': None, 'estado': 'rechazada', 'error': 'La clave de idempotencia debe ser texto'}
+            continue
+        clave = (clave or '').strip()
+        if not clave:
+            resultados[i] = {'clave': None, 'estado': 'rechazada', 'error': 'Falta la clave de idempotencia'}
+            continue
+        if clave in primeras:
+            repetidas.append((i, primeras[clave]))
+            continue
+        primeras[clave] = i
+        try:
+            if any(venta.get(campo) is not None and not isinstance(venta[campo], str)
+                   for campo in ('metodo_pago', 'observaciones')):
+                raise VentaError('Método de pago u observaciones inválidos')
+            lineas = venta.get('lineas')
+            if not isinstance(lineas, list):
+                raise VentaError('Debe agregar al menos un producto')
+            lineas = [linea for linea in lineas if isinstance(linea, dict)]
+            cantidades = consolidar_lineas((linea.get('producto_id'), linea.get('cantidad')) for linea in lineas)
+            if not cantidades:
+                raise VentaError('Debe agregar al menos un producto')
+            precios = {}
+            for linea in lineas:
+                if linea.get('precio') is not None:
+                    precios.setdefault(int(linea.get('producto_id')), float(linea['precio']))
+            cliente_id = int(venta['cliente_id']) if venta.get('cliente_id') else None
+            fecha = _normalizar_fecha_venta(venta.get('fecha'))
+        except (TypeError, ValueError):
+            resultados[i] = {'clave': clave, 'estado': 'rechazada', 'error': 'Producto, precio o cliente inválidos'}
+            continue
+        except VentaError as e:
+            resultados[i] = {'clave': clave, 'estado': 'rechazada', 'error': str(e)}
+            continue
+        candidatas.append((i, clave, cantidades, precios, cliente_id, fecha, venta))
+
+    claves = [c[1] for c in candidatas]
+    ids_productos = sorted({prod_id for c in candidatas for prod_id in c[2]})
+    ids_clientes = sorted({c[4] for c in candidatas if c[4] is not None})
+
+    cursor = conn.cursor()
+    inicio = time.perf_counter()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        cursor.execute('''
+            SELECT clave, venta_id, numero_venta FROM ventas_idempotencia
+            WHERE clave IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(claves),))
+        existentes = {fila['clave']: fila for fila in cursor.fetchall()}
+        cursor.execute('''
+            SELECT id, nombre, precio, stock FROM productos
+            WHERE activo = 1 AND id IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(ids_productos),))
+        productos = {p['id']: p for p in cursor.fetchall()}
+        cursor.execute('SELECT id FROM clientes WHERE id IN (SELECT value FROM json_each(?))', (json.dumps(ids_clientes),))
+        clientes = {fila['id'] for fila in cursor.fetchall()}
+        archivados = set(meses_archivados(cursor))
+
+        restante = {prod_id: p['stock'] for prod_id, p in productos.items()}
+        aceptadas = []
+        for i, clave, cantidades, precios, cliente_id, fecha, venta in candidatas:
+            if clave in existentes:
+                fila = existentes[clave]
+                resultados[i] = {'clave': clave, 'estado': 'duplicada',
+                                 'venta_id': fila['venta_id'], 'numero_venta': fila['numero_venta']}
+                continue
+            try:
+                if cliente_id is not None and cliente_id not in clientes:
+                    raise VentaError('Cliente no encontrado')
+                if fecha and fecha[:7] in archivados:
+                    raise VentaError(f'El mes {fecha[:7]} está archivado')
+                for prod_id, cantidad in cantidades.items():
+                    producto = productos.get(prod_id)
+                    if producto is None:
+                        raise VentaError('Producto no encontrado')
+                    if prod_id in precios and abs(precios[prod_id] - producto['precio']) > 0.005:
+                        raise VentaError(f'El precio de {producto["nombre"]} cambió. Actual: {producto["precio"]:.2f}')
+                    if cantidad > restante[prod_id]:
+                        raise VentaError(f'Stock insuficiente para {producto["nombre"]}. Disponible: {restante[prod_id]}')
+            except VentaError as e:
+                resultados[i] = {'clave': clave, 'estado': 'rechazada', 'error': str(e)}
+                continue
+            movimientos = []
+            for prod_id, cantidad in cantidades.items():
+                movimientos.append((prod_id, cantidad, restante[prod_id]))
+                restante[prod_id] -= cantidad
+            aceptadas.append((i, clave, movimientos, cliente_id, fecha, venta))
+
+        if aceptadas:
+            numeros = numerador.reservar(cursor, len(aceptadas), serie)
+            filas_ventas = []
+            for (i, clave, movimientos, cliente_id, fecha, venta), num_venta in zip(aceptadas, numeros):
+                subtotal = sum(productos[prod_id]['precio'] * cantidad for prod_id, cantidad, _ in movimientos)
+                igv = subtotal * IGV
+                filas_ventas.append((num_venta, cliente_id, usuario_id, fecha, subtotal, igv, subtotal + igv,
+                                     venta.get('metodo_pago'), venta.get('observaciones') or ''))
+            cursor.executemany('''
+                INSERT INTO ventas (numero_venta, cliente_id, usuario_id, fecha_venta, subtotal, igv, total, metodo_pago, observaciones)
+                VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?, ?, ?, ?, ?)
+            ''', filas_ventas)
+            cursor.execute('''
+                SELECT numero_venta, id FROM ventas
+                WHERE numero_venta IN (SELECT value FROM json_each(?))
+            ''', (json.dumps(numeros),))
+            ids_ventas = dict(cursor.fetchall())
+
+            vendidas = {}
+            filas_detalle, filas_historial, filas_claves = [], [], []
+            for (i, clave, movimientos, cliente_id, fecha, venta), num_venta in zip(aceptadas, numeros):
+                venta_id = ids_ventas[num_venta]
+                for prod_id, cantidad, anterior in movimientos:
+                    precio = productos[prod_id]['precio']
+                    filas_detalle.append((venta_id, prod_id, cantidad, precio, precio * cantidad))
+                    filas_historial.append((prod_id, usuario_id, anterior, anterior - cantidad, f'Venta {num_venta}'))
+                    vendidas[prod_id] = vendidas.get(prod_id, 0) + cantidad
+                filas_claves.append((clave, venta_id, num_venta))
+                resultados[i] = {'clave': clave, 'estado': 'registrada', 'venta_id': venta_id, 'numero_venta': num_venta}
+
+            # Un solo descuento por producto con la cantidad total del lote
+            cursor.executemany(
+                'UPDATE productos SET stock = stock - ? WHERE id = ? AND stock >= ?',
+                [(cantidad, prod_id, cantidad) for prod_id, cantidad in vendidas.items()]
+            )
+            if cursor.rowcount != len(vendidas):
+                raise VentaError('Stock insuficiente: otro usuario vendió las últimas unidades')
+            cursor.executemany('''
+                INSERT INTO detalle_ventas (venta_id, producto_id, cantidad, precio_unitario, subtotal)
+                VALUES (?, ?, ?, ?, ?)
+            ''', filas_detalle)
+            cursor.executemany('''
+                INSERT INTO historial_stock (producto_id, usuario_id, cantidad_anterior, cantidad_nueva, tipo_movimiento, motivo)
+                VALUES (?, ?, ?, ?, 'venta', ?)
+            ''', filas_historial)
+            cursor.executemany(
+                'INSERT INTO ventas_idempotencia (clave, venta_id, numero_venta) VALUES (?, ?, ?)',
+                filas_claves
+            )
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    metricas.observar('tienda_venta_commit_segundos', time.perf_counter() - inicio)
+
+    for i, primera in repetidas:
+        original = resultados[primera]
+        if original['estado'] == 'rechazada':
+            resultados[i] = dict(original)
+        else:
+            resultados[i] = {'clave': original['clave'], 'estado': 'duplicada',
+                             'venta_id': original['venta_id'], 'numero_venta': original['numero_venta']}
+    return resultados
+
+# Exportación en flujo
+EXPORTACION_LOTE = 1000
+
+def filas_como_texto(cursor, formato='csv', lote=EXPORTACION_LOTE, encabezado=True):
+    """Convierte el resultado de una consulta ya ejecutada en bloques de texto CSV o JSONL
+
+    Las filas se leen de a `lote` con fetchmany y cada bloque se entrega en
+    cuanto se escribe, así que nunca se tiene en memoria más de un lote.
+    """
+    columnas = [descripcion[0] for descripcion in cursor.description]
+    # Tuplas simples en lugar de sqlite3.Row: menos costo por fila
+    cursor.row_factory = None
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    if formato == 'csv' and encabezado:
+        escritor.writerow(columnas)
+    while True:
+        filas = cursor.fetchmany(lote)
+        if not filas:
+            break
+        if formato == 'csv':
+            escritor.writerows(filas)
+        else:
+            buffer.writelines(json.dumps(dict(zip(columnas, fila)), ensure_ascii=False) + '\n' for fila in filas)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def comprimir_gzip(bloques, nivel=6):
+    """Comprime en formato gzip un flujo de bloques de texto sin acumularlo"""
+    compresor = zlib.compressobj(nivel, zlib.DEFLATED, 31)
+    for bloque in bloques:
+        datos = compresor.compress(bloque.encode('utf-8'))
+        if datos:
+            yield datos
+    yield compresor.flush()
+
+def respuesta_exportacion(bloques, nombre, formato, comprimir=False):
+    """Respuesta de descarga que envía los bloques a medida que se generan"""
+    tipo = 'text/csv' if formato == 'csv' else 'application/x-ndjson'
+    nombre = f'{nombre}.{formato}'
+    if comprimir:
+        bloques, tipo, nombre = comprimir_gzip(bloques), 'application/gzip', nombre + '.gz'
+    respuesta = Response(stream_with_context(bloques), mimetype=tipo)
+    respuesta.headers['Content-Disposition'] = f'attachment; filename={nombre}'
+    return respuesta
+
+# Importación y exportación del catálogo de productos
+COLUMNAS_CATALOGO = ('codigo', 'nombre', 'descripcion', 'categoria_id', 'marca', 'modelo',
+                     'precio', 'stock', 'stock_minimo', 'activo')
+COLUMNAS_TEXTO_CATALOGO = ('nombre', 'descripcion', 'marca', 'modelo')
+CATALOGO_LOTE = 1000
+CATALOGO_MUESTRA = 100
+
+def leer_catalogo(archivo, formato):
+    """Genera (linea, fila) desde un archivo de texto CSV o JSONL, una fila a la vez"""
+    if formato == 'csv':
+        lector = csv.DictReader(archivo)
+        for fila in lector:
+            yield lector.line_num, fila
+        return
+    for numero, linea in enumerate(archivo, 1):
+        if not linea.strip():
+            continue
+        try:
+            yield numero, json.loads(linea)
+        except ValueError:
+            yield numero, None
+
+def normalizar_fila_catalogo(fila, categorias):
+    """Convierte una fila importada en un dict con las columnas presentes
+
+    Las celdas vacías o ausentes no se incluyen, de modo que una lista de
+    precios con solo codigo y precio no toca el resto de columnas.
+    """
+    if not isinstance(fila, dict):
+        raise ValueError('Fila con formato inválido')
+    datos = {}
+    for columna in COLUMNAS_CATALOGO:
+        valor = fila.get(columna)
+        if isinstance(valor, str):
+            valor = valor.strip()
+        if valor is None or valor == '':
+            continue
+        if columna in COLUMNAS_TEXTO_CATALOGO or columna == 'codigo':
+            datos[columna] = str(valor)
+            continue
+        try:
+            if columna == 'precio':
+                valor = round(float(valor), 2)
+            elif columna == 'activo':
+                valor = 1 if str(valor).lower() in ('1', 'true', 'si', 'sí') else 0
+            else:
+                valor = int(valor)
+        except (TypeError, ValueError):
+            raise ValueError(f'Valor inválido en {columna}: {valor}')
+        if columna == 'precio' and valor <= 0:
+            raise ValueError('El precio debe ser mayor a cero')
+        if columna in ('stock', 'stock_minimo') and valor < 0:
+            raise ValueError(f'{columna} no puede ser negativo')
+        if columna == 'categoria_id' and valor not in categorias:
+            raise ValueError(f'Categoría {valor} no existe')
+        datos[columna] = valor
+    if 'codigo' not in datos:
+        raise ValueError('Falta el código')
+    return datos
+
+def _aplicar_lote_catalogo(conn, filas, usuario_id, simular, informe):
+    """Compara un lote de filas con la base y, si no es simulación, lo guarda"""
+    cursor = conn.cursor()
+    # La simulación solo lee: una transacción diferida no toma el bloqueo de
+    # escritura (con WAL las ventas siguen registrándose mientras tanto)
+    cursor.execute('BEGIN' if simular else 'BEGIN IMMEDIATE')
+    try:
+        cursor.execute(f'''
+            SELECT id, {', '.join(COLUMNAS_CATALOGO)} FROM productos
+            WHERE codigo IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(list(filas)),))
+        actuales = {fila['codigo']: fila for fila in cursor.fetchall()}
+
+        cambios = {}
+        historial = []
+        nuevos_con_stock = {}
+        for codigo, (linea, datos) in filas.items():
+            actual = actuales.get(codigo)
+            if actual is None:
+                if 'nombre' not in datos or 'precio' not in datos:
+                    informe['errores'] += 1
+                    if len(informe['detalle_errores']) < CATALOGO_MUESTRA:
+                        informe['detalle_errores'].append({'linea': linea, 'codigo': codigo,
+                                                           'error': 'Un producto nuevo requiere nombre y precio'})
+                    continue
+                diferencias = {campo: [None, valor] for campo, valor in datos.items() if campo != 'codigo'}
+                informe['nuevos'] += 1
+                if datos.get('stock'):
+                    nuevos_con_stock[codigo] = datos['stock']
+            else:
+                diferencias = {campo: [actual[campo], valor] for campo, valor in datos.items() if actual[campo] != valor}
+                if not diferencias:
+                    informe['sin_cambios'] += 1
+                    continue
+                informe['actualizados'] += 1
+                if 'stock' in diferencias:
+                    anterior, nuevo = diferencias['stock']
+                    historial.append((actual['id'], usuario_id, anterior, nuevo,
+                                      'entrada' if nuevo > anterior else 'salida', 'Importación de catálogo'))
+            if actual is None:
+                cambios[codigo] = (datos, tuple(datos))
+            else:
+                # NOT NULL se verifica antes del conflicto: el INSERT lleva nombre y precio
+                # actuales, pero solo se actualizan las columnas que cambiaron (así un
+                # cambio de precio no reindexa la búsqueda)
+                cambios[codigo] = ({'nombre': actual['nombre'], 'precio': actual['precio'], **datos}, tuple(diferencias))
+            if len(informe['cambios']) < CATALOGO_MUESTRA:
+                informe['cambios'].append({'linea': linea, 'codigo': codigo,
+                                           'accion': 'nuevo' if actual is None else 'actualizado',
+                                           'campos': diferencias})
+
+        if simular:
+            conn.rollback()
+            return
+
+        # Un INSERT ... ON CONFLICT por cada combinación de columnas presente en el lote
+        grupos = {}
+        for datos, modificadas in cambios.values():
+            grupos.setdefault((tuple(datos), modificadas), []).append(tuple(datos.values()))
+        for (columnas, modificadas), valores in grupos.items():
+            actualizar = ', '.join(f'{c} = excluded.{c}' for c in modificadas if c != 'codigo')
+            cursor.executemany(f'''
+                INSERT INTO productos ({', '.join(columnas)}) VALUES ({', '.join('?' * len(columnas))})
+                ON CONFLICT (codigo) DO UPDATE SET {actualizar}
+            ''', valores)
+
+        if nuevos_con_stock:
+            cursor.execute('SELECT id, codigo FROM productos WHERE codigo IN (SELECT value FROM json_each(?))',
+                           (json.dumps(list(nuevos_con_stock)),))
+            historial.extend((fila['id'], usuario_id, 0, nuevos_con_stock[fila['codigo']], 'entrada', 'Importación de catálogo')
+                             for fila in cursor.fetchall())
+        cursor.executemany('''
+            INSERT INTO historial_stock (producto_id, usuario_id, cantidad_anterior, cantidad_nueva, tipo_movimiento, motivo)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', historial)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def importar_catalogo(conn, filas, usuario_id, simular=False, lote=CATALOGO_LOTE):
+    """Inserta o actualiza productos por código desde un iterable de (linea, fila)
+
+    Las filas se procesan en lotes de `lote`, cada uno en su propia
+    transacción, así que la memoria usada no depende del tamaño del archivo.
+    Los cambios de stock quedan en historial_stock. Con simular=True no se
+    escribe nada y el informe describe lo que cambiaría: conteos, errores y
+    una muestra de las diferencias campo por campo.
+    """
+    informe = {'simulado': simular, 'nuevos': 0, 'actualizados': 0, 'sin_cambios': 0,
+               'errores': 0, 'detalle_errores': [], 'cambios': []}
+    categorias = {fila[0] for fila in conn.execute('SELECT id FROM categorias')}
+    pendientes = {}
+    for linea, fila in filas:
+        try:
+            datos = normalizar_fila_catalogo(fila, categorias)
+        except ValueError as e:
+            informe['errores'] += 1
+            if len(informe['detalle_errores']) < CATALOGO_MUESTRA:
+                codigo = fila.get('codigo') if isinstance(fila, dict) else None
+                informe['detalle_errores'].append({'linea': linea, 'codigo': codigo, 'error': str(e)})
+            continue
+        # Un código repetido dentro del lote se combina: la última fila manda
+        anterior = pendientes.pop(datos['codigo'], (linea, {}))[1]
+        pendientes[datos['codigo']] = (linea, {**anterior, **datos})
+        if len(pendientes) >= lote:
+            _aplicar_lote_catalogo(conn, pendientes, usuario_id, simular, informe)
+            pendientes = {}
+    if pendientes:
+        _aplicar_lote_catalogo(conn, pendientes, usuario_id, simular, informe)
+    return informe
+
+def exportar_catalogo(conn, formato='csv', lote=EXPORTACION_LOTE):
+    """Genera el catálogo completo como texto CSV o JSONL, un lote de filas a la vez"""
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT {", ".join(COLUMNAS_CATALOGO)} FROM productos ORDER BY codigo')
+    yield from filas_como_texto(cursor, formato, lote)
+
+# Exportación de ventas para contabilidad: una fila por línea de detalle o por venta
+CONSULTAS_EXPORTACION_VENTAS = {
+    'lineas': '''
+        SELECT v.numero_venta, v.fecha_venta, v.estado, v.metodo_pago, u.username AS vendedor,
+               c.documento AS cliente_documento, c.nombre || ' ' || c.apellido AS cliente_nombre,
+               p.codigo AS producto_codigo, p.nombre AS producto_nombre,
+               d.cantidad, d.precio_unitario, d.subtotal
+        FROM {esquema}.ventas v
+        JOIN {esquema}.detalle_ventas d ON d.venta_id = v.id
+        LEFT JOIN productos p ON d.producto_id = p.id
+        LEFT JOIN usuarios u ON v.usuario_id = u.id
+        LEFT JOIN clientes c ON v.cliente_id = c.id
+    ''',
+    'ventas': '''
+        SELECT v.numero_venta, v.fecha_venta, v.estado, v.metodo_pago, u.username AS vendedor,
+               c.documento AS cliente_documento, c.nombre || ' ' || c.apellido AS cliente_nombre,
+               v.subtotal, v.igv, v.total, v.observaciones
+        FROM {esquema}.ventas v
+        LEFT JOIN usuarios u ON v.usuario_id = u.id
+        LEFT JOIN clientes c ON v.cliente_id = c.id
+    ''',
+}
+
+def exportar_ventas(conn, condiciones, params, formato='csv', nivel='lineas', lote=EXPORTACION_LOTE, meses_archivo=()):
+    """Genera las ventas filtradas como texto CSV o JSONL en orden de fecha
+
+    condiciones y params son los de filtrar_ventas(). La consulta recorre el
+    índice de fecha y se lee con fetchmany, así que la memoria no depende de
+    cuántas líneas abarque el rango. Los meses de `meses_archivo` (en orden)
+    se leen de su archivo, adjuntado solo mientras se exporta ese mes, y
+    las ventas vigentes se intercalan por rango de fechas entre ellos.
+    """
+    tramos = []
+    anterior = None
+    for mes in meses_archivo:
+        inicio, fin = limites_mes(mes)
+        tramos.append(('main', anterior, inicio))
+        tramos.append((mes, None, None))
+        anterior = fin
+    tramos.append(('main', anterior, None))
+    for numero, (origen, inicio, fin) in enumerate(tramos):
+        consulta = CONSULTAS_EXPORTACION_VENTAS[nivel].format(esquema='main' if origen == 'main' else 'archivo')
+        extra, valores = list(condiciones), list(params)
+        if inicio:
+            extra.append('v.fecha_venta >= ?')
+            valores.append(inicio)
+        if fin:
+            extra.append('v.fecha_venta < ?')
+            valores.append(fin)
+        if extra:
+            consulta += ' WHERE ' + ' AND '.join(extra)
+        # El cursor se cierra antes de separar el archivo (DETACH falla con consultas abiertas)
+        with nullcontext() if origen == 'main' else archivo_adjunto(conn, origen):
+            cursor = conn.cursor()
+            try:
+                cursor.execute(consulta + ' ORDER BY v.fecha_venta, v.id', valores)
+                yield from filas_como_texto(cursor, formato, lote, encabezado=numero == 0)
+            finally:
+                cursor.close()
+
+# Archivo de ventas por mes: los meses cerrados se mueven, con sus líneas, a un
+# archivo SQLite por mes (ventas_AAAA-MM.db). La base principal conserva los
+# resúmenes (los reportes no cambian) y el índice ventas_archivadas para
+# encontrar cada venta; los archivos se adjuntan (ATTACH) solo para leer el
+# mes que se necesita.
+ARCHIVO_DIR = os.environ.get('ARCHIVO_DIR', '')
+ARCHIVO_MESES = int(os.environ.get('ARCHIVO_MESES', 24))
+
+class ArchivoError(Exception):
+    """Error al archivar, verificar o rehidratar un mes de ventas"""
+    pass
+
+def ruta_archivo(nombre):
+    """Ruta de un archivo de ventas: ARCHIVO_DIR o la carpeta 'archivo' junto a la base"""
+    directorio = ARCHIVO_DIR or os.path.join(os.path.dirname(os.path.abspath(DATABASE)), 'archivo')
+    return os.path.join(directorio, nombre)
+
+def limites_mes(mes):
+    """Primer día del mes (AAAA-MM) y del mes siguiente, para comparar con fecha_venta"""
+    fecha = datetime.strptime(mes, '%Y-%m')
+    anio, num = divmod(fecha.year * 12 + fecha.month, 12)
+    return f'{mes}-01', f'{anio:04d}-{num + 1:02d}-01'
+
+def meses_archivados(cursor):
+    """Meses archivados en orden; vacío si la base aún no tiene el registro de archivos"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archivos_ventas'")
+    if cursor.fetchone() is None:
+        return []
+    cursor.execute('SELECT mes FROM archivos_ventas ORDER BY mes')
+    return [fila[0] for fila in cursor.fetchall()]
+
+def meses_archivados_en(cursor, desde='', hasta=''):
+    """Meses archivados que abarca un rango de fechas (AAAA-MM-DD, extremos opcionales)"""
+    return [mes for mes in meses_archivados(cursor)
+            if mes >= (desde or '')[:7] and (not hasta or mes <= hasta[:7])]
+
+@contextmanager
+def archivo_adjunto(conn, mes, escritura=False):
+    """Adjunta el archivo del mes como esquema 'archivo' mientras dura el bloque
+
+    Se abre de solo lectura salvo al crearlo. Las consultas sobre el archivo
+    deben terminar (o cerrar su cursor) antes de salir del bloque.
+    """
+    ruta = os.path.abspath(ruta_archivo(f'ventas_{mes}.db'))
+    if escritura:
+        conn.execute('ATTACH ? AS archivo', (ruta,))
+    else:
+        if not os.path.exists(ruta):
+            raise ArchivoError(f'No se encuentra el archivo de {mes}: {ruta}')
+        conn.execute('ATTACH ? AS archivo', (f'file:{urllib.parse.quote(ruta)}?mode=ro',))
+        metricas.incrementar('tienda_archivos_adjuntos_total')
+    try:
+        yield ruta
+    finally:
+        conn.execute('DETACH archivo')
+
+@contextmanager
+def resumenes_conservados(cursor):
+    """Desactiva los triggers de los resúmenes mientras ventas de un mes entran o salen de la base
+
+    Mover un mes entre la base y su archivo no cambia sus totales, así que
+    ventas_diarias y ventas_productos_mes deben quedar igual. Como en la
+    carga masiva, los triggers se eliminan y se recrean dentro de la
+    transacción del llamador.
+    """
+    cursor.execute('''
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'trigger' AND tbl_name IN ('ventas', 'detalle_ventas')
+          AND (name LIKE 'ventas_diarias%' OR name LIKE 'ventas_productos_mes%')
+    ''')
+    triggers = cursor.fetchall()
+    for trigger in triggers:
+        cursor.execute(f'DROP TRIGGER {trigger["name"]}')
+    yield
+    for trigger in triggers:
+        cursor.execute(trigger['sql'])
+
+def _crear_tablas_archivo(cursor):
+    """Crea en el archivo adjunto las tablas de ventas con las columnas actuales (sin claves foráneas)"""
+    for tabla in ('ventas', 'detalle_ventas'):
+        cursor.execute(f'PRAGMA main.table_info({tabla})')
+        columnas = [f'{c["name"]} {c["type"]}' + (' PRIMARY KEY' if c['pk'] else '') for c in cursor.fetchall()]
+        cursor.execute(f'CREATE TABLE archivo.{tabla} ({", ".join(columnas)})')
+    cursor.execute('''
+        CREATE TABLE archivo.archivo_info (
+            mes TEXT PRIMARY KEY,
+            ventas INTEGER NOT NULL,
+            lineas INTEGER NOT NULL,
+            total REAL NOT NULL,
+            fecha_archivo TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _resumen_archivo(cursor):
+    cursor.execute('SELECT COUNT(*), COALESCE(SUM(total), 0) FROM archivo.ventas')
+    ventas, total = cursor.fetchone()
+    cursor.execute('SELECT COUNT(*) FROM archivo.detalle_ventas')
+    return ventas, cursor.fetchone()[0], round(total, 2)
+
+def archivar_mes(conn, mes):
+    """Mueve las ventas del mes y sus líneas a su archivo y retorna (ventas, lineas, total)
+
+    Primero se copian al archivo en una transacción solo del archivo (la
+    base principal únicamente se lee). Luego, en una transacción de la base
+    principal, se comprueba que la copia coincide fila por fila, se borran
+    las ventas y se registra el archivo. Si algo falla antes del commit, las
+    ventas siguen en la base y el archivo sin registrar se reemplaza en el
+    próximo intento.
+    """
+    inicio, fin = limites_mes(mes)
+    cursor = conn.cursor()
+    if mes in meses_archivados(cursor):
+        raise ArchivoError(f'El mes {mes} ya está archivado')
+    ruta = ruta_archivo(f'ventas_{mes}.db')
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    if os.path.exists(ruta):
+        os.remove(ruta)
+    with archivo_adjunto(conn, mes, escritura=True):
+        cursor.execute('PRAGMA archivo.journal_mode = DELETE')
+        cursor.execute('PRAGMA archivo.synchronous = FULL')
+        cursor.execute('BEGIN')
+        try:
+            _crear_tablas_archivo(cursor)
+            cursor.execute('INSERT INTO archivo.ventas SELECT * FROM main.ventas WHERE fecha_venta >= ? AND fecha_venta < ?',
+                           (inicio, fin))
+            cursor.execute('''
+                INSERT INTO archivo.detalle_ventas
+                SELECT * FROM main.detalle_ventas WHERE venta_id IN (SELECT id FROM archivo.ventas)
+            ''')
+            cursor.execute('CREATE INDEX archivo.idx_ventas_fecha ON ventas(fecha_venta)')
+            cursor.execute('CREATE INDEX archivo.idx_detalle_venta ON detalle_ventas(venta_id)')
+            resumen = _resumen_archivo(cursor)
+            cursor.execute('INSERT INTO archivo.archivo_info (mes, ventas, lineas, total) VALUES (?, ?, ?, ?)',
+                           (mes,) + resumen)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        with transaccion(conn):
+            # Una venta registrada, anulada o borrada después de la copia la invalida
+            cursor.execute('SELECT COUNT(*) FROM main.ventas WHERE fecha_venta >= ? AND fecha_venta < ?', (inicio, fin))
+            distintas = cursor.fetchone()[0] != resumen[0]
+            cursor.execute('''
+                SELECT COUNT(*) FROM (
+                    SELECT * FROM main.ventas WHERE fecha_venta >= ? AND fecha_venta < ?
+                    EXCEPT SELECT * FROM archivo.ventas
+                )
+            ''', (inicio, fin))
+            distintas = distintas or cursor.fetchone()[0]
+            cursor.execute('''
+                SELECT COUNT(*) FROM (
+                    SELECT * FROM archivo.detalle_ventas
+                    EXCEPT SELECT * FROM main.detalle_ventas WHERE venta_id IN (SELECT id FROM archivo.ventas)
+                )
+            ''')
+            distintas = distintas or cursor.fetchone()[0]
+            cursor.execute('SELECT COUNT(*) FROM main.detalle_ventas WHERE venta_id IN (SELECT id FROM archivo.ventas)')
+            if distintas or cursor.fetchone()[0] != resumen[1]:
+                raise ArchivoError(f'Las ventas de {mes} cambiaron durante el archivo; vuelva a intentarlo')
+            with resumenes_conservados(cursor):
+                cursor.execute('INSERT INTO ventas_archivadas (venta_id, mes) SELECT id, ? FROM archivo.ventas', (mes,))
+                cursor.execute('DELETE FROM main.detalle_ventas WHERE venta_id IN (SELECT id FROM archivo.ventas)')
+                cursor.execute('DELETE FROM main.ventas WHERE id IN (SELECT id FROM archivo.ventas)')
+            cursor.execute('INSERT INTO archivos_ventas (mes, archivo, ventas, lineas, total) VALUES (?, ?, ?, ?, ?)',
+                           (mes, os.path.basename(ruta)) + resumen)
+    return resumen
+
+def archivar_ventas(conn, hasta):
+    """Archiva, del más antiguo en adelante, cada mes con ventas hasta `hasta` (AAAA-MM) inclusive
+
+    Solo se archivan meses cerrados. Retorna una lista de (mes, ventas, lineas, total).
+    """
+    if hasta >= datetime.now().strftime('%Y-%m'):
+        raise ArchivoError('Solo se pueden archivar meses cerrados')
+    limite = limites_mes(hasta)[1]
+    archivados = []
+    while True:
+        fila = conn.execute('SELECT MIN(fecha_venta) FROM ventas').fetchone()
+        if fila[0] is None or fila[0] >= limite:
+            return archivados
+        mes = fila[0][:7]
+        archivados.append((mes,) + archivar_mes(conn, mes))
+
+def rehidratar_mes(conn, mes):
+    """Devuelve a la base principal las ventas archivadas del mes y borra su archivo"""
+    cursor = conn.cursor()
+    if mes not in meses_archivados(cursor):
+        raise ArchivoError(f'El mes {mes} no está archivado')
+    with archivo_adjunto(conn, mes) as ruta:
+        with transaccion(conn):
+            with resumenes_conservados(cursor):
+                cursor.execute('INSERT INTO main.ventas SELECT * FROM archivo.ventas')
+                cursor.execute('INSERT INTO main.detalle_ventas SELECT * FROM archivo.detalle_ventas')
+            resumen = _resumen_archivo(cursor)
+            cursor.execute('DELETE FROM ventas_archivadas WHERE mes = ?', (mes,))
+            cursor.execute('DELETE FROM archivos_ventas WHERE mes = ?', (mes,))
+    os.remove(ruta)
+    return resumen
+
+def verificar_archivo(conn, mes):
+    """Comprueba un mes archivado y retorna la lista de problemas encontrados"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT ventas, lineas, total FROM archivos_ventas WHERE mes = ?', (mes,))
+    registro = cursor.fetchone()
+    if registro is None:
+        return [f'{mes} no está registrado como archivado']
+    problemas = []
+    inicio, fin = limites_mes(mes)
+    try:
+        with archivo_adjunto(conn, mes):
+            cursor.execute('PRAGMA archivo.quick_check')
+            estado = cursor.fetchone()[0]
+            if estado != 'ok':
+                problemas.append(f'integridad del archivo: {estado}')
+            resumen = _resumen_archivo(cursor)
+            cursor.execute('SELECT ventas, lineas, total FROM archivo.archivo_info WHERE mes = ?', (mes,))
+            info = cursor.fetchone()
+            cursor.execute('''
+                SELECT COUNT(*) FROM archivo.ventas
+                WHERE fecha_venta < ? OR fecha_venta >= ?
+                   OR id NOT IN (SELECT venta_id FROM main.ventas_archivadas WHERE mes = ?)
+            ''', (inicio, fin, mes))
+            ajenas = cursor.fetchone()[0]
+    except (ArchivoError, sqlite3.Error) as e:
+        return [str(e)]
+    if tuple(registro) != resumen:
+        problemas.append(f'el registro indica {tuple(registro)} (ventas, líneas, total) y el archivo tiene {resumen}')
+    if info is None or tuple(info) != resumen:
+        problemas.append('el resumen interno del archivo no coincide con su contenido')
+    if ajenas:
+        problemas.append(f'{ajenas} ventas fuera del mes o sin registrar en ventas_archivadas')
+    cursor.execute('SELECT COUNT(*) FROM ventas_archivadas WHERE mes = ?', (mes,))
+    if cursor.fetchone()[0] != resumen[0]:
+        problemas.append('ventas_archivadas no coincide con las ventas del archivo')
+    cursor.execute('SELECT COUNT(*) FROM ventas WHERE fecha_venta >= ? AND fecha_venta < ?', (inicio, fin))
+    vigentes = cursor.fetchone()[0]
+    if vigentes:
+        problemas.append(f'{vigentes} ventas del mes siguen en la base principal')
+    return problemas
+
+# Paginación por cursor (keyset)
+def codificar_cursor(valores):
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode()
+
+def decodificar_cursor(token, largo):
+    """Valores de la clave de orden, o None si el cursor falta o no es válido
+
+    Solo se aceptan listas de largo valores escalares (números o texto); con
+    cualquier otra cosa la página vuelve a empezar desde el principio.
+    """
+    if not token:
+        return None
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(valores, list) or len(valores) != largo:
+        return None
+    if not all(isinstance(valor, (int, float, str)) and not isinstance(valor, bool) for valor in valores):
+        return None
+    return valores
+
+def paginar(cursor, consulta, condiciones, params, orden, campos, descendente=False, tamano=None):
+    """Obtiene una página de resultados ordenada por claves indexadas
+
+    consulta es el SELECT ... FROM ... sin WHERE ni ORDER BY; orden son las
+    expresiones SQL de la clave de orden (la última debe ser única) y campos
+    los nombres con que esas columnas aparecen en cada fila. Los cursores
+    'despues' y 'antes' de request.args indican desde qué fila continuar,
+    por lo que cada página cuesta lo mismo sin importar su posición.
+    """
+    tamano = tamano or PAGINA_TAMANO
+    condiciones = list(condiciones)
+    params = list(params)
+    despues = decodificar_cursor(request.args.get('despues'), len(orden))
+    antes = decodificar_cursor(request.args.get('antes'), len(orden)) if despues is None else None
+
+    clave = '(' + ', '.join(orden) + ')'
+    marcadores = '(' + ', '.join('?' * len(orden)) + ')'
+    hacia_atras = antes is not None
+    if despues is not None:
+        condiciones.append(f"{clave} {'<' if descendente else '>'} {marcadores}")
+        params.extend(despues)
+    elif hacia_atras:
+        condiciones.append(f"{clave} {'>' if descendente else '<'} {marcadores}")
+        params.extend(antes)
+
+    invertir = descendente != hacia_atras
+    direccion = 'DESC' if invertir else 'ASC'
+    sql = consulta
+    if condiciones:
+        sql += ' WHERE ' + ' AND '.join(condiciones)
+    sql += ' ORDER BY ' + ', '.join(f'{col} {direccion}' for col in orden)
+    sql += ' LIMIT ?'
+    params.append(tamano + 1)
+
+    cursor.execute(sql, params)
+    filas = cursor.fetchall()
+    hay_mas = len(filas) > tamano
+    filas = filas[:tamano]
+    if hacia_atras:
+        filas.reverse()
+
+    def url_pagina(**extra):
+        args = {k: v for k, v in request.args.items() if k not in ('antes', 'despues')}
+        args.update(extra)
+        return url_for(request.endpoint, **request.view_args, **args)
+
+    siguiente = anterior = None
+    if filas:
+        if hay_mas or hacia_atras:
+            siguiente = url_pagina(despues=codificar_cursor([filas[-1][c] for c in campos]))
+        if despues is not None or (hacia_atras and hay_mas):
+            anterior = url_pagina(antes=codificar_cursor([filas[0][c] for c in campos]))
+
+    return {
+        'filas': filas,
+        'siguiente': siguiente,
+        'anterior': anterior,
+        'primera': url_pagina() if anterior else None,
+    }
+
+# Decorador para requerir login
+def login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            flash('Por favor inicia sesión para acceder', 'warning')
+            return redirect(url_for('login'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+# Decorador para requerir rol de administrador
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            flash('Por favor inicia sesión para acceder', 'warning')
+            return redirect(url_for('login'))
+        if session.get('rol') != 'administrador':
+            flash('No tienes permisos para acceder a esta sección', 'danger')
+            return redirect(url_for('dashboard'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+# Decorador de caché HTTP condicional: el ETag resume las versiones de las
+# tablas de las que depende la vista, la URL y el usuario. Si el navegador
+# ya tiene esa versión se responde 304 sin ejecutar la vista.
+def condicional(*tablas):
+    def decorador(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != 'GET':
+                return f(*args, **kwargs)
+            marcadores = ','.join('?' * len(tablas))
+            versiones = get_db().execute(
+                f'SELECT tabla, version FROM versiones_tablas WHERE tabla IN ({marcadores}) ORDER BY tabla', tablas
+            ).fetchall()
+            semilla = json.dumps([[tuple(fila) for fila in versiones], request.full_path,
+                                  session.get('user_id'), session.get('rol')])
+            etag = hashlib.sha1(semilla.encode()).hexdigest()
+
+            # Con mensajes flash pendientes la página debe renderizarse para mostrarlos
+            if '_flashes' not in session and request.if_none_match.contains(etag):
+                respuesta = app.response_class(status=304)
+            else:
+                respuesta = make_response(f(*args, **kwargs))
+                if respuesta.status_code != 200:
+                    return respuesta
+            respuesta.set_etag(etag)
+            respuesta.headers['Cache-Control'] = 'private, no-cache'
+            return respuesta
+        return decorated_function
+    return decorador
+
+# Rutas de autenticación
+@app.route('/')
+def index():
+    if 'user_id' in session:
+        return redirect(url_for('dashboard'))
+    return redirect(url_for('login'))
+
+@app.route('/login', methods=['GET', 'POST'])
+def login():
+    if request.method == 'POST':
+        username = request.form['username']
+        password = request.form['password']
+        
+        # Validar campos vacíos
+        if not username or not password:
+            flash('Por favor completa todos los campos', 'warning')
+            return render_template('login.html')
+        
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM usuarios WHERE username = ? AND activo = 1', (username,))
+        user = cursor.fetchone()
+        
+        if user and check_password_hash(user['password'], password):
+            session['user_id'] = user['id']
+            session['username'] = user['username']
+            session['nombre_completo'] = user['nombre_completo']
+            session['rol'] = user['rol']
+            registrar_evento_acceso('ingreso', user['id'], user['username'])
+            flash(f'Bienvenido {user["nombre_completo"]}!', 'success')
+            return redirect(url_for('dashboard'))
+        else:
+            registrar_evento_acceso('fallido', user['id'] if user else None, username)
+            flash('Usuario o contraseña incorrectos', 'danger')
+    
+    return render_template('login.html')
+
+@app.route('/logout')
+def logout():
+    if 'user_id' in session:
+        registrar_evento_acceso('salida', session['user_id'], session.get('username'))
+    session.clear()
+    flash('Sesión cerrada exitosamente', 'info')
+    return redirect(url_for('login'))
+
+# Dashboard principal
+@app.route('/dashboard')
+@login_required
+def dashboard():
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    # Obtener estadísticas
+    cursor.execute('SELECT COUNT(*) as total FROM productos WHERE activo = 1')
+    total_productos = cursor.fetchone()['total']
+    
+    cursor.execute('SELECT COUNT(*) as total FROM productos_stock_bajo')
+    productos_bajo_stock = cursor.fetchone()['total']
+    
+    # Ventas del día: fila de total en el resumen diario (búsqueda por clave primaria)
+    cursor.execute("""
+        SELECT num_ventas, total FROM ventas_diarias
+        WHERE fecha = DATE('now') AND metodo_pago = '*' AND usuario_id = 0
+    """)
+    resumen_hoy = cursor.fetchone()
+    ventas_hoy = resumen_hoy['num_ventas'] if resumen_hoy else 0
+    ingresos_hoy = resumen_hoy['total'] if resumen_hoy else 0
+    
+    # Productos con bajo stock (el conjunto que mantienen los triggers) y la
+    # última alerta, desde la que el tablero escucha los cambios en vivo
+    cursor.execute('''
+        SELECT p.*, c.nombre as categoria_nombre
+        FROM productos_stock_bajo b
+        JOIN productos p ON p.id = b.producto_id
+        LEFT JOIN categorias c ON p.categoria_id = c.id
+        ORDER BY p.stock ASC
+        LIMIT 5
+    ''')
+    productos_alerta = cursor.fetchall()
+    cursor.execute('SELECT COALESCE(MAX(id), 0) FROM alertas_stock')
+    ultima_alerta = cursor.fetchone()[0]
+    
+    # Últimas ventas
+    cursor.execute('''
+        SELECT v.*, u.nombre_completo as vendedor,
+            CASE 
+               WHEN c.nombre IS NOT NULL THEN c.nombre || ' ' || c.apellido
+               ELSE 'Cliente General'
+            END as cliente_nombre
+        FROM ventas v
+        LEFT JOIN usuarios u ON v.usuario_id = u.id
+        LEFT JOIN clientes c ON v.cliente_id = c.id
+        ORDER BY v.fecha_venta DESC
+        LIMIT 5
+    ''')
+    ultimas_ventas = cursor.fetchall()
+    
+    return render_template('dashboard.html',
+                         total_productos=total_productos,
+                         productos_bajo_stock=productos_bajo_stock,
+                         ventas_hoy=ventas_hoy,
+                         ingresos_hoy=ingresos_hoy,
+                         productos_alerta=productos_alerta,
+                         ultima_alerta=ultima_alerta,
+                         ultimas_ventas=ultimas_ventas)
+
+@app.route('/api/alertas/stock')
+@login_required
+def alertas_stock():
+    """Flujo SSE con los productos que entran o salen del stock bajo
+
+    No usa conexiones del pool: las alertas las lee el vigía del proceso.
+    """
+    desde = request.headers.get('Last-Event-ID') or request.args.get('desde')
+    try:
+        desde = int(desde) if desde else None
+    except ValueError:
+        desde = None
+    respuesta = Response(vigia_alertas.escuchar(desde), mimetype='text/event-stream')
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    # Evita que un proxy inverso (nginx) acumule el flujo en su búfer
+    respuesta.headers['X-Accel-Buffering'] = 'no'
+    return respuesta
+
+# Gestión de productos
+@app.route('/productos')
+@login_required
+@condicional('productos', 'categorias')
+def productos():
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    filtros = {k: request.args.get(k, '').strip() for k in ('categoria', 'stock')}
+    condiciones = ['p.activo = 1']
+    params = []
+    if filtros['categoria']:
+        condiciones.append('p.categoria_id = ?')
+        params.append(filtros['categoria'])
+    if filtros['stock'] == 'critico':
+        condiciones.append('p.stock <= p.stock_minimo')
+    elif filtros['stock'] == 'bajo':
+        condiciones.append('p.stock > p.stock_minimo AND p.stock <= p.stock_minimo * 2')
+    elif filtros['stock'] == 'normal':
+        condiciones.append('p.stock > p.stock_minimo * 2')
+    
+    pagina = paginar(cursor, '''
+        SELECT p.*, c.nombre as categoria_nombre
+        FROM productos p
+        LEFT JOIN categorias c ON p.categoria_id = c.id
+    ''', condiciones, params, ['p.nombre', 'p.id'], ['nombre', 'id'])
+    
+    return render_template('productos.html', productos=pagina['filas'], pagina=pagina,
+                           categorias=categorias_activas(), filtros=filtros)
+
+@app.route('/api/producto/<int:id>')
+@login_required
+@condicional('productos')
+def api_producto(id):
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT * FROM productos WHERE id = ? AND activo = 1', (id,))
+    producto = cursor.fetchone()
+    
+    if producto:
+        return jsonify({
+            'id': producto['id'],
+            'codigo': producto['codigo'],
+            'nombre': producto['nombre'],
+            'precio': producto['precio'],
+            'stock': producto['stock']
+        })
+    return jsonify({'error': 'Producto no encontrado'}), 404
+
+# Consulta de productos por lotes (cajas / POS)
+CAMPOS_PRODUCTO_API = ('id', 'codigo', 'nombre', 'precio', 'stock', 'stock_minimo', 'marca', 'modelo',
+                       'categoria_id', 'version')
+CAMPOS_PRODUCTO_DEFECTO = ('id', 'codigo', 'nombre', 'precio', 'stock')
+PRODUCTOS_LOTE_MAX = 500
+
+@app.route('/api/productos/lote', methods=['GET', 'POST'])
+@login_required
+@condicional('productos')
+def api_productos_lote():
+    """Varios productos en una consulta, por ids, por códigos o modificados desde una versión
+
+    Parámetros (query string separados por comas, o JSON en POST): ids,
+    codigos, campos y desde. La respuesta es {"version": V, "productos":
+    {clave: campos}} donde la clave es el id o código pedido; un producto
+    inexistente vale null y uno inactivo {"inactivo": true}. Con desde=X se
+    devuelven todos los productos modificados después de la versión X, y
+    la version de la respuesta sirve como próximo desde.
+    """
+    if request.method == 'POST':
+        datos = request.get_json(silent=True) or {}
+        if not isinstance(datos, dict):
+            return jsonify({'error': 'El cuerpo debe ser un objeto JSON'}), 400
+        for clave in ('ids', 'codigos', 'campos'):
+            if datos.get(clave) is not None and not isinstance(datos[clave], list):
+                return jsonify({'error': f'{clave} debe ser una lista'}), 400
+    else:
+        datos = {clave: [v for v in request.args[clave].split(',') if v]
+                 for clave in ('ids', 'codigos', 'campos') if request.args.get(clave)}
+        if request.args.get('desde'):
+            datos['desde'] = request.args['desde']
+    
+    campos = tuple(datos.get('campos') or CAMPOS_PRODUCTO_DEFECTO)
+    invalidos = [campo for campo in campos if campo not in CAMPOS_PRODUCTO_API]
+    if invalidos:
+        return jsonify({'error': f"Campos no disponibles: {', '.join(map(str, invalidos))}"}), 400
+    
+    if datos.get('desde') is not None:
+        try:
+            desde = int(datos['desde'])
+        except (TypeError, ValueError):
+            return jsonify({'error': 'desde debe ser un número de versión'}), 400
+        columna, claves, filtro, parametro = 'id', None, 'version > ?', desde
+    elif datos.get('ids') or datos.get('codigos'):
+        if datos.get('ids'):
+            try:
+                claves = [int(valor) for valor in datos['ids']]
+            except (TypeError, ValueError):
+                return jsonify({'error': 'ids debe ser una lista de números'}), 400
+            columna = 'id'
+        else:
+            claves = [str(valor) for valor in datos['codigos']]
+            columna = 'codigo'
+        if len(claves) > PRODUCTOS_LOTE_MAX:
+            return jsonify({'error': f'Máximo {PRODUCTOS_LOTE_MAX} productos por consulta'}), 400
+        filtro, parametro = f'{columna} IN (SELECT value FROM json_each(?))', json.dumps(claves)
+    else:
+        return jsonify({'error': 'Indique ids, codigos o desde'}), 400
+    
+    conn = get_db()
+    # Versión y filas leídas en la misma transacción de lectura
+    conn.execute('BEGIN')
+    try:
+        version = conn.execute("SELECT version FROM versiones_tablas WHERE tabla = 'productos'").fetchone()[0]
+        filas = conn.execute(f'''
+            SELECT {', '.join(dict.fromkeys(campos + (columna, 'activo')))} FROM productos WHERE {filtro}
+        ''', (parametro,)).fetchall()
+    finally:
+        conn.commit()
+    
+    productos = dict.fromkeys(map(str, claves), None) if claves is not None else {}
+    for fila in filas:
+        productos[str(fila[columna])] = {campo: fila[campo] for campo in campos} if fila['activo'] else {'inactivo': True}
+    return jsonify({'version': version, 'productos': productos})
+
+# Búsqueda de productos y clientes
+def limite_busqueda():
+    try:
+        return max(1, min(int(request.args.get('limite', 20)), BUSQUEDA_LIMITE))
+    except ValueError:
+        return 20
+
+def buscar_texto(tabla, select, condiciones, pesos):
+    """Ejecuta una búsqueda FTS5 por prefijos y retorna las filas como dicts
+
+    select debe leer desde '{tabla}_fts f' con CROSS JOIN a la tabla base,
+    para que SQLite recorra primero el índice de texto completo. Los
+    resultados se ordenan por bm25 cuando las coincidencias son pocas; si
+    el término es muy común se devuelven las primeras del índice para que
+    el costo de la consulta se mantenga acotado.
+    """
+    consulta = consulta_fts(request.args.get('q', ''))
+    if not consulta:
+        return []
+    
+    fts = f'{tabla}_fts'
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT COUNT(*) FROM (SELECT 1 FROM {fts} WHERE {fts} MATCH ? LIMIT ?)',
+                   (consulta, BUSQUEDA_MAX_RANQUEO + 1))
+    ranquear = cursor.fetchone()[0] <= BUSQUEDA_MAX_RANQUEO
+    
+    sql = select + f' WHERE {fts} MATCH ?'
+    if condiciones:
+        sql += ' AND ' + ' AND '.join(condiciones)
+    if ranquear:
+        sql += f" ORDER BY bm25({fts}, {', '.join(str(p) for p in pesos)})"
+    sql += ' LIMIT ?'
+    cursor.execute(sql, (consulta, limite_busqueda()))
+    return [dict(fila) for fila in cursor.fetchall()]
+
+@app.route('/api/buscar/productos')
+@login_required
+def api_buscar_productos():
+    resultados = buscar_texto('productos', '''
+        SELECT p.id, p.codigo, p.nombre, p.marca, p.modelo, p.precio, p.stock, p.stock_minimo,
+               c.nombre as categoria_nombre
+        FROM productos_fts f
+        CROSS JOIN productos p ON p.id = f.rowid
+        LEFT JOIN categorias c ON p.categoria_id = c.id
+    ''', ['p.activo = 1'], (10.0, 5.0, 1.0, 3.0, 3.0))
+    return jsonify({'resultados': resultados})
+
+@app.route('/api/buscar/clientes')
+@login_required
+def api_buscar_clientes():
+    resultados = buscar_texto('clientes', '''
+        SELECT c.id, c.documento, c.tipo_documento, c.nombre, c.apellido, c.email,
+               c.telefono, c.direccion, c.fecha_registro
+        FROM clientes_fts f
+        CROSS JOIN clientes c ON c.id = f.rowid
+    ''', [], (10.0, 5.0, 5.0, 2.0))
+    return jsonify({'resultados': resultados})
+
+# Selectores del formulario de venta
+def completar_con_busqueda(resultados, encontrados):
+    """Agrega resultados de la búsqueda de texto sin repetir ids"""
+    ids = {r['id'] for r in resultados}
+    for fila in encontrados:
+        if len(resultados) >= limite_busqueda():
+            break
+        if fila['id'] not in ids:
+            resultados.append(fila)
+    return resultados
+
+@app.route('/api/venta/productos')
+@login_required
+def api_venta_productos():
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({'resultados': []})
+    
+    # Primero coincidencias por prefijo de código (rango sobre el índice único)
+    prefijo = q.upper()
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id, codigo, nombre, precio, stock
+        FROM productos
+        WHERE codigo >= ? AND codigo < ? AND activo = 1 AND stock > 0
+        ORDER BY codigo
+        LIMIT ?
+    ''', (prefijo, prefijo + '\uffff', limite_busqueda()))
+    resultados = [dict(fila) for fila in cursor.fetchall()]
+    
+    if len(resultados) < limite_busqueda():
+        completar_con_busqueda(resultados, buscar_texto('productos', '''
+            SELECT p.id, p.codigo, p.nombre, p.precio, p.stock
+            FROM productos_fts f
+            CROSS JOIN productos p ON p.id = f.rowid
+        ''', ['p.activo = 1', 'p.stock > 0'], (10.0, 5.0, 1.0, 3.0, 3.0)))
+    
+    return jsonify({'resultados': resultados})
+
+@app.route('/api/venta/clientes')
+@login_required
+def api_venta_clientes():
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({'resultados': []})
+    
+    # Primero coincidencias por prefijo de documento
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id, documento, nombre, apellido
+        FROM clientes
+        WHERE documento >= ? AND documento < ?
+        ORDER BY documento
+        LIMIT ?
+    ''', (q, q + '\uffff', limite_busqueda()))
+    resultados = [dict(fila) for fila in cursor.fetchall()]
+    
+    if len(resultados) < limite_busqueda():
+        completar_con_busqueda(resultados, buscar_texto('clientes', '''
+            SELECT c.id, c.documento, c.nombre, c.apellido
+            FROM clientes_fts f
+            CROSS JOIN clientes c ON c.id = f.rowid
+        ''', [], (10.0, 5.0, 5.0, 2.0)))
+    
+    return jsonify({'resultados': resultados})
+
+@app.route('/productos/importar', methods=['GET', 'POST'])
+@admin_required
+def importar_productos():
+    """Carga masiva de productos desde CSV o JSONL, con simulación previa"""
+    informe = None
+    if request.method == 'POST':
+        archivo = request.files.get('archivo')
+        if not archivo or not archivo.filename:
+            flash('Selecciona un archivo CSV o JSONL', 'danger')
+            return redirect(url_for('importar_productos'))
+        formato = 'csv' if archivo.filename.lower().endswith('.csv') else 'jsonl'
+        # Werkzeug guarda en disco las subidas grandes: el archivo se lee por líneas
+        texto = io.TextIOWrapper(archivo.stream, encoding='utf-8-sig', newline='')
+        informe = importar_catalogo(get_db(), leer_catalogo(texto, formato), session['user_id'],
+                                    simular=bool(request.form.get('simular')))
+        if not informe['simulado']:
+            flash(f"Importación completa: {informe['nuevos']} nuevos, {informe['actualizados']} actualizados", 'success')
+    return render_template('productos_importar.html', informe=informe)
+
+@app.route('/productos/exportar')
+@admin_required
+def exportar_productos():
+    """Descarga el catálogo completo como CSV o JSONL sin cargarlo en memoria"""
+    formato = 'jsonl' if request.args.get('formato') == 'jsonl' else 'csv'
+    return respuesta_exportacion(exportar_catalogo(get_db(), formato), 'productos', formato,
+                                 comprimir=bool(request.args.get('gzip')))
+
+@app.route('/producto/nuevo', methods=['GET', 'POST'])
+@admin_required
+def nuevo_producto():
+    if request.method == 'POST':
+        conn = get_db()
+        cursor = conn.cursor()
+        
+        try:
+            codigo = request.form.get('codigo', '').strip().upper()
+            nombre = request.form.get('nombre', '').strip()
+            precio = float(request.form.get('precio', 0))
+            stock  = int(request.form.get('stock', 0))
+            
+            # Validar campos obligatorios
+            if not codigo or not nombre or precio <= 0 or stock < 0:
+                raise ValueError('Datos incompletos')
+            
+            # El alta y su stock inicial en el historial van en la misma transacción
+            with transaccion(conn):
+                cursor.execute('''
+                    INSERT INTO productos (codigo, nombre, descripcion, categoria_id, marca, modelo, precio, stock, stock_minimo)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    request.form['codigo'],
+                    request.form['nombre'],
+                    request.form['descripcion'],
+                    request.form['categoria_id'] if request.form['categoria_id'] else None,
+                    request.form['marca'],
+                    request.form['modelo'],
+                    request.form['precio'],
+                    stock,
+                    request.form['stock_minimo']
+                ))
+                if stock:
+                    registrar_historial_stock(cursor, cursor.lastrowid, session['user_id'], 0, stock, 'entrada', 'Stock inicial')
+            flash('Producto creado exitosamente', 'success')
+            return redirect(url_for('productos'))
+        except ValueError:
+            flash('Por favor completa todos los campos obligatorios correctamente', 'danger')
+        except sqlite3.IntegrityError:
+            flash('El código del producto ya existe', 'danger')
+    
+    return render_template('producto_form.html', categorias=categorias_activas())
+
+@app.route('/producto/editar/<int:id>', methods=['GET', 'POST'])
+@admin_required
+def editar_producto(id):
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    if request.method == 'POST':
+        try:
+            stock_nuevo = int(request.form['stock'])
+            # El cambio de stock y su movimiento en el historial se confirman juntos
+            with transaccion(conn):
+                cursor.execute('SELECT stock FROM productos WHERE id = ?', (id,))
+                stock_anterior = cursor.fetchone()['stock']
+                cursor.execute('''
+                    UPDATE productos
+                    SET codigo = ?, nombre = ?, descripcion = ?, categoria_id = ?,
+                        marca = ?, modelo = ?, precio = ?, stock = ?, stock_minimo = ?
+                    WHERE id = ?
+                ''', (
+                    request.form['codigo'],
+                    request.form['nombre'],
+                    request.form['descripcion'],
+                    request.form['categoria_id'] if request.form['categoria_id'] else None,
+                    request.form['marca'],
+                    request.form['modelo'],
+                    request.form['precio'],
+                    stock_nuevo,
+                    request.form['stock_minimo'],
+                    id
+                ))
+                if stock_anterior != stock_nuevo:
+                    tipo = 'entrada' if stock_nuevo > stock_anterior else 'salida'
+                    registrar_historial_stock(cursor, id, session['user_id'], stock_anterior, stock_nuevo, tipo, 'Ajuste manual')
+            flash('Producto actualizado exitosamente', 'success')
+            return redirect(url_for('productos'))
+        except ValueError:
+            flash('El stock debe ser un número entero', 'danger')
+        except sqlite3.IntegrityError:
+            flash('El código del producto ya existe', 'danger')
+    
+    cursor.execute('SELECT * FROM productos WHERE id = ?', (id,))
+    producto = cursor.fetchone()
+    if not producto:
+        flash('Producto no encontrado', 'danger')
+        return redirect(url_for('productos'))
+
+    return render_template('producto_form.html', producto=producto, categorias=categorias_activas())
+
+@app.route('/producto/<int:id>/historial')
+@login_required
+def historial_producto(id):
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    cursor.execute('SELECT * FROM productos WHERE id = ?', (id,))
+    producto = cursor.fetchone()
+    
+    if not producto:
+        flash('Producto no encontrado', 'danger')
+        return redirect(url_for('productos'))
+    
+    pagina = paginar(cursor, '''
+        SELECT h.*, u.nombre_completo as usuario
+        FROM historial_stock h
+        LEFT JOIN usuarios u ON h.usuario_id = u.id
+    ''', ['h.producto_id = ?'], [id], ['h.fecha', 'h.id'], ['fecha', 'id'], descendente=True)
+    
+    # Stock a una fecha: instantánea más cercana más los movimientos posteriores
+    consulta = {'al': request.args.get('al', '').strip(), 'stock': None}
+    if consulta['al']:
+        try:
+            consulta['stock'] = consultar_stock_en(cursor, normalizar_momento(consulta['al']), id).fetchone()['stock']
+        except ValueError:
+            flash('Fecha inválida', 'danger')
+    
+    return render_template('historial_stock.html', producto=producto, historial=pagina['filas'],
+                           pagina=pagina, consulta=consulta)
+
+@app.route('/productos/inventario')
+@admin_required
+def inventario_en_fecha():
+    """Descarga el stock de todos los productos en una fecha (?fecha=AAAA-MM-DD[THH:MM])"""
+    try:
+        momento = normalizar_momento(request.args.get('fecha'))
+    except ValueError:
+        flash('Indica una fecha válida para el inventario', 'danger')
+        return redirect(url_for('productos'))
+    formato = 'jsonl' if request.args.get('formato') == 'jsonl' else 'csv'
+    cursor = consultar_stock_en(get_db().cursor(), momento)
+    return respuesta_exportacion(filas_como_texto(cursor, formato), f'inventario_{momento[:10]}', formato)
+
+@app.route('/producto/eliminar/<int:id>')
+@admin_required
+def eliminar_producto(id):
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('UPDATE productos SET activo = 0 WHERE id = ?', (id,))
+    conn.commit()
+    flash('Producto eliminado exitosamente', 'success')
+    return redirect(url_for('productos'))
+
+# Gestión de ventas
+def filtrar_ventas(args):
+    """Lee los filtros del listado de ventas y retorna (filtros, condiciones, params)"""
+    filtros = {k: args.get(k, '').strip() for k in ('desde', 'hasta', 'vendedor', 'estado', 'metodo_pago')}
+    condiciones = []
+    params = []
+    if filtros['desde']:
+        condiciones.append('v.fecha_venta >= ?')
+        params.append(filtros['desde'])
+    if filtros['hasta']:
+        condiciones.append("v.fecha_venta < DATE(?, '+1 day')")
+        params.append(filtros['hasta'])
+    if filtros['vendedor']:
+        condiciones.append('v.usuario_id = ?')
+        params.append(filtros['vendedor'])
+    if filtros['estado']:
+        condiciones.append('v.estado = ?')
+        params.append(filtros['estado'])
+    if filtros['metodo_pago']:
+        condiciones.append('v.metodo_pago = ?')
+        params.append(filtros['metodo_pago'])
+    return filtros, condiciones, params
+
+@app.route('/ventas')
+@login_required
+def ventas():
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    filtros, condiciones, params = filtrar_ventas(request.args)
+    
+    pagina = paginar(cursor, '''
+        SELECT v.*, u.nombre_completo as vendedor, 
+               c.nombre || ' ' || c.apellido as cliente_nombre
+        FROM ventas v
+        LEFT JOIN usuarios u ON v.usuario_id = u.id
+        LEFT JOIN clientes c ON v.cliente_id = c.id
+    ''', condiciones, params, ['v.fecha_venta', 'v.id'], ['fecha_venta', 'id'], descendente=True)
+    
+    return render_template('ventas.html', ventas=pagina['filas'], pagina=pagina,
+                           filtros=filtros, vendedores=lista_vendedores())
+
+@app.route('/ventas/exportar')
+@admin_required
+def exportar_ventas_vista():
+    """Descarga las ventas filtradas (una fila por línea o por venta) sin cargarlas en memoria"""
+    filtros, condiciones, params = filtrar_ventas(request.args)
+    formato = 'jsonl' if request.args.get('formato') == 'jsonl' else 'csv'
+    nivel = 'ventas' if request.args.get('nivel') == 'ventas' else 'lineas'
+    conn = get_db_reportes()
+    # Solo se adjuntan los archivos de los meses que abarca el rango
+    meses = meses_archivados_en(conn.cursor(), filtros['desde'], filtros['hasta'])
+    bloques = exportar_ventas(conn, condiciones, params, formato, nivel, meses_archivo=meses)
+    respuesta = respuesta_exportacion(bloques, f'ventas_{nivel}', formato, comprimir=bool(request.args.get('gzip')))
+    if g.datos_al:
+        respuesta.headers['X-Datos-Al'] = g.datos_al
+    return respuesta
+
+@app.route('/venta/nueva', methods=['GET', 'POST'])
+@login_required
+def nueva_venta():
+    if request.method == 'POST':
+        conn = get_db()
+        
+        try:
+            lineas = zip(request.form.getlist('producto_id[]'), request.form.getlist('cantidad[]'))
+            venta_id, num_venta = registrar_venta(
+                conn,
+                session['user_id'],
+                lineas,
+                cliente_id=request.form.get('cliente_id'),
+                metodo_pago=request.form['metodo_pago'],
+                observaciones=request.form.get('observaciones', '')
+            )
+            flash(f'Venta {num_venta} registrada exitosamente', 'success')
+            return redirect(url_for('ventas'))
+        except VentaError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('nueva_venta'))
+        except Exception as e:
+            flash(f'Error al registrar la venta: {str(e)}', 'danger')
+    
+    # GET: mostrar formulario (productos y clientes se cargan bajo demanda)
+    return render_template('venta_form.html')
+
+@app.route('/api/ventas/lote', methods=['POST'])
+@login_required
+def api_ventas_lote():
+    """Recibe las ventas acumuladas por un punto de venta sin conexión
+
+    El cuerpo es {"ventas": [...]} con hasta VENTAS_LOTE_MAX ventas, cada una
+    con su clave de idempotencia generada por el cliente. El resultado de
+    cada venta se informa por separado; reenviar el lote es seguro.
+    """
+    datos = request.get_json(silent=True)
+    ventas = datos.get('ventas') if isinstance(datos, dict) else None
+    if not isinstance(ventas, list):
+        return jsonify({'error': 'Se esperaba {"ventas": [...]}'}), 400
+    if len(ventas) > VENTAS_LOTE_MAX:
+        return jsonify({'error': f'Máximo {VENTAS_LOTE_MAX} ventas por lote'}), 400
+
+    try:
+        resultados = registrar_ventas_lote(get_db(), session['user_id'], ventas)
+    except VentaError as e:
+        return jsonify({'error': str(e)}), 409
+
+    totales = {'registrada': 0, 'duplicada': 0, 'rechazada': 0}
+    for resultado in resultados:
+        totales[resultado['estado']] += 1
+    return jsonify({
+        'registradas': totales['registrada'],
+        'duplicadas': totales['duplicada'],
+        'rechazadas': totales['rechazada'],
+        'resultados': resultados
+    })
+
+def leer_venta(cursor, venta_id, esquema='main'):
+    """Venta con vendedor y cliente, y sus líneas, desde la base o el archivo adjunto"""
+    cursor.execute(f'''
+        SELECT v.*, u.nombre_completo as vendedor,
+               c.nombre || ' ' || c.apellido as cliente_nombre,
+               c.documento, c.telefono, c.email
+        FROM {esquema}.ventas v
+        LEFT JOIN usuarios u ON v.usuario_id = u.id
+        LEFT JOIN clientes c ON v.cliente_id = c.id
+        WHERE v.id = ?
+    ''', (venta_id,))
+    venta = cursor.fetchone()
+    
+    cursor.execute(f'''
+        SELECT dv.*, p.nombre as producto_nombre, p.codigo
+        FROM {esquema}.detalle_ventas dv
+        JOIN productos p ON dv.producto_id = p.id
+        WHERE dv.venta_id = ?
+    ''', (venta_id,))
+    return venta, cursor.fetchall()
+
+@app.route('/venta/detalle/<int:id>')
+@login_required
+def detalle_venta(id):
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    venta, detalles = leer_venta(cursor, id)
+    if venta is None:
+        # Venta de un mes archivado: se adjunta solo ese archivo
+        cursor.execute('SELECT mes FROM ventas_archivadas WHERE venta_id = ?', (id,))
+        archivada = cursor.fetchone()
+        if archivada is not None:
+            with archivo_adjunto(conn, archivada['mes']):
+                venta, detalles = leer_venta(cursor, id, 'archivo')
+    
+    return render_template('venta_detalle.html', venta=venta, detalles=detalles)
+
+# Gestión de clientes
+@app.route('/clientes')
+@login_required
+@condicional('clientes')
+def clientes():
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    filtros = {'tipo_documento': request.args.get('tipo_documento', '').strip()}
+    condiciones = []
+    params = []
+    if filtros['tipo_documento']:
+        condiciones.append('tipo_documento = ?')
+        params.append(filtros['tipo_documento'])
+    
+    pagina = paginar(cursor, 'SELECT * FROM clientes', condiciones, params,
+                     ['nombre', 'apellido', 'id'], ['nombre', 'apellido', 'id'])
+    
+    return render_template('clientes.html', clientes=pagina['filas'], pagina=pagina, filtros=filtros)
+
+@app.route('/cliente/nuevo', methods=['GET', 'POST'])
+@login_required
+def nuevo_cliente():
+    if request.method == 'POST':
+        conn = get_db()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                INSERT INTO clientes (documento, tipo_documento, nombre, apellido, email, telefono, direccion)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                request.form['documento'],
+                request.form['tipo_documento'],
+                request.form['nombre'],
+                request.form['apellido'],
+                request.form['email'],
+                request.form['telefono'],
+                request.form['direccion']
+            ))
+            conn.commit()
+            flash('Cliente registrado exitosamente', 'success')
+            return redirect(url_for('clientes'))
+        except sqlite3.IntegrityError:
+            flash('El documento ya está registrado', 'danger')
+    
+    return render_template('cliente_form.html')
+
+# Reportes
+def rango_meses():
+    """Rango de meses (YYYY-MM) pedido en request.args; por defecto los últimos 12"""
+    hoy = datetime.now()
+    hasta = request.args.get('hasta') or hoy.strftime('%Y-%m')
+    desde = request.args.get('desde')
+    if not desde:
+        anio, mes = divmod(hoy.year * 12 + hoy.month - 1 - 11, 12)
+        desde = f'{anio:04d}-{mes + 1:02d}'
+    for valor in (desde, hasta):
+        try:
+            datetime.strptime(valor, '%Y-%m')
+        except ValueError:
+            raise ValueError(f'Mes inválido: {valor}')
+    return desde, hasta
+
+def reporte_top_productos(cursor, desde, hasta, por='unidades', limite=10):
+    """Productos más vendidos entre dos meses, por unidades o por ingresos"""
+    orden = 'ingresos' if por == 'ingresos' else 'unidades'
+    cursor.execute(f'''
+        SELECT p.id, p.nombre, p.codigo, r.unidades, r.ingresos, r.num_ventas
+        FROM (
+            SELECT producto_id, SUM(unidades) as unidades, SUM(ingresos) as ingresos,
+                   SUM(num_ventas) as num_ventas
+            FROM ventas_productos_mes
+            WHERE mes BETWEEN ? AND ?
+            GROUP BY producto_id
+            ORDER BY {orden} DESC
+            LIMIT ?
+        ) r
+        JOIN productos p ON p.id = r.producto_id
+        ORDER BY r.{orden} DESC
+    ''', (desde, hasta, limite))
+    return cursor.fetchall()
+
+def reporte_categorias(cursor, desde, hasta):
+    """Unidades e ingresos por categoría entre dos meses"""
+    cursor.execute('''
+        SELECT COALESCE(c.nombre, 'Sin categoría') as categoria,
+               SUM(r.unidades) as unidades, SUM(r.ingresos) as ingresos
+        FROM ventas_productos_mes r
+        JOIN productos p ON p.id = r.producto_id
+        LEFT JOIN categorias c ON c.id = p.categoria_id
+        WHERE r.mes BETWEEN ? AND ?
+        GROUP BY p.categoria_id
+        ORDER BY ingresos DESC
+    ''', (desde, hasta))
+    return cursor.fetchall()
+
+def reporte_tendencia(cursor, desde, hasta):
+    """Ventas e ingresos por mes con la variación respecto al mes anterior"""
+    cursor.execute('''
+        SELECT SUBSTR(fecha, 1, 7) as mes, SUM(num_ventas) as num_ventas,
+               SUM(total) as total_ingresos
+        FROM ventas_diarias
+        WHERE fecha >= ? AND fecha < DATE(? || '-01', '+1 month') AND metodo_pago = '*'
+        GROUP BY mes
+        ORDER BY mes
+    ''', (desde + '-01', hasta))
+    por_mes = {fila['mes']: fila for fila in cursor.fetchall()}
+    
+    # Se incluyen los meses sin ventas para que la variación sea mes a mes
+    meses = []
+    anterior = None
+    anio, mes_num = int(desde[:4]), int(desde[5:7])
+    while f'{anio:04d}-{mes_num:02d}' <= hasta:
+        clave = f'{anio:04d}-{mes_num:02d}'
+        fila = por_mes.get(clave)
+        mes = {
+            'mes': clave,
+            'num_ventas': fila['num_ventas'] if fila else 0,
+            'total_ingresos': fila['total_ingresos'] if fila else 0,
+            'variacion': None,
+        }
+        if anterior and anterior['total_ingresos']:
+            mes['variacion'] = (mes['total_ingresos'] - anterior['total_ingresos']) / anterior['total_ingresos'] * 100
+        meses.append(mes)
+        anterior = mes
+        anio, mes_num = (anio + 1, 1) if mes_num == 12 else (anio, mes_num + 1)
+    return meses
+
+@app.route('/reportes')
+@admin_required
+def reportes():
+    conn = get_db_reportes()
+    cursor = conn.cursor()
+    
+    try:
+        desde, hasta = rango_meses()
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('reportes'))
+    por = request.args.get('por', 'unidades')
+    
+    productos_top = reporte_top_productos(cursor, desde, hasta, por)
+    categorias = reporte_categorias(cursor, desde, hasta)
+    ventas_mensuales = reporte_tendencia(cursor, desde, hasta)[::-1]
+    
+    return render_template('reportes.html', 
+                         productos_top=productos_top,
+                         categorias=categorias,
+                         ventas_mensuales=ventas_mensuales,
+                         desde=desde, hasta=hasta, por=por,
+                         datos_al=g.datos_al, refresco=duracion_legible(base_reportes.antiguedad))
+
+@app.route('/api/reportes/<tipo>')
+@admin_required
+def api_reportes(tipo):
+    conn = get_db_reportes()
+    cursor = conn.cursor()
+    
+    try:
+        desde, hasta = rango_meses()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if tipo == 'top-productos':
+        try:
+            limite = max(1, min(int(request.args.get('limite', 10)), 100))
+        except ValueError:
+            limite = 10
+        datos = [dict(f) for f in reporte_top_productos(cursor, desde, hasta, request.args.get('por', 'unidades'), limite)]
+    elif tipo == 'categorias':
+        datos = [dict(f) for f in reporte_categorias(cursor, desde, hasta)]
+    elif tipo == 'tendencia':
+        datos = reporte_tendencia(cursor, desde, hasta)
+    else:
+        return jsonify({'error': 'Reporte no encontrado'}), 404
+    
+    return jsonify({'desde': desde, 'hasta': hasta, 'datos_al': g.datos_al, 'datos': datos})
+
+# Gestión de usuarios (solo administrador)
+@app.route('/usuarios')
+@admin_required
+def usuarios():
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    filtros = {k: request.args.get(k, '').strip() for k in ('rol', 'activo')}
+    condiciones = []
+    params = []
+    if filtros['rol']:
+        condiciones.append('rol = ?')
+        params.append(filtros['rol'])
+    if filtros['activo'] in ('0', '1'):
+        condiciones.append('activo = ?')
+        params.append(int(filtros['activo']))
+    
+    pagina = paginar(cursor, '''
+        SELECT u.*, (
+            SELECT MAX(e.fecha) FROM eventos_acceso e
+            WHERE e.usuario_id = u.id AND e.evento = 'ingreso'
+        ) AS ultimo_acceso
+        FROM usuarios u
+    ''', condiciones, params,
+                     ['nombre_completo', 'id'], ['nombre_completo', 'id'])
+    
+    return render_template('usuarios.html', usuarios=pagina['filas'], pagina=pagina, filtros=filtros)
+
+@app.route('/usuario/nuevo', methods=['GET', 'POST'])
+@admin_required
+def nuevo_usuario():
+    if request.method == 'POST':
+        conn = get_db()
+        cursor = conn.cursor()
+        
+        try:
+            hash_password = generate_password_hash(request.form['password'])
+            cursor.execute('''
+                INSERT INTO usuarios (username, password, nombre_completo, email, rol)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (
+                request.form['username'],
+                hash_password,
+                request.form['nombre_completo'],
+                request.form['email'],
+                request.form['rol']
+            ))
+            cache_lecturas.invalidar(cursor, 'usuarios')
+            conn.commit()
+            flash('Usuario creado exitosamente', 'success')
+            return redirect(url_for('usuarios'))
+        except sqlite3.IntegrityError:
+            flash('El nombre de usuario o email ya existe', 'danger')
+    
+    return render_template('usuario_form.html')
+
+# Categorías (solo administrador)
+@app.route('/categorias')
+@admin_required
+@condicional('categorias')
+def categorias():
+    return render_template('categorias.html', categorias=categorias_activas())
+
+# Estado del sistema (solo administrador)
+@app.route('/api/sistema/conexiones')
+@admin_required
+def api_conexiones():
+    return jsonify(pool.estadisticas())
+
+# Métricas por petición
+@app.before_request
+def iniciar_medicion():
+    g.inicio_peticion = time.perf_counter()
+
+@app.after_request
+def guardar_estado_respuesta(respuesta):
+    g.estado_respuesta = respuesta.status_code
+    return respuesta
+
+@app.teardown_request
+def registrar_metricas_peticion(exception=None):
+    inicio = g.pop('inicio_peticion', None)
+    if inicio is None:
+        return
+    ruta = request.endpoint or 'sin_ruta'
+    metricas.incrementar('tienda_peticiones_total', ruta=ruta, metodo=request.method,
+                         estado=g.get('estado_respuesta', 500))
+    metricas.observar('tienda_peticion_duracion_segundos', time.perf_counter() - inicio, ruta=ruta)
+    conn = g.get('db')
+    consultas = conn.consultas if conn is not None else 0
+    metricas.observar('tienda_consultas_por_peticion', consultas, ruta=ruta)
+    if consultas:
+        metricas.incrementar('tienda_sql_consultas_total', consultas, ruta=ruta)
+        metricas.incrementar('tienda_sql_segundos_total', conn.segundos_sql, ruta=ruta)
+
+@app.route('/metrics')
+@admin_required
+def metrics():
+    estado_pool = pool.estadisticas()
+    medidores = [('tienda_pool_conexiones', {'estado': estado}, estado_pool[estado])
+                 for estado in ('abiertas', 'en_uso', 'libres')]
+    medidores.append(('tienda_cache_entradas', {}, cache_lecturas.tamano()))
+    medidores.append(('tienda_escritura_diferida_pendientes', {}, cola_escritura.pendientes()))
+    medidores.append(('tienda_alertas_clientes', {}, vigia_alertas.clientes()))
+    if base_reportes.activa() and base_reportes.edad() is not None:
+        medidores.append(('tienda_reportes_antiguedad_segundos', {}, round(base_reportes.edad(), 1)))
+    return metricas.exportar(medidores), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+# Perfilado bajo demanda de peticiones
+@app.before_request
+def iniciar_perfilado():
+    perfilador.revisar()
+    if perfilador.activo and perfilador.debe_perfilar(request.endpoint):
+        g.perfil_inicio = time.perf_counter()
+        g.perfil = cProfile.Profile()
+        g.perfil.enable()
+
+@app.teardown_request
+def guardar_perfilado(exception=None):
+    perfil = g.pop('perfil', None)
+    if perfil is None:
+        return
+    perfil.disable()
+    conn = g.get('db')
+    perfilador.guardar(perfil, {
+        'ruta': request.endpoint or 'sin_ruta',
+        'metodo': request.method,
+        'url': request.full_path.rstrip('?'),
+        'estado': g.get('estado_respuesta', 500),
+        'fecha': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'duracion_ms': round((time.perf_counter() - g.perfil_inicio) * 1000, 2),
+        'consultas': conn.consultas if conn is not None else 0,
+        'sql_ms': round(conn.segundos_sql * 1000, 2) if conn is not None else 0,
+    })
+
+@app.route('/sistema/perfiles', methods=['GET', 'POST'])
+@admin_required
+def perfiles():
+    if request.method == 'POST':
+        try:
+            fraccion = float(request.form.get('fraccion', 0)) if request.form.get('activo') else 0.0
+        except ValueError:
+            fraccion = -1
+        if not 0 <= fraccion <= 1:
+            flash('La fracción debe ser un número entre 0 y 1', 'danger')
+        else:
+            perfilador.configurar(fraccion, request.form.get('ruta'))
+            flash('Perfilado activado' if perfilador.activo else 'Perfilado desactivado', 'success')
+        return redirect(url_for('perfiles'))
+    
+    rutas = sorted(endpoint for endpoint in app.view_functions if endpoint != 'static')
+    return render_template('perfiles.html', perfilador=perfilador, perfiles=perfilador.listar(), rutas=rutas)
+
+@app.route('/sistema/perfiles/<nombre>')
+@admin_required
+def detalle_perfil(nombre):
+    archivo = perfilador.archivo(nombre)
+    if not archivo:
+        abort(404)
+    orden = request.args.get('orden', 'cumulative')
+    if orden not in ('cumulative', 'tottime', 'ncalls'):
+        orden = 'cumulative'
+    salida = io.StringIO()
+    pstats.Stats(archivo, stream=salida).strip_dirs().sort_stats(orden).print_stats(60)
+    return render_template('perfil_detalle.html', nombre=nombre, orden=orden, estadisticas=salida.getvalue())
+
+@app.route('/sistema/perfiles/<nombre>/descargar')
+@admin_required
+def descargar_perfil(nombre):
+    archivo = perfilador.archivo(nombre)
+    if not archivo:
+        abort(404)
+    return send_file(os.path.abspath(archivo), as_attachment=True, download_name=nombre + '.prof')
+
+# Generación de datos sintéticos
+# Tipos de producto con sus marcas y rango de precios (S/)
+TIPOS_PRODUCTO = [
+    ('Laptop', ('HP', 'Lenovo', 'Dell', 'Asus', 'Acer', 'Apple'), (1500, 9000)),
+    ('Smartphone', ('Samsung', 'Apple', 'Xiaomi', 'Motorola', 'Honor'), (600, 6500)),
+    ('Tablet', ('Apple', 'Samsung', 'Lenovo', 'Huawei'), (700, 5000)),
+    ('Mouse', ('Logitech', 'Razer', 'HyperX', 'Microsoft'), (40, 450)),
+    ('Teclado', ('Logitech', 'Corsair', 'Redragon', 'HyperX'), (60, 800)),
+    ('Monitor', ('LG', 'Samsung', 'AOC', 'Dell', 'ViewSonic'), (450, 3500)),
+    ('Audífonos', ('Sony', 'JBL', 'Bose', 'Sennheiser', 'Xiaomi'), (80, 1800)),
+    ('Impresora', ('Epson', 'HP', 'Canon', 'Brother'), (350, 2500)),
+    ('Disco SSD', ('Kingston', 'Samsung', 'WD', 'Crucial'), (150, 1200)),
+    ('Router', ('TP-Link', 'Asus', 'Huawei', 'Mercusys'), (90, 900)),
+]
+NOMBRES_GENERADOS = ('Juan', 'María', 'Luis', 'Ana', 'Carlos', 'Rosa', 'Jorge', 'Lucía', 'Pedro', 'Carmen',
+                     'José', 'Elena', 'Miguel', 'Sofía', 'Diego', 'Valeria', 'Andrés', 'Patricia', 'Raúl', 'Gabriela')
+APELLIDOS_GENERADOS = ('Quispe', 'Flores', 'García', 'Rodríguez', 'Huamán', 'Mamani', 'Sánchez', 'Torres',
+                       'Ramírez', 'Castillo', 'Vargas', 'Rojas', 'Mendoza', 'Chávez', 'Díaz', 'Gutiérrez')
+METODOS_PAGO_GENERADOS = ('efectivo', 'tarjeta', 'transferencia', 'yape')
+TABLAS_CARGA_MASIVA = ('productos', 'clientes', 'ventas', 'detalle_ventas', 'historial_stock')
+LOTE_VENTAS = 50000
+
+def generar_datos(conn, categorias=0, productos=2000, clientes=2000, usuarios=0, ventas=20000,
+                  dias=365, semilla=42):
+    """Agrega datos sintéticos realistas y reproducibles a una base migrada
+
+    Todo se carga en una sola transacción con executemany. Los índices
+    secundarios y los triggers (búsqueda y resúmenes) de las tablas grandes
+    se eliminan durante la carga y se recrean al final, reconstruyendo los
+    índices de búsqueda y los resúmenes de una sola vez. Retorna la cantidad
+    de filas insertadas por tabla.
+    """
+    azar = random.Random(semilla)
+    cursor = conn.cursor()
+    if meses_archivados(cursor):
+        raise ArchivoError('La base tiene meses de ventas archivados; genere los datos en una base nueva')
+    totales = {}
+    with transaccion(conn):
+        marcas = ','.join('?' * len(TABLAS_CARGA_MASIVA))
+        cursor.execute(f'''
+            SELECT name, sql FROM sqlite_master
+            WHERE type IN ('index', 'trigger') AND sql IS NOT NULL AND tbl_name IN ({marcas})
+        ''', TABLAS_CARGA_MASIVA)
+        diferidos = cursor.fetchall()
+        for objeto in diferidos:
+            tipo = 'TRIGGER' if objeto['sql'].upper().startswith('CREATE TRIGGER') else 'INDEX'
+            cursor.execute(f'DROP {tipo} {objeto["name"]}')
+        
+        # Categorías y usuarios (asesores que comparten la clave asesor123)
+        cursor.execute('SELECT COUNT(*) FROM categorias')
+        existentes = cursor.fetchone()[0]
+        cursor.executemany('INSERT INTO categorias (nombre, descripcion) VALUES (?, ?)', [
+            (f'{TIPOS_PRODUCTO[i % len(TIPOS_PRODUCTO)][0]} {existentes + i + 1}', 'Categoría generada')
+            for i in range(categorias)
+        ])
+        cursor.execute('SELECT id FROM categorias')
+        ids_categorias = [fila[0] for fila in cursor.fetchall()]
+        
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM usuarios')
+        base_usuarios = cursor.fetchone()[0]
+        clave = generate_password_hash('asesor123')
+        cursor.executemany('''
+            INSERT INTO usuarios (username, password, nombre_completo, email, rol)
+            VALUES (?, ?, ?, ?, 'asesor')
+        ''', [
+            (f'asesor{base_usuarios + i}', clave,
+             f'{azar.choice(NOMBRES_GENERADOS)} {azar.choice(APELLIDOS_GENERADOS)}',
+             f'asesor{base_usuarios + i}@gpsmanagement.com')
+            for i in range(1, usuarios + 1)
+        ])
+        cursor.execute("SELECT id FROM usuarios WHERE activo = 1")
+        ids_usuarios = [fila[0] for fila in cursor.fetchall()]
+        
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM productos')
+        base_productos = cursor.fetchone()[0]
+        
+        def filas_productos():
+            for i in range(base_productos + 1, base_productos + productos + 1):
+                tipo, marcas_tipo, (minimo, maximo) = azar.choice(TIPOS_PRODUCTO)
+                marca = azar.choice(marcas_tipo)
+                modelo = f'{marca[:2].upper()}-{azar.randint(100, 9999)}'
+                yield (f'GEN{i:07d}', f'{tipo} {marca} {modelo}', f'{tipo} {marca} modelo {modelo}',
+                       azar.choice(ids_categorias), marca, modelo, round(azar.uniform(minimo, maximo), 1),
+                       azar.randint(20, 300), azar.choice((3, 5, 5, 10)))
+        cursor.executemany('''
+            INSERT INTO productos (codigo, nombre, descripcion, categoria_id, marca, modelo, precio, stock, stock_minimo)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', filas_productos())
+        cursor.execute('SELECT id, precio, stock FROM productos WHERE activo = 1')
+        catalogo = cursor.fetchall()
+        stock = {fila['id']: fila['stock'] for fila in catalogo}
+        
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM clientes')
+        base_clientes = cursor.fetchone()[0]
+        
+        def filas_clientes():
+            for i in range(base_clientes + 1, base_clientes + clientes + 1):
+                nombre, apellido = azar.choice(NOMBRES_GENERADOS), azar.choice(APELLIDOS_GENERADOS)
+                ruc = azar.random() < 0.1
+                yield (f'{"20" if ruc else ""}{i:0{9 if ruc else 8}d}', 'RUC' if ruc else 'DNI',
+                       nombre, f'{apellido} {azar.choice(APELLIDOS_GENERADOS)}',
+                       f'{nombre.lower()}.{apellido.lower()}{i}@correo.com', f'9{azar.randint(10000000, 99999999)}')
+        cursor.executemany('''
+            INSERT INTO clientes (documento, tipo_documento, nombre, apellido, email, telefono)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', filas_clientes())
+        cursor.execute('SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM clientes')
+        rango_clientes = tuple(cursor.fetchone())
+        
+        # Ventas en orden cronológico dentro del periodo, en horario de tienda
+        # (9:00 a 21:00); los primeros productos del catálogo se venden más.
+        # El periodo termina ayer: el historial no puede quedar con fechas futuras
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM ventas')
+        venta_id = cursor.fetchone()[0]
+        inicio = datetime.now().date() - timedelta(days=dias)
+        fechas = [(inicio + timedelta(days=dia)).isoformat() for dia in range(dias)]
+        momentos = sorted(azar.randrange(dias * 43200) for _ in range(ventas))
+        productos_venta = [(fila['id'], fila['precio']) for fila in catalogo]
+        cantidad_productos = len(productos_venta)
+        aleatorio = azar.random
+        totales.update(categorias=categorias, usuarios=usuarios, productos=productos, clientes=clientes,
+                       ventas=ventas, detalle_ventas=0, historial_stock=0)
+        for desde in range(0, ventas, LOTE_VENTAS):
+            filas_ventas, filas_detalle, filas_historial = [], [], []
+            for momento in momentos[desde:desde + LOTE_VENTAS]:
+                venta_id += 1
+                numero = f'GEN-{venta_id:08d}'
+                dia, segundos = divmod(momento, 43200)
+                minutos, segundos = divmod(segundos, 60)
+                fecha = f'{fechas[dia]} {9 + minutos // 60:02d}:{minutos % 60:02d}:{segundos:02d}'
+                usuario = ids_usuarios[int(aleatorio() * len(ids_usuarios))]
+                subtotal = 0
+                lineas = 1 + int(aleatorio() ** 2 * 4)
+                for producto_id, precio in {productos_venta[int(cantidad_productos * aleatorio() ** 2)] for _ in range(lineas)}:
+                    cantidad = 1 + int(aleatorio() ** 3 * 3)
+                    actual = stock[producto_id]
+                    if actual < cantidad:
+                        reposicion = actual + 50 + int(aleatorio() * 150)
+                        filas_historial.append((producto_id, usuario, actual, reposicion, 'entrada', 'Reposición', fecha))
+                        actual = reposicion
+                    filas_historial.append((producto_id, usuario, actual, actual - cantidad, 'venta', f'Venta {numero}', fecha))
+                    stock[producto_id] = actual - cantidad
+                    filas_detalle.append((venta_id, producto_id, cantidad, precio, precio * cantidad))
+                    subtotal += precio * cantidad
+                cliente = None
+                if rango_clientes[0] and aleatorio() < 0.7:
+                    cliente = rango_clientes[0] + int(aleatorio() * (rango_clientes[1] - rango_clientes[0] + 1))
+                filas_ventas.append((venta_id, numero, cliente, usuario, fecha, round(subtotal, 2), round(subtotal * IGV, 2),
+                                     round(subtotal * (1 + IGV), 2), 'anulada' if aleatorio() < 0.02 else 'completada',
+                                     METODOS_PAGO_GENERADOS[int(aleatorio() * len(METODOS_PAGO_GENERADOS))]))
+            cursor.executemany('''
+                INSERT INTO ventas (id, numero_venta, cliente_id, usuario_id, fecha_venta, subtotal, igv, total, estado, metodo_pago)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', filas_ventas)
+            cursor.executemany('''
+                INSERT INTO detalle_ventas (venta_id, producto_id, cantidad, precio_unitario, subtotal)
+                VALUES (?, ?, ?, ?, ?)
+            ''', filas_detalle)
+            cursor.executemany('''
+                INSERT INTO historial_stock (producto_id, usuario_id, cantidad_anterior, cantidad_nueva, tipo_movimiento, motivo, fecha)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', filas_historial)
+            totales['detalle_ventas'] += len(filas_detalle)
+            totales['historial_stock'] += len(filas_historial)
+        cursor.executemany('UPDATE productos SET stock = ? WHERE id = ?', [(cantidad, producto_id) for producto_id, cantidad in stock.items()])
+        
+        # Los triggers de versión estuvieron desactivados durante la carga:
+        # se incrementan las versiones y todos los productos quedan marcados
+        # con la nueva para los clientes que sincronizan por delta
+        for tabla in ('usuarios',) + TABLAS_VERSIONADAS:
+            cache_lecturas.invalidar(cursor, tabla)
+        cursor.execute("UPDATE productos SET version = (SELECT version FROM versiones_tablas WHERE tabla = 'productos')")
+        
+        for objeto in diferidos:
+            cursor.execute(objeto['sql'])
+        for tabla in INDICES_BUSQUEDA:
+            cursor.execute(f"INSERT INTO {tabla}_fts ({tabla}_fts) VALUES ('rebuild')")
+        reconstruir_resumen_diario(cursor)
+        reconstruir_resumen_productos(cursor)
+        reconstruir_stock_bajo(cursor)
+        # El historial generado tiene fechas pasadas: las instantáneas previas ya
+        # no lo cubren, así que se reemplazan por una del estado final
+        cursor.execute('DELETE FROM instantaneas_stock_detalle')
+        cursor.execute('DELETE FROM instantaneas_stock')
+        tomar_instantanea_stock(cursor)
+    cursor.execute('ANALYZE')
+    return totales
+
+# Herramientas de diagnóstico de rendimiento
+# Tablas que crecen con el uso: recorrerlas completas o ordenar sus filas en
+# un B-tree temporal es una regresión de rendimiento
+TABLAS_CRECIENTES = {'productos', 'clientes', 'ventas', 'detalle_ventas', 'historial_stock'}
+
+def problemas_plan(sql, plan):
+    """Revisa las líneas de EXPLAIN QUERY PLAN y retorna los problemas encontrados"""
+    alias = {}
+    for tabla, nombre in re.findall(r'(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(?!ON\b|WHERE\b|LEFT\b|JOIN\b|CROSS\b|ORDER\b|GROUP\b|LIMIT\b)(\w+))?', sql, re.I):
+        alias[(nombre or tabla).lower()] = tabla.lower()
+    
+    problemas = []
+    primera_tabla = None
+    tiene_limite = re.search(r'\bLIMIT\b', sql, re.I) is not None
+    for detalle in plan:
+        acceso = re.match(r'(SCAN|SEARCH) (\w+)', detalle)
+        if acceso:
+            tabla = alias.get(acceso.group(2).lower(), acceso.group(2).lower())
+            primera_tabla = primera_tabla or tabla
+            if acceso.group(1) == 'SCAN' and tabla in TABLAS_CRECIENTES:
+                if 'INDEX' not in detalle or not tiene_limite:
+                    problemas.append(f'recorrido completo de {tabla}: {detalle}')
+        elif 'USE TEMP B-TREE' in detalle and primera_tabla in TABLAS_CRECIENTES:
+            problemas.append(f'ordenamiento temporal sobre {primera_tabla}: {detalle}')
+    return problemas
+
+def rutas_verificacion(conn):
+    """Peticiones (método, url, datos) que recorren las consultas de todas las vistas"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, fecha_venta FROM ventas ORDER BY id LIMIT 1 OFFSET (SELECT COUNT(*) / 2 FROM ventas)')
+    venta = cursor.fetchone()
+    cursor.execute('SELECT id, nombre, apellido FROM clientes ORDER BY id LIMIT 1')
+    cliente = cursor.fetchone()
+    cursor.execute('SELECT id, nombre FROM productos WHERE activo = 1 AND stock > 5 ORDER BY id LIMIT 1')
+    producto = cursor.fetchone()
+    # Términos tomados de los datos generados para que haya coincidencias: el
+    # prefijo GEN de los códigos abarca todos los productos sintéticos (más de
+    # BUSQUEDA_MAX_RANQUEO con los valores por defecto, así que también se
+    # recorre la búsqueda sin ranqueo); el tipo de producto y el apellido
+    # coinciden con una parte de las filas
+    cursor.execute('SELECT codigo, nombre FROM productos WHERE activo = 1 AND stock > 0 ORDER BY id DESC LIMIT 1')
+    generado = cursor.fetchone()
+    cursor.execute('SELECT documento, apellido FROM clientes ORDER BY id DESC LIMIT 1')
+    cliente_generado = cursor.fetchone()
+    tipo_producto = generado['nombre'].split()[0]
+    apellido = cliente_generado['apellido'].split()[0]
+    mes = datetime.now().strftime('%Y-%m')
+    return [
+        ('GET', '/dashboard', None),
+        ('GET', '/productos', None),
+        ('GET', f'/productos?stock=critico&despues={codificar_cursor([producto["nombre"], producto["id"]])}', None),
+        ('GET', '/productos?categoria=1', None),
+        ('GET', '/ventas', None),
+        ('GET', f'/ventas?despues={codificar_cursor([venta["fecha_venta"], venta["id"]])}', None),
+        ('GET', f'/ventas?antes={codificar_cursor([venta["fecha_venta"], venta["id"]])}', None),
+        ('GET', f'/ventas?desde={mes}-01&vendedor=1', None),
+        ('GET', '/ventas?metodo_pago=yape&estado=completada', None),
+        ('GET', '/clientes', None),
+        ('GET', f'/clientes?despues={codificar_cursor([cliente["nombre"], cliente["apellido"], cliente["id"]])}', None),
+        ('GET', '/usuarios', None),
+        ('GET', '/categorias', None),
+        ('GET', '/reportes', None),
+        ('GET', '/api/reportes/top-productos?por=ingresos', None),
+        ('GET', '/api/reportes/categorias', None),
+        ('GET', '/api/reportes/tendencia', None),
+        ('GET', f'/api/producto/{producto["id"]}', None),
+        ('GET', f'/api/productos/lote?ids={producto["id"]},1,2', None),
+        ('GET', '/api/productos/lote?codigos=LAP001,LAP002', None),
+        ('GET', '/api/productos/lote?desde=' + str(conn.execute("SELECT version FROM versiones_tablas WHERE tabla = 'productos'").fetchone()[0] - 5), None),
+        ('GET', f'/ventas/exportar?desde={mes}-01', None),
+        ('GET', f'/ventas/exportar?desde={mes}-01&vendedor=1&nivel=ventas&formato=jsonl', None),
+        ('GET', f'/producto/{producto["id"]}/historial', None),
+        ('GET', f'/producto/{producto["id"]}/historial?al={mes}-01', None),
+        ('GET', '/producto/1/historial?al=2000-01-01', None),
+        ('GET', f'/producto/editar/{producto["id"]}', None),
+        ('GET', f'/venta/detalle/{venta["id"]}', None),
+        ('GET', '/venta/nueva', None),
+        ('GET', f'/api/buscar/productos?q={urllib.parse.quote(generado["codigo"][:3])}', None),
+        ('GET', f'/api/buscar/productos?q={urllib.parse.quote(tipo_producto)}', None),
+        ('GET', f'/api/buscar/clientes?q={urllib.parse.quote(apellido)}', None),
+        ('GET', f'/api/venta/productos?q={urllib.parse.quote(generado["codigo"][:6])}', None),
+        ('GET', f'/api/venta/productos?q={urllib.parse.quote(tipo_producto)}', None),
+        ('GET', f'/api/venta/clientes?q={urllib.parse.quote(cliente_generado["documento"][:4])}', None),
+        ('GET', f'/api/venta/clientes?q={urllib.parse.quote(apellido)}', None),
+        ('POST', '/venta/nueva', {'producto_id[]': [str(producto['id'])], 'cantidad[]': ['1'], 'metodo_pago': 'efectivo'}),
+    ]
+
+def verificar_planes(ruta, productos, clientes, ventas):
+    """Ejecuta las vistas sobre una base poblada y revisa el plan de cada consulta
+
+    Retorna una lista de dicts (ruta, sql, plan, problemas) por sentencia
+    distinta ejecutada.
+    """
+    with usar_base_datos(ruta) as pool_diagnostico:
+        with app.app_context():
+            init_db()
+            generar_datos(get_db(), productos=productos, clientes=clientes, ventas=ventas)
+        
+        # El pool entrega siempre la misma conexión a peticiones secuenciales
+        sentencias = []
+        conn = pool_diagnostico.obtener()
+        conn.set_trace_callback(sentencias.append)
+        pool_diagnostico.devolver(conn)
+        
+        cliente_http = app.test_client()
+        with cliente_http.session_transaction() as sesion:
+            sesion.update(user_id=1, username='admin', nombre_completo='Administrador', rol='administrador')
+        
+        resultados = []
+        vistas = set()
+        for metodo, url, datos in rutas_verificacion(conn):
+            sentencias.clear()
+            # buffered consume también las respuestas en flujo (exportaciones)
+            cliente_http.open(url, method=metodo, data=datos, buffered=True)
+            for sql in sentencias:
+                sql = sql.strip()
+                if not re.match(r'(SELECT|UPDATE|DELETE|INSERT|WITH)\b', sql, re.I):
+                    continue
+                clave = re.sub(r"'[^']*'|\b\d+(\.\d+)?\b", '?', sql)
+                if clave in vistas:
+                    continue
+                vistas.add(clave)
+                plan = [fila[3] for fila in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+                resultados.append({
+                    'ruta': f'{metodo} {url.split("?")[0]}',
+                    'sql': ' '.join(sql.split()),
+                    'plan': plan,
+                    'problemas': problemas_plan(sql, plan),
+                })
+        conn.set_trace_callback(None)
+    return resultados
+
+# Escenarios de carga: (nombre, rol, método, ruta). La ruta puede usar
+# {producto}, {venta} y {termino}, que se sortean en cada petición
+ESCENARIOS_CARGA = [
+    ('dashboard', 'asesor', 'GET', '/dashboard'),
+    ('api_producto', 'asesor', 'GET', '/api/producto/{producto}'),
+    ('api_venta_productos', 'asesor', 'GET', '/api/venta/productos?q={termino}'),
+    ('nueva_venta', 'asesor', 'POST', '/venta/nueva'),
+    ('ventas', 'administrador', 'GET', '/ventas'),
+    ('venta_detalle', 'administrador', 'GET', '/venta/detalle/{venta}'),
+    ('productos', 'administrador', 'GET', '/productos'),
+    ('reportes', 'administrador', 'GET', '/reportes'),
+    ('api_reporte_tendencia', 'administrador', 'GET', '/api/reportes/tendencia'),
+]
+CREDENCIALES_CARGA = {'asesor': ('asesor', 'asesor123'), 'administrador': ('admin', 'admin123')}
+
+def percentil(valores, p):
+    """Percentil por rango más cercano de una lista ya ordenada"""
+    if not valores:
+        return 0
+    indice = max(0, min(len(valores) - 1, int(round(p / 100 * len(valores) + 0.5)) - 1))
+    return valores[indice]
+
+class _SinRedirecciones(urllib.request.HTTPRedirectHandler):
+    # Se mide cada respuesta por separado, sin seguir la redirección
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+class _PeticionSilenciosa(WSGIRequestHandler):
+    # El servidor de medición no escribe una línea de log por petición
+    def log_request(self, *args, **kwargs):
+        pass
+
+class ClienteCarga:
+    """Sesión de un usuario simulado, por el cliente de pruebas o por HTTP real"""
+
+    def __init__(self, rol, url_base=None):
+        self.url_base = url_base
+        if url_base:
+            self._http = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()), _SinRedirecciones)
+        else:
+            self._cliente = app.test_client()
+        usuario, clave = CREDENCIALES_CARGA[rol]
+        self.pedir('POST', '/login', {'username': usuario, 'password': clave})
+
+    def pedir(self, metodo, ruta, datos=None):
+        """Realiza la petición y retorna el código de estado HTTP"""
+        if not self.url_base:
+            return self._cliente.open(ruta, method=metodo, data=datos).status_code
+        cuerpo = urllib.parse.urlencode(datos, doseq=True).encode() if datos else None
+        peticion = urllib.request.Request(self.url_base + ruta, data=cuerpo, method=metodo)
+        try:
+            with self._http.open(peticion) as respuesta:
+                respuesta.read()
+                return respuesta.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+def medir_rutas(ruta_bd, peticiones=200, concurrencia=4, servidor=False, escenarios=None, semilla=42):
+    """Mide cada escenario de carga con usuarios concurrentes sobre la base indicada
+
+    Los escenarios se ejecutan uno a la vez para atribuir a cada ruta sus
+    consultas SQL. Retorna un dict por escenario con peticiones, errores,
+    throughput, percentiles de latencia (ms) y consultas por petición.
+    """
+    contador = {'consultas': 0}
+    lock_contador = threading.Lock()
+    
+    def contar(sql):
+        if not sql.startswith('--'):
+            with lock_contador:
+                contador['consultas'] += 1
+    
+    resultados = {}
+    with usar_base_datos(ruta_bd, max_conexiones=max(DB_POOL_SIZE, concurrencia),
+                         al_abrir=lambda conn: conn.set_trace_callback(contar)):
+        with app.app_context():
+            init_db()
+            cursor = get_db().cursor()
+            cursor.execute('SELECT MIN(id), MAX(id) FROM productos WHERE activo = 1')
+            productos = tuple(cursor.fetchone())
+            cursor.execute('SELECT MIN(id), MAX(id) FROM ventas')
+            ventas = tuple(cursor.fetchone())
+            cursor.execute('SELECT nombre FROM productos WHERE activo = 1 LIMIT 200')
+            terminos = [fila['nombre'].split()[0] for fila in cursor.fetchall()] or ['a']
+        
+        url_base = None
+        if servidor:
+            servidor_http = make_server('127.0.0.1', 0, app, threaded=True, request_handler=_PeticionSilenciosa)
+            threading.Thread(target=servidor_http.serve_forever, daemon=True).start()
+            url_base = f'http://127.0.0.1:{servidor_http.server_port}'
+        
+        try:
+            for nombre, rol, metodo, plantilla in escenarios or ESCENARIOS_CARGA:
+                clientes = [ClienteCarga(rol, url_base) for _ in range(concurrencia)]
+                latencias, errores = [], []
+                
+                def trabajador(numero):
+                    azar = random.Random(semilla + numero)
+                    for _ in range(peticiones // concurrencia):
+                        try:
+                            # Los términos de búsqueda pueden tener tildes: van codificados en la URL
+                            ruta = plantilla.format(
+                                producto=azar.randint(*productos) if productos[0] else 1,
+                                venta=azar.randint(*ventas) if ventas[0] else 1,
+                                termino=urllib.parse.quote(azar.choice(terminos)))
+                            datos = None
+                            if nombre == 'nueva_venta':
+                                datos = {'producto_id[]': [str(azar.randint(*productos))], 'cantidad[]': ['1'],
+                                         'metodo_pago': 'efectivo'}
+                            inicio = time.perf_counter()
+                            estado = clientes[numero].pedir(metodo, ruta, datos)
+                        except Exception as error:
+                            # Una excepción cuenta como error en lugar de terminar el hilo sin aviso
+                            errores.append(type(error).__name__)
+                            continue
+                        latencias.append((time.perf_counter() - inicio) * 1000)
+                        if estado >= 400:
+                            errores.append(estado)
+                
+                with lock_contador:
+                    contador['consultas'] = 0
+                hilos = [threading.Thread(target=trabajador, args=(i,)) for i in range(concurrencia)]
+                inicio = time.perf_counter()
+                for hilo in hilos:
+                    hilo.start()
+                for hilo in hilos:
+                    hilo.join()
+                duracion = time.perf_counter() - inicio
+                
+                latencias.sort()
+                resultados[nombre] = {
+                    'ruta': f'{metodo} {plantilla.split("?")[0]}',
+                    'peticiones': len(latencias),
+                    'errores': len(errores),
+                    'duracion_s': round(duracion, 3),
+                    'peticiones_por_segundo': round(len(latencias) / duracion, 1) if duracion else 0,
+                    'p50_ms': round(percentil(latencias, 50), 2),
+                    'p95_ms': round(percentil(latencias, 95), 2),
+                    'p99_ms': round(percentil(latencias, 99), 2),
+                    'consultas_por_peticion': round(contador['consultas'] / len(latencias), 1) if latencias else 0,
+                }
+        finally:
+            if servidor:
+                servidor_http.shutdown()
+    return resultados
+
+# Comandos de administración (flask --app app <comando>)
+@app.cli.command('reconstruir-resumen-diario')
+def reconstruir_resumen_diario_comando():
+    """Recalcula el resumen diario de ventas desde la tabla ventas."""
+    conn = get_db()
+    with transaccion(conn):
+        dias = reconstruir_resumen_diario(conn.cursor())
+    click.echo(f'Resumen diario reconstruido: {dias} días')
+
+@app.cli.command('reconstruir-resumen-productos')
+def reconstruir_resumen_productos_comando():
+    """Recalcula el resumen mensual de ventas por producto."""
+    conn = get_db()
+    with transaccion(conn):
+        filas = reconstruir_resumen_productos(conn.cursor())
+    click.echo(f'Resumen de productos reconstruido: {filas} filas')
+
+@app.cli.command('importar-productos')
+@click.argument('archivo', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--formato', type=click.Choice(['csv', 'jsonl']), help='Por defecto según la extensión del archivo.')
+@click.option('--simular', is_flag=True, help='Solo informa los cambios, sin guardarlos.')
+@click.option('--usuario', default='admin', show_default=True, help='Usuario al que se atribuyen los movimientos de stock.')
+def importar_productos_comando(archivo, formato, simular, usuario):
+    """Inserta o actualiza productos por código desde un CSV o JSONL."""
+    formato = formato or ('csv' if archivo.name.lower().endswith('.csv') else 'jsonl')
+    conn = get_db()
+    fila = conn.execute('SELECT id FROM usuarios WHERE username = ?', (usuario,)).fetchone()
+    if fila is None:
+        raise click.ClickException(f'No existe el usuario {usuario}')
+    inicio = time.perf_counter()
+    informe = importar_catalogo(conn, leer_catalogo(archivo, formato), fila['id'], simular=simular)
+    for cambio in informe['cambios']:
+        campos = ', '.join(f'{campo}: {antes} -> {despues}' for campo, (antes, despues) in cambio['campos'].items())
+        click.echo(f"{cambio['accion']:<12}{cambio['codigo']:<16}{campos}")
+    for error in informe['detalle_errores']:
+        click.echo(f"línea {error['linea']}: {error['error']}", err=True)
+    click.echo(f"{'Simulación' if simular else 'Importación'}: {informe['nuevos']} nuevos, "
+               f"{informe['actualizados']} actualizados, {informe['sin_cambios']} sin cambios, "
+               f"{informe['errores']} errores en {time.perf_counter() - inicio:.1f} s")
+
+@app.cli.command('exportar-productos')
+@click.argument('salida', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--formato', type=click.Choice(['csv', 'jsonl']), default='csv', show_default=True)
+def exportar_productos_comando(salida, formato):
+    """Escribe el catálogo completo en CSV o JSONL (por defecto a la salida estándar)."""
+    for bloque in exportar_catalogo(get_db(), formato):
+        salida.write(bloque)
+
+@app.cli.command('exportar-ventas')
+@click.argument('salida', type=click.Path(dir_okay=False, allow_dash=True), default='-')
+@click.option('--desde', help='Fecha inicial (AAAA-MM-DD).')
+@click.option('--hasta', help='Fecha final inclusive (AAAA-MM-DD).')
+@click.option('--formato', type=click.Choice(['csv', 'jsonl']), default='csv', show_default=True)
+@click.option('--nivel', type=click.Choice(['lineas', 'ventas']), default='lineas', show_default=True,
+              help='Una fila por línea de detalle o por venta.')
+@click.option('--gzip', 'comprimir', is_flag=True, help='Comprime la salida (implícito si SALIDA termina en .gz).')
+def exportar_ventas_comando(salida, desde, hasta, formato, nivel, comprimir):
+    """Exporta las ventas de un rango de fechas para contabilidad."""
+    filtros, condiciones, params = filtrar_ventas({'desde': desde or '', 'hasta': hasta or ''})
+    conn = get_db()
+    meses = meses_archivados_en(conn.cursor(), filtros['desde'], filtros['hasta'])
+    bloques = exportar_ventas(conn, condiciones, params, formato, nivel, meses_archivo=meses)
+    if comprimir or salida.endswith('.gz'):
+        with click.open_file(salida, 'wb') as archivo:
+            for datos in comprimir_gzip(bloques):
+                archivo.write(datos)
+    else:
+        with click.open_file(salida, 'w', encoding='utf-8') as archivo:
+            for bloque in bloques:
+                archivo.write(bloque)
+
+@app.cli.command('instantanea-stock')
+@click.option('--conservar', type=int, help='Borra las instantáneas con más de estos días.')
+def instantanea_stock_comando(conservar):
+    """Guarda el stock actual de todos los productos (programar a diario con cron)."""
+    conn = get_db()
+    with transaccion(conn):
+        cursor = conn.cursor()
+        instantanea_id = tomar_instantanea_stock(cursor)
+        borradas = 0
+        if conservar:
+            cursor.execute("SELECT id FROM instantaneas_stock WHERE fecha < datetime('now', ?) AND id != ?",
+                           (f'-{conservar} days', instantanea_id))
+            viejas = [fila[0] for fila in cursor.fetchall()]
+            cursor.executemany('DELETE FROM instantaneas_stock_detalle WHERE instantanea_id = ?', [(i,) for i in viejas])
+            cursor.executemany('DELETE FROM instantaneas_stock WHERE id = ?', [(i,) for i in viejas])
+            borradas = len(viejas)
+    click.echo(f'Instantánea {instantanea_id} guardada' + (f', {borradas} antiguas borradas' if borradas else ''))
+
+@app.cli.command('refrescar-reportes')
+def refrescar_reportes_comando():
+    """Refresca la base de reportes (REPORTES_COPIA) con una instantánea de la base principal."""
+    if not base_reportes.activa():
+        raise click.ClickException('REPORTES_COPIA no está configurada')
+    inicio = time.perf_counter()
+    base_reportes.refrescar()
+    click.echo(f'Base de reportes {base_reportes.ruta} refrescada en {time.perf_counter() - inicio:.2f} s')
+
+def _validar_mes(ctx, param, valor):
+    if valor is None:
+        return valor
+    try:
+        return datetime.strptime(valor, '%Y-%m').strftime('%Y-%m')
+    except ValueError:
+        raise click.BadParameter('use el formato AAAA-MM')
+
+@app.cli.command('archivar-ventas')
+@click.option('--meses', default=ARCHIVO_MESES, show_default=True,
+              help='Meses cerrados que se mantienen en la base principal.')
+@click.option('--hasta', callback=_validar_mes, help='Último mes a archivar (AAAA-MM); reemplaza a --meses.')
+def archivar_ventas_comando(meses, hasta):
+    """Mueve las ventas de los meses cerrados antiguos a archivos por mes."""
+    if hasta is None:
+        hoy = datetime.now()
+        anio, mes = divmod(hoy.year * 12 + hoy.month - 1 - meses - 1, 12)
+        hasta = f'{anio:04d}-{mes + 1:02d}'
+    conn = get_db()
+    inicio = time.perf_counter()
+    try:
+        archivados = archivar_ventas(conn, hasta)
+    except ArchivoError as e:
+        raise click.ClickException(str(e))
+    for mes, ventas, lineas, total in archivados:
+        click.echo(f'{mes}  {ventas:>8} ventas  {lineas:>8} líneas  S/ {total:>14,.2f}')
+    click.echo(f'{len(archivados)} meses archivados hasta {hasta} en {time.perf_counter() - inicio:.1f} s')
+
+@app.cli.command('archivos-ventas')
+def archivos_ventas_comando():
+    """Lista los meses de ventas archivados."""
+    conn = get_db()
+    filas = conn.execute('SELECT * FROM archivos_ventas ORDER BY mes').fetchall()
+    for fila in filas:
+        ruta = ruta_archivo(fila['archivo'])
+        tamano = f'{os.path.getsize(ruta) / 1048576:.1f} MB' if os.path.exists(ruta) else 'NO ENCONTRADO'
+        click.echo(f'{fila["mes"]}  {fila["ventas"]:>8} ventas  {fila["lineas"]:>8} líneas  '
+                   f'S/ {fila["total"]:>14,.2f}  {tamano:>13}  {fila["fecha_archivo"]}')
+    click.echo(f'{len(filas)} meses archivados en {os.path.dirname(ruta_archivo("x"))}')
+
+@app.cli.command('verificar-archivos')
+@click.argument('mes', required=False, callback=_validar_mes)
+def verificar_archivos_comando(mes):
+    """Comprueba la integridad y los totales de los archivos de ventas."""
+    conn = get_db()
+    meses = [mes] if mes else meses_archivados(conn.cursor())
+    con_problemas = 0
+    for mes in meses:
+        problemas = verificar_archivo(conn, mes)
+        click.echo(f'{mes}: ' + ('ok' if not problemas else '; '.join(problemas)))
+        con_problemas += bool(problemas)
+    click.echo(f'{len(meses)} archivos revisados, {con_problemas} con problemas')
+    if con_problemas:
+        raise SystemExit(1)
+
+@app.cli.command('rehidratar-ventas')
+@click.argument('mes', callback=_validar_mes)
+def rehidratar_ventas_comando(mes):
+    """Devuelve a la base principal las ventas archivadas de un mes."""
+    try:
+        ventas, lineas, _ = rehidratar_mes(get_db(), mes)
+    except (ArchivoError, sqlite3.IntegrityError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f'{mes}: {ventas} ventas y {lineas} líneas restauradas')
+
+@app.cli.command('migrar')
+@click.option('--estado', is_flag=True, help='Solo muestra la versión actual del esquema.')
+def migrar_comando(estado):
+    """Aplica las migraciones pendientes del esquema de base de datos."""
+    conn = get_db()
+    version = version_esquema(conn)
+    if estado:
+        click.echo(f'Esquema en versión {version} de {len(MIGRACIONES)}')
+        return
+    aplicadas = migrar(conn)
+    if aplicadas:
+        click.echo(f'Migraciones aplicadas: {", ".join(map(str, aplicadas))}')
+    click.echo(f'Esquema en versión {version_esquema(conn)}')
+
+@app.cli.command('generar-datos')
+@click.option('--base', 'ruta_base', type=click.Path(dir_okay=False),
+              help='Base de destino (se crea y migra si no existe). Por defecto la configurada en DATABASE.')
+@click.option('--categorias', default=0, show_default=True, help='Categorías adicionales.')
+@click.option('--productos', default=10000, show_default=True)
+@click.option('--clientes', default=50000, show_default=True)
+@click.option('--usuarios', default=20, show_default=True, help='Asesores adicionales (clave asesor123).')
+@click.option('--ventas', default=1000000, show_default=True, help='Ventas, cada una con 1 a 4 líneas de detalle.')
+@click.option('--dias', default=730, show_default=True, help='Días hacia atrás que abarcan las ventas.')
+@click.option('--semilla', default=42, show_default=True, help='Semilla: la misma semilla genera los mismos datos.')
+@click.option('--si', is_flag=True, help='No pide confirmación.')
+def generar_datos_comando(ruta_base, categorias, productos, clientes, usuarios, ventas, dias, semilla, si):
+    """Carga datos sintéticos a escala para pruebas de rendimiento."""
+    ruta = ruta_base or DATABASE
+    if not si:
+        click.confirm(f'Se agregarán {ventas} ventas sintéticas a {ruta}. ¿Continuar?', abort=True)
+    inicio = time.perf_counter()
+    with usar_base_datos(ruta), app.app_context():
+        init_db()
+        try:
+            totales = generar_datos(get_db(), categorias=categorias, productos=productos, clientes=clientes,
+                                    usuarios=usuarios, ventas=ventas, dias=dias, semilla=semilla)
+        except ArchivoError as e:
+            raise click.ClickException(str(e))
+    for tabla, cantidad in totales.items():
+        click.echo(f'{tabla:<16}{cantidad:>12}')
+    click.echo(f'Carga completa en {time.perf_counter() - inicio:.1f} s')
+
+@app.cli.command('verificar-planes')
+@click.option('--productos', default=20000, show_default=True, help='Productos sintéticos a cargar.')
+@click.option('--clientes', default=20000, show_default=True, help='Clientes sintéticos a cargar.')
+@click.option('--ventas', default=100000, show_default=True, help='Ventas sintéticas a cargar.')
+@click.option('--detalle', is_flag=True, help='Muestra el plan de todas las consultas, no solo las que fallan.')
+def verificar_planes_comando(productos, clientes, ventas, detalle):
+    """Revisa con EXPLAIN QUERY PLAN las consultas de todas las vistas.
+
+    Crea una base temporal poblada con datos sintéticos, recorre las vistas
+    y termina con código 1 si alguna consulta recorre completa una tabla
+    que crece con el uso o la ordena en un B-tree temporal.
+    """
+    with tempfile.TemporaryDirectory() as directorio:
+        resultados = verificar_planes(os.path.join(directorio, 'planes.db'), productos, clientes, ventas)
+    
+    fallidas = [r for r in resultados if r['problemas']]
+    for resultado in resultados:
+        if resultado['problemas'] or detalle:
+            click.echo(f"\n[{'FALLA' if resultado['problemas'] else 'OK'}] {resultado['ruta']}")
+            click.echo(f"  {resultado['sql']}")
+            for linea in resultado['plan']:
+                click.echo(f'    {linea}')
+            for problema in resultado['problemas']:
+                click.echo(f'  -> {problema}')
+    click.echo(f'\n{len(resultados)} consultas revisadas, {len(fallidas)} con problemas')
+    if fallidas:
+        raise SystemExit(1)
+
+@app.cli.command('medir-rutas')
+@click.option('--base', 'ruta_base', type=click.Path(exists=True, dir_okay=False),
+              help='Base existente a medir (se registran ventas en ella). Por defecto se crea una temporal.')
+@click.option('--productos', default=10000, show_default=True, help='Productos sintéticos de la base temporal.')
+@click.option('--clientes', default=10000, show_default=True, help='Clientes sintéticos de la base temporal.')
+@click.option('--ventas', default=100000, show_default=True, help='Ventas sintéticas de la base temporal.')
+@click.option('--peticiones', default=200, show_default=True, help='Peticiones por ruta.')
+@click.option('--concurrencia', default=4, show_default=True, help='Usuarios simultáneos por ruta.')
+@click.option('--servidor', is_flag=True, help='Usa un servidor HTTP real con hilos en lugar del cliente de pruebas.')
+@click.option('--salida', type=click.Path(dir_okay=False), help='Guarda los resultados en este archivo JSON.')
+@click.option('--comparar', type=click.Path(exists=True, dir_okay=False), help='JSON de una ejecución anterior (línea base).')
+@click.option('--tolerancia', default=20.0, show_default=True, help='Aumento porcentual de p95 admitido frente a la línea base.')
+def medir_rutas_comando(ruta_base, productos, clientes, ventas, peticiones, concurrencia, servidor, salida, comparar, tolerancia):
+    """Mide throughput, latencia y consultas por petición de las rutas principales.
+
+    Simula cajeros y administradores concurrentes. Con --comparar termina
+    con código 1 si el p95 de alguna ruta empeora más que la tolerancia.
+    """
+    with tempfile.TemporaryDirectory() as directorio:
+        if ruta_base:
+            ruta = ruta_base
+        else:
+            ruta = os.path.join(directorio, 'carga.db')
+            click.echo(f'Generando base temporal ({productos} productos, {clientes} clientes, {ventas} ventas)...')
+            with usar_base_datos(ruta), app.app_context():
+                init_db()
+                generar_datos(get_db(), productos=productos, clientes=clientes, ventas=ventas)
+        resultados = medir_rutas(ruta, peticiones, concurrencia, servidor)
+    
+    informe = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'configuracion': {'base': ruta_base, 'productos': productos, 'clientes': clientes, 'ventas': ventas,
+                          'peticiones': peticiones, 'concurrencia': concurrencia, 'servidor': servidor},
+        'rutas': resultados,
+    }
+    linea_base = {}
+    if comparar:
+        with open(comparar, encoding='utf-8') as archivo:
+            linea_base = json.load(archivo)['rutas']
+    
+    click.echo(f"\n{'ruta':<24}{'pet/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'consultas':>11}{'errores':>9}")
+    regresiones = []
+    sin_medicion = []
+    for nombre, r in resultados.items():
+        linea = (f"{nombre:<24}{r['peticiones_por_segundo']:>9}{r['p50_ms']:>9}{r['p95_ms']:>9}"
+                 f"{r['p99_ms']:>9}{r['consultas_por_peticion']:>11}{r['errores']:>9}")
+        anterior = linea_base.get(nombre)
+        if not r['peticiones']:
+            # Sin peticiones completadas no hay latencia que comparar: es una falla
+            linea += '   sin peticiones completadas'
+            sin_medicion.append(nombre)
+        elif anterior and anterior['p95_ms']:
+            cambio = (r['p95_ms'] - anterior['p95_ms']) / anterior['p95_ms'] * 100
+            linea += f'   p95 {cambio:+.0f}%'
+            if cambio > tolerancia:
+                regresiones.append(nombre)
+        click.echo(linea)
+    
+    if salida:
+        with open(salida, 'w', encoding='utf-8') as archivo:
+            json.dump(informe, archivo, indent=2, ensure_ascii=False)
+        click.echo(f'\nResultados guardados en {salida}')
+    if sin_medicion:
+        click.echo(f"\nSin peticiones completadas en: {', '.join(sin_medicion)}")
+    if regresiones:
+        click.echo(f"\nRegresión de p95 en: {', '.join(regresiones)}")
+    if sin_medicion or regresiones:
+        raise SystemExit(1)
+
+# Cada proceso verifica el esquema una sola vez, antes de su primera petición
+_esquema_verificado = False
+
+@app.before_request
+def verificar_esquema():
+    global _esquema_verificado
+    if not _esquema_verificado:
+        init_db()
+        _esquema_verificado = True
+
+if __name__ == '__main__':
+    with app.app_context():
+        init_db()
+    app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,13 @@
+"""Pruebas de los planes de consulta sobre una base sintética pequeña
+
+Se ejecutan desde la carpeta del proyecto con `python -m pytest`.
+"""
+import app as tienda
+
+
+def test_verificar_planes_sin_problemas(tmp_path):
+    resultados = tienda.verificar_planes(str(tmp_path / 'planes.db'), productos=300, clientes=300, ventas=3000)
+
+    assert resultados
+    problemas = [(r['ruta'], r['sql'], r['problemas']) for r in resultados if r['problemas']]
+    assert problemas == []